@@ -0,0 +1,135 @@
+"""
+De-duplication of the stylesheets and embedded images of rendered label cells.
+
+Every rendered label carries the template's own <style> block and often the same
+images embedded as data URIs. Instead of repeating them in every cell of the document,
+identical style blocks are moved to the document head once (except the ones scoped to
+inline SVG images) and large data URIs are replaced by short references which are
+resolved by the url_fetcher during rendering.
+"""
+
+import base64
+import hashlib
+import re
+import threading
+from urllib.parse import unquote, unquote_to_bytes
+
+
+# URL scheme of the references replacing hoisted data URIs
+ASSET_URL_SCHEME = "adv-sheet-asset"
+
+# style blocks and the boundaries of inline SVG images, whose style blocks are scoped to the image
+_STYLE_RE = re.compile(
+    r"(?P<style><style\b[^>]*>.*?</style\s*>)|(?P<svg_open><svg\b)|(?P<svg_close></svg\s*>)", re.S | re.I
+)
+# data URIs up to their enclosing quotes or url() delimiter, as percent-encoded (e.g. SVG)
+# data URIs may contain parentheses and the other kind of quote
+_DATA_URI_RE = re.compile(
+    r"\"(?P<double>data:[^\",]*,[^\"]*)\"|'(?P<single>data:[^',]*,[^']*)'"
+    r"|url\(\s*(?P<bare>data:[^\"'\s),]*,[^\"'\s)]*)\s*\)"
+)
+
+
+def _content_hash(content: str) -> str:
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def decode_data_uri(uri: str) -> tuple[bytes, str]:
+    """
+    Decodes a data URI to its content and mime type.
+    """
+    header, _, data = uri[len("data:"):].partition(",")
+    params = header.split(";")
+    mime_type = params[0] or "text/plain"
+    if "base64" in params[1:]:
+        return base64.b64decode(unquote(data)), mime_type
+    return unquote_to_bytes(data), mime_type
+
+
+class AssetTable:
+    """
+    Collects the style blocks and data URIs of all label cells of a print job.
+    """
+
+    def __init__(self, min_data_uri_length: int = 256):
+        """
+        Arguments:
+            min_data_uri_length: data URIs shorter than this are left in place,
+                as replacing them would not make the document any smaller.
+        """
+        self.min_data_uri_length = min_data_uri_length
+        # content hash -> content, in order of first appearance
+        self.styles: dict[str, str] = {}
+        self.data_uris: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _replace_data_uri(self, match: re.Match) -> str:
+        uri = match.group(match.lastgroup)
+        if len(uri) < self.min_data_uri_length:
+            return match.group(0)
+        key = _content_hash(uri)
+        with self._lock:
+            self.data_uris.setdefault(key, uri)
+        # keep the delimiters around the URI
+        start, end = match.start(match.lastgroup) - match.start(), match.end(match.lastgroup) - match.start()
+        return f"{match.group(0)[:start]}{ASSET_URL_SCHEME}:{key}{match.group(0)[end:]}"
+
+    def _remove_styles(self, html: str) -> str:
+        """
+        Removes the top level style blocks, leaving the ones inside inline SVG images in place.
+        """
+        parts = []
+        svg_depth = 0
+        position = 0
+        for match in _STYLE_RE.finditer(html):
+            if match.group("svg_open") is not None:
+                svg_depth += 1
+            elif match.group("svg_close") is not None:
+                svg_depth = max(svg_depth - 1, 0)
+            elif svg_depth == 0:
+                style = match.group("style")
+                with self._lock:
+                    self.styles.setdefault(_content_hash(style), style)
+                parts.append(html[position:match.start()])
+                position = match.end()
+        parts.append(html[position:])
+        return "".join(parts)
+
+    def hoist(self, html: str) -> str:
+        """
+        Removes the style blocks (except the ones of inline SVG images) and large data URIs
+        from the HTML of a rendered cell, storing them in this table, and returns the remaining HTML.
+        """
+        html = _DATA_URI_RE.sub(self._replace_data_uri, html)
+        return self._remove_styles(html)
+
+    def clear(self) -> None:
+        """
+        Drops all collected styles and data URIs. The dictionaries are cleared in place,
+        as they may be shared with the render options.
+        """
+        with self._lock:
+            self.styles.clear()
+            self.data_uris.clear()
+
+    def head_styles(self) -> list[str]:
+        """
+        Returns all distinct style blocks to be inserted into the document head once.
+        """
+        return list(self.styles.values())
+
+
+def make_url_fetcher(data_uris: dict[str, str], fallback):
+    """
+    Returns a WeasyPrint url_fetcher resolving references to hoisted data URIs
+    and passing all other URLs on to the fallback fetcher.
+    """
+    prefix = ASSET_URL_SCHEME + ":"
+
+    def url_fetcher(url: str, *args, **kwargs) -> dict:
+        if url.startswith(prefix) and (uri := data_uris.get(url[len(prefix):])) is not None:
+            content, mime_type = decode_data_uri(uri)
+            return {"string": content, "mime_type": mime_type, "redirected_url": url}
+        return fallback(url, *args, **kwargs)
+
+    return url_fetcher
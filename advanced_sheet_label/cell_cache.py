@@ -0,0 +1,210 @@
+"""
+Persistent cache of rendered label cells, shared between print jobs.
+
+The key of a cell identifies the template version (primary key and a hash of the
+template file and metadata) and the item version (model, primary key and a version
+marker), so changes to either automatically lead to a cache miss.
+"""
+
+import abc
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+from django.core.cache import caches
+
+from .disk_cache import atomic_write, evict
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+
+class CellStore(abc.ABC):
+    """
+    Base class of the rendered cell stores, counting hits and misses.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    @abc.abstractmethod
+    def get(self, template_pk: int, key: str) -> str | None:
+        """
+        Returns the cell stored under the key, None if there is none.
+        """
+
+    @abc.abstractmethod
+    def put(self, template_pk: int, key: str, html: str) -> None:
+        """
+        Stores the HTML of a cell rendered with the specified template under the key.
+        """
+
+    @abc.abstractmethod
+    def invalidate_template(self, template_pk: int) -> None:
+        """
+        Removes all cells rendered with the specified template.
+        """
+
+
+class DiskCellStore(CellStore):
+    """
+    Stores rendered cells as files in a directory per template in the cache directory
+    of the plugin, which is shared by all processes. When the total size exceeds the
+    limit, the least recently used cells (by modification time, which is updated on
+    every hit) are removed.
+    """
+
+    # number of puts between checks of the total size
+    EVICTION_INTERVAL = 64
+
+    def __init__(self, directory: str, max_bytes: int):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._puts = 0
+
+    def _path(self, template_pk: int, key: str) -> str:
+        return os.path.join(self.directory, str(template_pk), hashlib.sha256(key.encode()).hexdigest() + ".html")
+
+    def get(self, template_pk: int, key: str) -> str | None:
+        path = self._path(template_pk, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                html = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            self._count(False)
+            return None
+        self._count(True)
+        return html
+
+    def put(self, template_pk: int, key: str, html: str) -> None:
+        try:
+            with atomic_write(self._path(template_pk, key), "w") as f:
+                f.write(html)
+        except OSError as exc:
+            _log.warning(f"Could not store rendered cell: {exc}")
+            return
+
+        with self._stats_lock:
+            self._puts += 1
+            check = self._puts % self.EVICTION_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used cells until the total size is within the limit.
+        """
+        removed = evict(self.directory, self.max_bytes)
+        with self._stats_lock:
+            self.evictions += removed
+
+    def invalidate_template(self, template_pk: int) -> None:
+        shutil.rmtree(os.path.join(self.directory, str(template_pk)), ignore_errors=True)
+
+
+class DjangoCellStore(CellStore):
+    """
+    Stores rendered cells in a Django cache. Eviction is left to the cache backend,
+    so its size limit is configured in the CACHES setting of InvenTree.
+    Invalidating a template increments its generation, which is part of every key.
+    """
+
+    KEY_PREFIX = "adv-sheet-label:cell"
+
+    def __init__(self, alias: str = "default", timeout: int | None = None):
+        super().__init__()
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def _cache(self):
+        return caches[self.alias]
+
+    def _generation(self, template_pk: int) -> int:
+        return self._cache.get_or_set(f"{self.KEY_PREFIX}:{template_pk}:generation", 0, None)
+
+    def _key(self, template_pk: int, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f"{self.KEY_PREFIX}:{template_pk}:{self._generation(template_pk)}:{digest}"
+
+    def get(self, template_pk: int, key: str) -> str | None:
+        html = self._cache.get(self._key(template_pk, key))
+        self._count(html is not None)
+        return html
+
+    def put(self, template_pk: int, key: str, html: str) -> None:
+        self._cache.set(self._key(template_pk, key), html, self.timeout)
+
+    def invalidate_template(self, template_pk: int) -> None:
+        generation_key = f"{self.KEY_PREFIX}:{template_pk}:generation"
+        self._cache.get_or_set(generation_key, 0, None)
+        try:
+            self._cache.incr(generation_key)
+        except ValueError:
+            self._cache.set(generation_key, int(time.time()), None)
+
+
+def template_fingerprint(label) -> str:
+    """
+    Returns a hash of everything of a label template which influences the rendered cells.
+    """
+    digest = hashlib.sha256()
+    # the template file field is called "label" in 0.15.x and "template" in 0.16.x
+    template_file = getattr(label, "template", None) or getattr(label, "label", None)
+    if template_file:
+        try:
+            template_file.open("rb")
+            try:
+                digest.update(template_file.read())
+            finally:
+                template_file.close()
+        except (OSError, ValueError):
+            digest.update(str(template_file.name).encode())
+    digest.update(repr(label.metadata).encode())
+    digest.update(f"{label.width}x{label.height}".encode())
+    return digest.hexdigest()
+
+
+def item_version(item) -> str:
+    """
+    Returns a marker which changes whenever the item changes: the "updated"
+    timestamp if the model has one, otherwise a hash of the field values.
+    """
+    updated = getattr(item, "updated", None)
+    if updated is not None:
+        return str(updated)
+
+    # only the concrete fields, as related objects would have to be queried
+    values = [(field.attname, getattr(item, field.attname)) for field in item._meta.concrete_fields]
+    return hashlib.sha256(repr(values).encode()).hexdigest()
+
+
+def cell_key(template_pk: int, template_hash: str, item) -> str:
+    """
+    Returns the cache key of the cell rendered for an item with a template version.
+    """
+    return f"{template_pk}:{template_hash}:{item._meta.label}:{item.pk}:{item_version(item)}"
@@ -0,0 +1,96 @@
+"""
+Helpers for the caches storing files on disk (rendered cells, job results and fetched
+resources), which share one directory between all processes of the InvenTree server.
+
+Files are written atomically, so concurrent readers in other processes never see
+partial files, and evicted by their modification time.
+"""
+
+import contextlib
+import os
+import stat
+import threading
+import time
+
+
+# temporary files older than this (seconds) were left behind by crashed writers
+STALE_TMP_SECONDS = 3600
+
+
+def private_directory(path: str) -> str:
+    """
+    Creates a directory only accessible by the user of this process (mode 0700) if it
+    doesn't exist yet, and checks that it is a real directory (not a symlink) owned by
+    this user and not accessible by others, so other local users can neither read the
+    cached labels and PDFs nor plant entries. Raises an OSError otherwise.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)   # doesn't follow symlinks
+    if not stat.S_ISDIR(info.st_mode):
+        raise NotADirectoryError(f"{path} is not a directory")
+    # there are no owners and modes to check on Windows
+    if hasattr(os, "getuid"):
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"{path} is not owned by the user of the server process")
+        if info.st_mode & 0o077:
+            raise PermissionError(f"{path} is accessible by other users (mode {info.st_mode & 0o777:o}, not 700)")
+    return path
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "wb"):
+    """
+    Opens a temporary file next to path for writing, which replaces path once the
+    block has completed, so concurrent readers never see partial files.
+    """
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=None if "b" in mode else "utf-8") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def evict(directory: str, max_bytes: int, ttl: float | None = None) -> int:
+    """
+    Removes the files in directory (and its subdirectories) which were modified more than
+    ttl seconds ago, then the least recently modified files until their total size is
+    within max_bytes. Returns the number of files removed because of the size limit.
+    """
+    entries = []
+    total = 0
+    now = time.time()
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                info = os.stat(path)
+                if name.endswith(".tmp"):
+                    # being written by another process, unless left behind
+                    if info.st_mtime + STALE_TMP_SECONDS < now:
+                        os.remove(path)
+                    continue
+                if ttl is not None and info.st_mtime + ttl < now:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+
+    removed = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
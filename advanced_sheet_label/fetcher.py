@@ -0,0 +1,224 @@
+"""
+Caching url_fetcher for WeasyPrint.
+
+Label templates usually reference the same images, logos and fonts in every label
+and every job. WeasyPrint resolves those again for every document, so the fetched
+resources are cached in process (size bounded LRU with TTL) and optionally on disk.
+"""
+
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+from urllib.parse import urlsplit
+
+from .disk_cache import atomic_write, evict
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+
+@dataclasses.dataclass(frozen=True)
+class FetcherConfig:
+    max_bytes: int                  # size limit of the in-process cache, 0 disables it
+    ttl: float                      # seconds after which cached resources are fetched again
+    disk_dir: str | None = None     # directory of the on-disk cache, None disables it
+    # path prefixes of http(s) URLs which are cached on disk (e.g. media and static files)
+    disk_url_prefixes: tuple[str, ...] = ()
+
+
+class LRUCache:
+    """
+    Thread safe LRU cache bounded by the total size of the cached values,
+    whose entries expire after a time to live.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiry time, size, value)
+        self._entries: OrderedDict[str, tuple[float, int, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Returns the cached value or None if there is no valid entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: str, value, size: int) -> None:
+        if size > self.max_bytes:
+            return      # would evict everything else
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class CachingURLFetcher:
+    """
+    WeasyPrint url_fetcher caching the resources fetched by another fetcher.
+    """
+
+    # number of disk cache writes between removing expired and the oldest entries
+    DISK_EVICTION_INTERVAL = 64
+
+    def __init__(self, config: FetcherConfig, fallback: Callable[..., dict]):
+        """
+        Arguments:
+            config: cache configuration
+            fallback: fetcher used to actually fetch resources, usually weasyprint.default_url_fetcher
+        """
+        self.config = config
+        self._fallback = fallback
+        self._memory = LRUCache(config.max_bytes, config.ttl)
+        self.disk_hits = 0
+        self._disk_writes = 0
+
+    @property
+    def hits(self) -> int:
+        return self._memory.hits + self.disk_hits
+
+    @property
+    def misses(self) -> int:
+        return self._memory.misses - self.disk_hits
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "cached_bytes": self._memory.size,
+        }
+
+    def _is_cacheable(self, url: str) -> bool:
+        return urlsplit(url).scheme in ("file", "http", "https")
+
+    def _uses_disk(self, url: str) -> bool:
+        if self.config.disk_dir is None:
+            return False
+        parts = urlsplit(url)
+        return parts.scheme in ("http", "https") and parts.path.startswith(self.config.disk_url_prefixes)
+
+    def _disk_path(self, url: str) -> str:
+        return os.path.join(self.config.disk_dir, hashlib.sha256(url.encode()).hexdigest())
+
+    def _read_disk(self, url: str) -> dict | None:
+        path = self._disk_path(url)
+        try:
+            if os.path.getmtime(path) + self.config.ttl < time.time():
+                return None
+            with open(path + ".json", "r") as f:
+                result = json.load(f)
+            with open(path, "rb") as f:
+                result["string"] = f.read()
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, url: str, result: dict) -> None:
+        path = self._disk_path(url)
+        try:
+            meta = {key: value for key, value in result.items() if key != "string"}
+            # the metadata is written first, as the entry is only valid once the contents exist
+            with atomic_write(path + ".json", "w") as f:
+                json.dump(meta, f)
+            with atomic_write(path) as f:
+                f.write(result["string"])
+        except OSError as exc:
+            _log.warning(f"Could not write fetch cache entry for {url}: {exc}")
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % self.DISK_EVICTION_INTERVAL == 0:
+            # the disk cache is bounded like the in-process cache
+            evict(self.config.disk_dir, self.config.max_bytes, self.config.ttl)
+
+    def _fetch(self, url: str, *args, **kwargs) -> dict:
+        """
+        Fetches a resource with the fallback fetcher, reading it completely into memory.
+        """
+        result = dict(self._fallback(url, *args, **kwargs))
+        if "file_obj" in result:
+            file_obj = result.pop("file_obj")
+            try:
+                result["string"] = file_obj.read()
+            finally:
+                file_obj.close()
+        if isinstance(result.get("string"), str):
+            result["string"] = result["string"].encode(result.get("encoding") or "utf-8")
+            result["encoding"] = result.get("encoding") or "utf-8"
+        return result
+
+    def __call__(self, url: str, *args, **kwargs) -> dict:
+        if not self._is_cacheable(url):
+            return self._fallback(url, *args, **kwargs)
+
+        if (result := self._memory.get(url)) is not None:
+            return dict(result)
+
+        result = None
+        if self._uses_disk(url) and (result := self._read_disk(url)) is not None:
+            self.disk_hits += 1
+        if result is None:
+            result = self._fetch(url, *args, **kwargs)
+            if self._uses_disk(url):
+                self._write_disk(url, result)
+
+        self._memory.put(url, result, len(result["string"]))
+        return dict(result)
+
+
+_fetcher: CachingURLFetcher | None = None
+_fetcher_lock = threading.Lock()
+
+
+def get_caching_fetcher(config: FetcherConfig, fallback: Callable[..., dict]) -> CachingURLFetcher:
+    """
+    Returns the caching fetcher of this process, which is shared by all jobs so
+    resources stay cached between them. It is re-created if the configuration changes.
+    """
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None or _fetcher.config != config:
+            _fetcher = CachingURLFetcher(config, fallback)
+        return _fetcher
+
+
+def get_fetcher_stats() -> dict | None:
+    """
+    Returns the hit/miss statistics of the caching fetcher of this process, if it exists.
+    """
+    if _fetcher is None:
+        return None
+    return _fetcher.stats()
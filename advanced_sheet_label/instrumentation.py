@@ -0,0 +1,242 @@
+"""
+Timing and profiling instrumentation of print jobs.
+
+This module must not depend on Django, as the timings are also collected by
+the PDF conversion in the worker processes of the parallel engine.
+"""
+
+import collections
+import contextlib
+import cProfile
+import heapq
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+# phases of a print job in execution order, used to order the summary
+PHASES = ("layout", "job_cache", "prefetch", "cells", "html", "render", "write_pdf", "compose")
+
+
+class JobTimings:
+    """
+    Collects the duration and counters (e.g. pages, cells, bytes) of the phases of a
+    print job, as well as the slowest rendered label templates.
+
+    Durations of the same phase are accumulated, so a phase can be recorded in parts,
+    e.g. once per chunk or label. The "cells" phase is the sum of the render times of
+    all labels, which can exceed the wall time if they are rendered on multiple threads.
+    """
+
+    def __init__(self, slowest_items: int = 5):
+        self.phases: dict[str, dict] = {}
+        self.slowest_items = slowest_items
+        self._slowest: list[tuple[float, str]] = []     # min heap of (seconds, item)
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.total_seconds: float | None = None
+
+    def add(self, name: str, seconds: float, **counts) -> None:
+        """
+        Adds a duration and counters to a phase.
+        """
+        with self._lock:
+            phase = self.phases.setdefault(name, {"seconds": 0.0})
+            phase["seconds"] += seconds
+            for key, value in counts.items():
+                phase[key] = phase.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **counts):
+        """
+        Context manager adding its duration to a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, **counts)
+
+    def seconds(self, name: str) -> float:
+        return self.phases.get(name, {}).get("seconds", 0.0)
+
+    def record_item(self, item, seconds: float) -> None:
+        """
+        Records the render time of a label template for an item in the "cells" phase.
+        """
+        self.add("cells", seconds, rendered=1)
+        entry = (seconds, describe_item(item))
+        with self._lock:
+            if len(self._slowest) < self.slowest_items:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def timed_items(self, render_func: Callable[[Any], str]) -> Callable[[Any], str]:
+        """
+        Wraps a function rendering the label template for an item, recording its render times.
+        """
+        def render(item) -> str:
+            start = time.perf_counter()
+            try:
+                return render_func(item)
+            finally:
+                self.record_item(item, time.perf_counter() - start)
+
+        return render
+
+    def merge(self, phases: dict[str, dict]) -> None:
+        """
+        Adds the phases recorded by another instance, e.g. in a worker process.
+        """
+        for name, phase in phases.items():
+            counts = {key: value for key, value in phase.items() if key != "seconds"}
+            self.add(name, phase["seconds"], **counts)
+
+    def finish(self) -> None:
+        self.total_seconds = time.perf_counter() - self._start
+
+    def as_dict(self) -> dict:
+        """
+        Returns the timings as JSON serializable data (durations in milliseconds).
+        """
+        ordered = sorted(self.phases, key=lambda name: PHASES.index(name) if name in PHASES else len(PHASES))
+        return {
+            "total_ms": None if self.total_seconds is None else round(self.total_seconds * 1000, 1),
+            "phases": {
+                name: {"ms": round(self.phases[name]["seconds"] * 1000, 1)} | {
+                    key: value for key, value in self.phases[name].items() if key != "seconds"
+                }
+                for name in ordered
+            },
+            "slowest_items": [
+                {"item": item, "ms": round(seconds * 1000, 1)}
+                for seconds, item in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    def summary(self) -> str:
+        """
+        Returns a single line summary for the log.
+        """
+        data = self.as_dict()
+        parts = []
+        for name, phase in data["phases"].items():
+            counts = ", ".join(f"{key}={value}" for key, value in phase.items() if key != "ms")
+            parts.append(f"{name} {phase['ms']} ms" + (f" ({counts})" if counts else ""))
+        slowest = ", ".join(f"{entry['item']} {entry['ms']} ms" for entry in data["slowest_items"])
+        return f"total {data['total_ms']} ms: " + "; ".join(parts) + (f"; slowest labels: {slowest}" if slowest else "")
+
+
+class JobHistory:
+    """
+    Timings of the most recent jobs rendered in this process, used to estimate the
+    duration of a job before it is printed. A job is modelled as the rendering of its
+    distinct labels (the "cells" phase) plus the assembly, layout and output of its pages.
+    """
+
+    def __init__(self, size: int = 50):
+        # (key, pages, rendered labels, seconds per label, seconds per page)
+        self._jobs: collections.deque[tuple[Any, int, int, float, float]] = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, key, timings: JobTimings, pages: int) -> None:
+        """
+        Records the timings of a finished job under a key, e.g. the template and render engine.
+        """
+        if timings.total_seconds is None or pages <= 0:
+            return
+        rendered = timings.phases.get("cells", {}).get("rendered", 0)
+        cells_seconds = timings.seconds("cells")
+        # labels rendered on multiple threads overlap, so their sum can exceed the total
+        page_seconds = max(timings.total_seconds - cells_seconds, 0.0) / pages
+        with self._lock:
+            self._jobs.append((key, pages, rendered, cells_seconds / rendered if rendered else 0.0, page_seconds))
+
+    def estimate(self, key, pages: int, labels: int) -> dict | None:
+        """
+        Estimates the duration of a job with the given number of pages and distinct labels,
+        from the recent jobs with the same key or all recent jobs if there are none.
+        Returns None if no job has been recorded yet.
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs if job[0] == key]
+            same_key = len(jobs) > 0
+            if not same_key:
+                jobs = list(self._jobs)
+        if len(jobs) == 0:
+            return None
+
+        # averages weighted by the size of the jobs, so tiny jobs don't dominate
+        rendered = sum(job[2] for job in jobs)
+        label_seconds = sum(job[2] * job[3] for job in jobs) / rendered if rendered else 0.0
+        page_seconds = sum(job[1] * job[4] for job in jobs) / sum(job[1] for job in jobs)
+        return {
+            "seconds": round(labels * label_seconds + pages * page_seconds, 3),
+            "ms_per_label": round(label_seconds * 1000, 2),
+            "ms_per_page": round(page_seconds * 1000, 2),
+            "based_on_jobs": len(jobs),
+            "exact_match": same_key,     # based on jobs with the same key
+        }
+
+
+def describe_item(item) -> str:
+    """
+    Returns a short description of an item for the timing reports, e.g. "stock.stockitem 12".
+    """
+    meta = getattr(item, "_meta", None)
+    name = meta.label_lower if meta is not None else type(item).__name__
+    return f"{name} {getattr(item, 'pk', id(item))}"
+
+
+@contextlib.contextmanager
+def profile_job(mode: str, directory: str | None, top: int = 25):
+    """
+    Profiles the code executed in the context with cProfile or tracemalloc and writes the
+    result to a file in directory, logging the top entries. Does nothing for any other mode
+    or without a directory.
+
+    The cProfile dump can be inspected with pstats or tools like snakeviz, the tracemalloc
+    dump can be loaded with tracemalloc.Snapshot.load().
+    """
+    if mode not in ("cprofile", "tracemalloc") or directory is None:
+        yield
+        return
+
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    path = os.path.join(directory, f"job-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{mode}")
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+            _log.info(f"Print job profile written to {path}\n{stream.getvalue()}")
+        return
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        snapshot.dump(path)
+        lines = "\n".join(str(stat) for stat in snapshot.statistics("lineno")[:top])
+        _log.info(f"Print job memory profile written to {path}, peak {peak / 1024 / 1024:.1f} MB\n{lines}")
@@ -0,0 +1,104 @@
+"""
+Cache of the PDFs of whole print jobs, so identical jobs submitted again
+(e.g. after a printer jam) are returned without rendering them again.
+
+A job is identified by a fingerprint of the template version, the ordered item
+identities and versions, all printing options and the plugin settings which
+change the output (e.g. the render engine and PDF options).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .cell_cache import item_version, template_fingerprint
+from .disk_cache import atomic_write, evict
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+
+def job_fingerprint(label, items: list, printing_options: dict, output_settings: dict) -> str:
+    """
+    Returns the fingerprint of a print job, which changes whenever the template (its
+    contents or any other field), any item (or their order), any printing option or
+    any of the output_settings (the resolved settings influencing the PDF) changes.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{label.pk}:{template_fingerprint(label)}:{item_version(label)}\n".encode())
+    for item in items:
+        digest.update(f"{item._meta.label}:{item.pk}:{item_version(item)}\n".encode())
+    digest.update(json.dumps(printing_options, sort_keys=True, default=str).encode())
+    digest.update(json.dumps(output_settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class JobResultCache:
+    """
+    Stores the PDFs of recent jobs as files in the cache directory of the plugin, which
+    is shared by all processes, so e.g. a job printed by a background worker is also
+    found when it is resubmitted to the web server. Entries expire after a time to live
+    and the oldest entries are removed when the total size exceeds the limit.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, fingerprint + ".pdf")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def get(self, fingerprint: str) -> bytes | None:
+        """
+        Returns the PDF of a previous job with the same fingerprint, None if there is none.
+        """
+        path = self._path(fingerprint)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "rb") as f:
+                pdf = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return pdf
+
+    def put(self, fingerprint: str, pdf: bytes | str) -> None:
+        """
+        Stores the PDF of a job, either as bytes or the path of a file which is copied.
+        """
+        size = len(pdf) if isinstance(pdf, bytes) else os.path.getsize(pdf)
+        if size > self.max_bytes:
+            return      # would evict everything else
+        try:
+            with atomic_write(self._path(fingerprint)) as f:
+                if isinstance(pdf, bytes):
+                    f.write(pdf)
+                else:
+                    with open(pdf, "rb") as source:
+                        shutil.copyfileobj(source, f)
+        except OSError as exc:
+            _log.warning(f"Could not store job result: {exc}")
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes expired entries and the oldest entries until the total size is within the limit.
+        """
+        evict(self.directory, self.max_bytes, self.ttl)
@@ -7,17 +7,24 @@ www.elektron.work
 List of sheet label paper layouts
 """
 
+import bisect
 import dataclasses
+import functools
+import math
 
 
-@dataclasses.dataclass
+# maximum deviation (mm) between label sizes that are considered to be equal
+SIZE_TOLERANCE = 0.01
+
+
+@dataclasses.dataclass(frozen=True)
 class PaperSize:
     display_name: str   # paper size display name (e.g. "A4")
     width: float        # mm
     height: float       # mm
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class SheetLayout:
     display_name: str
     page_size: PaperSize
@@ -67,15 +74,311 @@ class SheetLayout:
         """
         return self.spacing_left_computed + column * (self.label_width + self.column_spacing)
 
+    def matches_size(self, width: float, height: float) -> bool:
+        """
+        returns whether a label of the specified size (mm) matches the
+        label size of this layout within SIZE_TOLERANCE
+        """
+        return (
+            abs(self.label_width - width) <= SIZE_TOLERANCE
+            and abs(self.label_height - height) <= SIZE_TOLERANCE
+        )
+
     def __str__(self) -> str:
         return f"{self.display_name} ({self.page_size.display_name}, {self.label_width}mm x {self.label_height}mm, {self.columns} columns x {self.rows} rows, {'round corners' if self.corner_radius != 0 else 'sharp corners'})"
 
+
+class CompiledLayout:
+    """
+    Precomputed geometry and markup fragments of a SheetLayout, which are the same
+    for every page of every job using that layout.
+    Use compile_layout() to get the (cached) instance for a layout.
+    """
+
+    __slots__ = (
+        "layout",
+        "spacing_top",
+        "spacing_left",
+        "row_tops",
+        "column_lefts",
+        "cell_open_tags",
+        "flat_cell_open_tags",
+        "_geometry_css",
+        "_stylesheets",
+    )
+
+    # maximum number of debug option combinations to keep stylesheets for
+    MAX_STYLESHEETS = 16
+
+    def __init__(self, layout: SheetLayout):
+        self.layout = layout
+        self.spacing_top = layout.spacing_top_computed
+        self.spacing_left = layout.spacing_left_computed
+        self.row_tops = tuple(layout.row_position_top(row) for row in range(layout.rows))
+        self.column_lefts = tuple(layout.column_position_left(col) for col in range(layout.columns))
+
+        # opening tag of every cell on a page, indexed by cell index
+        self.cell_open_tags = tuple(
+            f"<td class='label-sheet-cell label-sheet-row-{row} label-sheet-col-{col}'>"
+            for row in range(layout.rows)
+            for col in range(layout.columns)
+        )
+        # opening tag of every cell for the flat page markup, positioned by inline offsets
+        self.flat_cell_open_tags = tuple(
+            f"<div class='label-sheet-cell' style='top: {top}mm; left: {left}mm;'>"
+            for top in self.row_tops
+            for left in self.column_lefts
+        )
+
+        # styles positioning the rows and columns
+        self._geometry_css = "\n".join(
+            [
+                f"""
+            .label-sheet-row-{row} {{
+                top: {top}mm;
+            }}
+            """
+                for row, top in enumerate(self.row_tops)
+            ] + [
+                f"""
+            .label-sheet-col-{col} {{
+                left: {left}mm;
+            }}
+            """
+                for col, left in enumerate(self.column_lefts)
+            ]
+        )
+        self._stylesheets: dict[tuple[bool, str, str], str] = {}
+
+    def stylesheet(self, enable_border: bool, fill_color: str, markup: str = "table") -> str:
+        """
+        Returns the CSS for documents using this layout with the provided debug options
+        and page markup ("table" or "flat", see AdvancedLabelSheetPlugin.print_page()).
+        """
+        key = (enable_border, fill_color, markup)
+        if (css := self._stylesheets.get(key)) is not None:
+            return css
+
+        layout = self.layout
+        css = f"""
+                @page {{
+                    size: {layout.page_size.width}mm {layout.page_size.height}mm;
+                    margin: 0mm;
+                    padding: 0mm;
+                }}
+
+                {self._page_css(markup)}
+
+                .label-sheet-cell-error {{
+                    background-color: #F00;
+                }}
+
+                .label-sheet-cell {{
+                    width: {layout.label_width}mm;
+                    height: {layout.label_height}mm;
+                    padding: 0mm;
+                    position: absolute;
+                    {'background-color: ' + fill_color + ';' if fill_color not in ["", "unset"] else ''};
+                    border-radius: {layout.corner_radius}mm;
+                }}
+
+                .label-sheet-cell-overlay {{
+                    border: {'0.25mm solid #000' if enable_border else '0mm'};
+                    border-radius: {layout.corner_radius}mm;
+                    box-sizing: border-box;
+                    width: {layout.label_width}mm;
+                    height: {layout.label_height}mm;
+                    padding: 0mm;
+                    position: absolute;
+                    top: 0px;
+                    left: 0px;
+                }}
+
+                {self._geometry_css if markup == "table" else ""}
+
+                body {{
+                    margin: 0mm !important;
+                }}
+            """
+
+        if len(self._stylesheets) >= self.MAX_STYLESHEETS:
+            self._stylesheets.clear()   # fill colors are free text, so don't grow forever
+        self._stylesheets[key] = css
+        return css
+
+    def _page_css(self, markup: str) -> str:
+        if markup == "flat":
+            # the cells are positioned relative to the page box, which has no height itself
+            return """.label-sheet-page {
+                    page-break-after: always;
+                    position: relative;
+                }"""
+        return f""".label-sheet-table {{
+                    page-break-after: always;
+                    table-layout: fixed;
+                    width: {self.layout.page_size.width}mm;
+                    border-spacing: 0mm 0mm;
+                }}"""
+
+
+@functools.lru_cache(maxsize=None)
+def compile_layout(layout: SheetLayout) -> CompiledLayout:
+    """
+    Returns the compiled geometry of a layout, which is only computed once per layout.
+    """
+    return CompiledLayout(layout)
+
+
+class LayoutRegistry(dict):
+    """
+    Dictionary of layouts which counts modifications in its version attribute,
+    so caches derived from the layouts know when they have to be rebuilt.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def _modified(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._modified()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._modified()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._modified()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._modified()
+
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self._modified()
+        return result
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._modified()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._modified()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._modified()
+
+
+class LayoutIndex:
+    """
+    Index of layouts by label size for finding the layout matching a label template.
+
+    Exact matches (within SIZE_TOLERANCE) are looked up in a hash map of quantized
+    label sizes. The closest contender is found by searching the layouts sorted by label
+    width, starting at the label width and stopping as soon as the width deviation alone
+    exceeds the best cost found so far.
+    """
+
+    def __init__(self, layouts: dict[str, SheetLayout]):
+        self.layouts = list(layouts.values())   # in definition order
+        self._order = {id(layout): idx for idx, layout in enumerate(self.layouts)}
+        # first key of every layout
+        self._keys: dict[SheetLayout, str] = {}
+        for key, layout in layouts.items():
+            self._keys.setdefault(layout, key)
+
+        self._by_size: dict[tuple[int, int], list[SheetLayout]] = {}
+        for layout in self.layouts:
+            self._by_size.setdefault(self._size_key(layout.label_width, layout.label_height), []).append(layout)
+
+        self._by_width = sorted(self.layouts, key=lambda layout: layout.label_width)
+        self._widths = [layout.label_width for layout in self._by_width]
+
+    @staticmethod
+    def _size_key(width: float, height: float) -> tuple[int, int]:
+        return round(width / SIZE_TOLERANCE), round(height / SIZE_TOLERANCE)
+
+    def exact_matches(self, width: float, height: float) -> list[SheetLayout]:
+        """
+        Returns all layouts matching the label size in definition order.
+        """
+        key_w, key_h = self._size_key(width, height)
+        matches = [
+            layout
+            # matches within the tolerance may have been quantized to a neighbouring key
+            for dw in (-1, 0, 1)
+            for dh in (-1, 0, 1)
+            for layout in self._by_size.get((key_w + dw, key_h + dh), ())
+            if layout.matches_size(width, height)
+        ]
+        return sorted(matches, key=lambda layout: self._order[id(layout)])
+
+    def closest_match(self, width: float, height: float) -> SheetLayout:
+        """
+        Returns the layout with the smallest label which can fit a label of
+        the specified size, measured by the geometric distance of the sizes.
+        If there is no layout large enough, the first layout is returned.
+        """
+        best: tuple[float, int, SheetLayout] | None = None
+        for idx in range(bisect.bisect_left(self._widths, width), len(self._by_width)):
+            layout = self._by_width[idx]
+            dw = layout.label_width - width
+            if best is not None and dw > best[0]:
+                break   # all following layouts are wider than the best cost
+            dh = layout.label_height - height
+            if dh < 0:
+                continue    # too small
+            candidate = (math.sqrt(dw**2 + dh**2), self._order[id(layout)], layout)
+            if best is None or candidate[:2] < best[:2]:
+                best = candidate
+
+        if best is None:
+            return self.layouts[0]
+        return best[2]
+
+    def key_of(self, layout: SheetLayout) -> str | None:
+        """
+        Returns the key of a layout in LAYOUTS, None if it isn't registered.
+        """
+        return self._keys.get(layout)
+
+    def find(self, width: float, height: float, prefer_round: bool) -> tuple[SheetLayout, bool]:
+        """
+        Finds the layout for a label of the specified size, preferring round or
+        sharp corners if there are multiple exact matches.
+
+        Returns:
+            layout: best matching sheet label layout
+            exact: whether the result size matches exactly or not
+        """
+        exact_matches = self.exact_matches(width, height)
+        if len(exact_matches) > 0:
+            # find the prefered match
+            for match in exact_matches:
+                if prefer_round == (match.corner_radius > 0):
+                    return match, True
+            # otherwise just return the first one
+            return exact_matches[0], True
+
+        # no exact matches found
+        return self.closest_match(width, height), False
+
 PAPER_SIZES = {
     "A4": PaperSize("A4", 210, 297),
     "142.5x132": PaperSize("Tedi Label Sheet", 132, 142.5)
 }
 
-LAYOUTS = {
+LAYOUTS = LayoutRegistry({
     "4780": SheetLayout(
         display_name="4780",
         page_size=PAPER_SIZES["A4"],
@@ -181,16 +484,93 @@ LAYOUTS = {
     spacing_top=4.5,
     spacing_left=0
     )
-}
+})
 
-LAYOUT_SELECT_OPTIONS = [
+AUTO_LAYOUT_OPTIONS = [
     ("auto_round", "Auto (round) - Automatically detect correct layout for label template according to metadata or size (prefer round-corner labels)"),
     ("auto_sharp", "Auto (sharp) - Automatically detect correct layout for label template according to metadata or size (prefer sharp-corner labels)")
-] + [
-    (
-        code, 
-        str(layout)
-    ) 
-    for code, layout in LAYOUTS.items()
 ]
 
+_layout_select_options: list[tuple[str, str]] | None = None
+_layout_select_options_version: int = -1
+
+
+def get_layout_select_options() -> list[tuple[str, str]]:
+    """
+    Returns the layout selection choices (the auto options followed by all layouts).
+    The list is only built when it is first needed and whenever the layouts change.
+    """
+    global _layout_select_options, _layout_select_options_version
+    if _layout_select_options is None or _layout_select_options_version != LAYOUTS.version:
+        _layout_select_options = AUTO_LAYOUT_OPTIONS + [
+            (
+                code, 
+                str(layout)
+            ) 
+            for code, layout in LAYOUTS.items()
+        ]
+        _layout_select_options_version = LAYOUTS.version
+    return _layout_select_options
+
+
+def __getattr__(name: str):
+    # LAYOUT_SELECT_OPTIONS is built lazily on first access
+    if name == "LAYOUT_SELECT_OPTIONS":
+        return get_layout_select_options()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_layout_index: LayoutIndex | None = None
+_layout_index_version: int = -1
+
+
+def get_layout_index() -> LayoutIndex:
+    """
+    Returns the index of all LAYOUTS, rebuilding it if they have changed.
+    """
+    global _layout_index, _layout_index_version
+    if _layout_index is None or _layout_index_version != LAYOUTS.version:
+        _layout_index = LayoutIndex(LAYOUTS)
+        _layout_index_version = LAYOUTS.version
+        match_layout.cache_clear()
+    return _layout_index
+
+
+@functools.lru_cache(maxsize=1024)
+def match_layout(
+    width: float, height: float, metadata_layout: str | None, prefer_round: bool
+) -> tuple[SheetLayout, bool, bool]:
+    """
+    Finds the best matching layout for a label template of the specified size
+    and "sheet_layout" metadata value (None if not specified).
+    Results are memoized until the layouts change. Use find_layout() instead
+    of calling this directly, so the memo is invalidated correctly.
+
+    Returns: 
+        layout: best matching sheet label layout
+        specified: whether the layout was specified in metadata or looked for via size
+        exact: whether the result size matches exactly or not
+    """
+    if metadata_layout is not None and metadata_layout in LAYOUTS:
+        layout = LAYOUTS[metadata_layout]
+        return layout, True, layout.matches_size(width, height)
+
+    layout, exact = get_layout_index().find(width, height, prefer_round)
+    return layout, False, exact
+
+
+def find_layout(
+    width: float, height: float, metadata_layout: str | None, prefer_round: bool
+) -> tuple[SheetLayout, bool, bool]:
+    """
+    Memoized layout lookup, see match_layout().
+    """
+    get_layout_index()  # invalidates the memo if the layouts have changed
+    return match_layout(width, height, metadata_layout, prefer_round)
+
+
+def get_layout_key(layout: SheetLayout) -> str | None:
+    """
+    Returns the key of a layout in LAYOUTS, None if it isn't registered.
+    """
+    return get_layout_index().key_of(layout)
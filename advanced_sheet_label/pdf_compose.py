@@ -0,0 +1,297 @@
+"""
+Composition of sheet pages from individually rendered labels.
+
+Every distinct label is laid out by WeasyPrint once, either at the label size of the
+layout ("render once, stamp many") or with the template's own page size ("impose").
+Its page is then turned into a PDF form XObject, which is placed at the position of
+every cell showing that label. Repeated labels therefore only exist once in the output PDF.
+
+Requires the optional pypdf package.
+"""
+
+import importlib
+import io
+import logging
+
+from .layouts import SheetLayout, compile_layout
+from .instrumentation import JobTimings
+from .pdf_engine import (
+    PageCountMismatch, RenderOptions, add_indirect_object, get_pypdf, get_weasyprint, get_url_fetcher,
+    render_document, write_pdf, write_pypdf
+)
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+# points per mm
+PT_PER_MM = 72 / 25.4
+# bezier control point distance for approximating quarter circles
+_KAPPA = 0.5522847498
+# width of the debug border (mm), see CompiledLayout.stylesheet()
+BORDER_WIDTH = 0.25
+
+
+def _num(value: float) -> str:
+    return f"{value:.4f}".rstrip("0").rstrip(".")
+
+
+def rounded_rect_path(x: float, y: float, w: float, h: float, r: float) -> str:
+    """
+    Returns PDF path operators for a rectangle with rounded corners (all values in points).
+    """
+    r = max(0.0, min(r, w / 2, h / 2))
+    if r == 0:
+        return f"{_num(x)} {_num(y)} {_num(w)} {_num(h)} re\n"
+    k = r * _KAPPA
+    x1, y1 = x + w, y + h
+    ops = [
+        f"{_num(x + r)} {_num(y)} m",
+        f"{_num(x1 - r)} {_num(y)} l",
+        f"{_num(x1 - r + k)} {_num(y)} {_num(x1)} {_num(y + r - k)} {_num(x1)} {_num(y + r)} c",
+        f"{_num(x1)} {_num(y1 - r)} l",
+        f"{_num(x1)} {_num(y1 - r + k)} {_num(x1 - r + k)} {_num(y1)} {_num(x1 - r)} {_num(y1)} c",
+        f"{_num(x + r)} {_num(y1)} l",
+        f"{_num(x + r - k)} {_num(y1)} {_num(x)} {_num(y1 - r + k)} {_num(x)} {_num(y1 - r)} c",
+        f"{_num(x)} {_num(y + r)} l",
+        f"{_num(x)} {_num(y + r - k)} {_num(x + r - k)} {_num(y)} {_num(x + r)} {_num(y)} c",
+        "h",
+    ]
+    return "\n".join(ops) + "\n"
+
+
+def parse_fill_color(fill_color: str) -> tuple[float, float, float] | None:
+    """
+    Parses a CSS color to RGB components (0-1), returning None for no fill
+    ("", "unset" or anything that isn't a plain color).
+    """
+    if fill_color in ["", "unset"]:
+        return None
+    # tinycss2 is a dependency of WeasyPrint
+    color = importlib.import_module("tinycss2.color3").parse_color(fill_color)
+    if color is None or not hasattr(color, "red") or color.alpha == 0:
+        return None
+    return color.red, color.green, color.blue
+
+
+class SheetComposer:
+    """
+    Builds sheet pages by placing label form XObjects at the cell positions of a layout,
+    including the debug fill color and border of the cells.
+    Labels are aligned to the top left corner of their cells.
+    """
+
+    def __init__(self, sheet_layout: SheetLayout, enable_border: bool, fill_color: str, clip: bool = False):
+        """
+        Arguments:
+            sheet_layout: layout of the sheets
+            enable_border, fill_color: debug options, see wrap_pages()
+            clip: whether to clip labels to the cell shape (including the corner radius)
+        """
+        self.pypdf = get_pypdf()
+        self.writer = self.pypdf.PdfWriter()
+        self.layout = sheet_layout
+        self.compiled = compile_layout(sheet_layout)
+        self.enable_border = enable_border
+        self.fill = parse_fill_color(fill_color)
+        self.clip = clip
+        self.stamps: list = []      # indirect references of the form XObjects
+        self.stamp_heights: list[float] = []
+
+        self.page_width = sheet_layout.page_size.width * PT_PER_MM
+        self.page_height = sheet_layout.page_size.height * PT_PER_MM
+        self.cell_width = sheet_layout.label_width * PT_PER_MM
+        self.cell_height = sheet_layout.label_height * PT_PER_MM
+        self.radius = sheet_layout.corner_radius * PT_PER_MM
+
+    def add_stamps(self, document: bytes) -> list[int]:
+        """
+        Converts every page of a rendered PDF into a form XObject which can be placed
+        on sheets, returning the stamp indices in page order.
+        """
+        generic = self.pypdf.generic
+        reader = self.pypdf.PdfReader(io.BytesIO(document))
+        indices = []
+        for page in reader.pages:
+            contents = page.get_contents()
+            xobject = generic.DecodedStreamObject()
+            xobject.set_data(contents.get_data() if contents is not None else b"")
+            xobject.update({
+                generic.NameObject("/Type"): generic.NameObject("/XObject"),
+                generic.NameObject("/Subtype"): generic.NameObject("/Form"),
+                generic.NameObject("/BBox"): generic.ArrayObject(
+                    [generic.FloatObject(value) for value in page.mediabox]
+                ),
+            })
+            if "/Resources" in page:
+                xobject[generic.NameObject("/Resources")] = page["/Resources"].clone(self.writer)
+            indices.append(len(self.stamps))
+            self.stamps.append(add_indirect_object(self.writer, xobject.flate_encode()))
+            self.stamp_heights.append(float(page.mediabox.top))
+        return indices
+
+    def _cell_origin(self, idx: int) -> tuple[float, float]:
+        """
+        Returns the bottom left corner of a cell in PDF coordinates (points, origin bottom left).
+        """
+        row, col = divmod(idx, self.layout.columns)
+        x = self.compiled.column_lefts[col] * PT_PER_MM
+        y = self.page_height - self.compiled.row_tops[row] * PT_PER_MM - self.cell_height
+        return x, y
+
+    def add_sheet(self, cells: list[int | None]) -> None:
+        """
+        Adds a sheet page showing the specified stamps in grid order (None for skipped cells).
+        """
+        generic = self.pypdf.generic
+        page = self.writer.add_blank_page(self.page_width, self.page_height)
+        ops = []
+        used: dict[str, object] = {}
+
+        for idx, stamp in enumerate(cells[:self.layout.cells]):
+            x, y = self._cell_origin(idx)
+            if self.fill is not None:
+                ops.append("q {} {} {} rg\n".format(*(_num(c) for c in self.fill)))
+                ops.append(rounded_rect_path(x, y, self.cell_width, self.cell_height, self.radius))
+                ops.append("f Q\n")
+            if stamp is not None:
+                name = f"/L{stamp}"
+                used[name] = self.stamps[stamp]
+                ops.append("q\n")
+                if self.clip:
+                    ops.append(rounded_rect_path(x, y, self.cell_width, self.cell_height, self.radius))
+                    ops.append("W n\n")
+                # align the top edge of the label with the top edge of the cell
+                stamp_y = y + self.cell_height - self.stamp_heights[stamp]
+                ops.append(f"1 0 0 1 {_num(x)} {_num(stamp_y)} cm {name} Do Q\n")
+            if self.enable_border:
+                # the border is on the inside of the cell, so the path is inset by half its width
+                inset = BORDER_WIDTH * PT_PER_MM / 2
+                ops.append(f"q 0 g 0 G {_num(BORDER_WIDTH * PT_PER_MM)} w\n")
+                ops.append(rounded_rect_path(
+                    x + inset, y + inset,
+                    self.cell_width - 2 * inset, self.cell_height - 2 * inset,
+                    max(self.radius - inset, 0)
+                ))
+                ops.append("S Q\n")
+
+        contents = generic.DecodedStreamObject()
+        contents.set_data("".join(ops).encode())
+        page[generic.NameObject("/Contents")] = add_indirect_object(self.writer, contents.flate_encode())
+        page[generic.NameObject("/Resources")] = generic.DictionaryObject({
+            generic.NameObject("/XObject"): generic.DictionaryObject({
+                generic.NameObject(name): ref for name, ref in used.items()
+            })
+        })
+
+    def write(self, compress: bool = True) -> bytes:
+        """
+        Writes the composed sheets. With compress, resources repeated in the labels
+        (e.g. fonts embedded in every imposed label) are only written once.
+        """
+        return write_pypdf(self.writer, compress)
+
+
+def render_label_pdf(html_data: str, options: RenderOptions | None = None, timings: JobTimings | None = None) -> bytes:
+    """
+    Renders a single label document (including its own @page style) to a PDF
+    whose first page can be imposed onto sheets.
+    """
+    options = options or RenderOptions()
+    timings = timings or JobTimings()
+    html = get_weasyprint().HTML(string=html_data, url_fetcher=get_url_fetcher(options))
+    with timings.phase("render", html_bytes=len(html_data)):
+        document = render_document(html, options.pdf)
+    return write_pdf(document.copy(document.pages[:1]), options.pdf, timings)
+
+
+def stamp_document(cells: list[str], sheet_layout: SheetLayout, head_styles: list[str]) -> str:
+    """
+    Returns an HTML document showing every provided cell on its own page of the label size.
+    """
+    return "".join((
+        f"""
+        <head>
+            <style>
+                @page {{
+                    size: {sheet_layout.label_width}mm {sheet_layout.label_height}mm;
+                    margin: 0mm;
+                    padding: 0mm;
+                }}
+
+                .label-sheet-stamp {{
+                    width: {sheet_layout.label_width}mm;
+                    height: {sheet_layout.label_height}mm;
+                    padding: 0mm;
+                    position: relative;
+                    overflow: hidden;
+                    page-break-after: always;
+                }}
+
+                .label-sheet-cell-error {{
+                    background-color: #F00;
+                }}
+
+                body {{
+                    margin: 0mm !important;
+                }}
+            </style>
+            """,
+        *head_styles,
+        """
+        </head>
+        <body>
+            """,
+        *(f"<div class='label-sheet-stamp'>{cell}</div>" for cell in cells),
+        """
+        </body>
+        </html>
+        """
+    ))
+
+
+def render_stamped_pdf(
+    cells: list[str],
+    sheets: list[list[int | None]],
+    sheet_layout: SheetLayout,
+    enable_border: bool,
+    fill_color: str,
+    head_styles: list[str],
+    options: RenderOptions | None = None,
+    timings: JobTimings | None = None
+) -> bytes:
+    """
+    Renders the distinct cells of a job once and composes the sheets from them.
+
+    Arguments:
+        cells: HTML of every distinct cell
+        sheets: for every page, the index into cells of every position (None if skipped)
+        sheet_layout: layout of the sheets
+        enable_border, fill_color: debug options, see wrap_pages()
+        head_styles: style blocks hoisted out of the cells
+        options: options for the conversion of the cells
+        timings: optional collector of the duration of the phases
+    """
+    options = options or RenderOptions()
+    timings = timings or JobTimings()
+    composer = SheetComposer(sheet_layout, enable_border, fill_color)
+
+    if len(cells) > 0:
+        with timings.phase("html"):
+            html_data = stamp_document(cells, sheet_layout, head_styles)
+        html = get_weasyprint().HTML(string=html_data, url_fetcher=get_url_fetcher(options))
+        with timings.phase("render", html_bytes=len(html_data)):
+            document = render_document(html, options.pdf)
+        if len(document.pages) != len(cells):
+            # some label overflowed its size onto another page, so the pages can't be matched to the labels
+            raise PageCountMismatch(f"Expected {len(cells)} rendered labels, got {len(document.pages)} pages")
+        stamps = write_pdf(document, options.pdf, timings)
+        with timings.phase("compose", stamps=len(cells)):
+            composer.add_stamps(stamps)
+
+    with timings.phase("compose", sheets=len(sheets)):
+        for sheet in sheets:
+            composer.add_sheet(sheet)
+        pdf = composer.write(options.pdf.compress)
+
+    _log.debug(f"Stamped {len(cells)} distinct labels onto {len(sheets)} sheets")
+    return pdf
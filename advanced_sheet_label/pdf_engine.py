@@ -0,0 +1,644 @@
+"""
+Conversion of the generated label sheet HTML to PDF.
+
+This module must not depend on Django or InvenTree, because the functions
+executed in worker processes are imported there from a fresh interpreter.
+"""
+
+import dataclasses
+import gc
+import hashlib
+import importlib
+import io
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import time
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable
+
+from .assets import make_url_fetcher
+from .fetcher import FetcherConfig, get_caching_fetcher
+from .instrumentation import JobTimings
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+_pool: ProcessPoolExecutor | None = None
+_pool_workers: int = 0
+_pool_lock = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class PdfOptions:
+    """
+    Options for writing laid out documents to PDF, see write_pdf().
+    """
+    subset_fonts: bool = True   # only embed the glyphs used instead of the full fonts
+    image_dpi: int = 0          # maximum resolution of images at their printed size, 0 keeps the original
+    jpeg_quality: int = 0       # quality of recompressed JPEG images (1-95), 0 keeps the original
+    compress: bool = True       # compress the PDF streams
+    pdf_variant: str = ""       # e.g. "pdf/a-3b", empty for a standard PDF
+
+    @property
+    def optimize_images(self) -> bool:
+        return self.image_dpi > 0 or self.jpeg_quality > 0
+
+
+@dataclasses.dataclass
+class RenderOptions:
+    """
+    Options for converting documents to PDF, which are also passed to the worker processes.
+    """
+    # data URIs hoisted out of the document by an AssetTable
+    data_uris: dict[str, str] = dataclasses.field(default_factory=dict)
+    # configuration of the caching url_fetcher, None disables caching
+    fetcher: FetcherConfig | None = None
+    # options for writing the PDF
+    pdf: PdfOptions = dataclasses.field(default_factory=PdfOptions)
+
+
+def get_weasyprint():
+    """
+    Imports WeasyPrint on first use. Importing it is expensive, so this is
+    deferred until a label is actually rendered instead of slowing down every
+    InvenTree process loading the plugin.
+    """
+    return importlib.import_module("weasyprint")
+
+
+def get_pypdf():
+    """
+    Imports pypdf on first use, returning None if it is not installed.
+    It is optional and only required for merging the results of the parallel engine.
+    """
+    try:
+        return importlib.import_module("pypdf")
+    except ImportError:
+        return None
+
+
+def get_url_fetcher(options: RenderOptions):
+    """
+    Returns the WeasyPrint url_fetcher to use for the provided options.
+    """
+    weasyprint = get_weasyprint()
+    fetcher = weasyprint.default_url_fetcher
+    if options.fetcher is not None and options.fetcher.max_bytes > 0:
+        fetcher = get_caching_fetcher(options.fetcher, fetcher)
+    return make_url_fetcher(options.data_uris, fetcher)
+
+
+def _weasyprint_major_version() -> int:
+    try:
+        return int(get_weasyprint().__version__.split(".")[0])
+    except (AttributeError, ValueError):
+        return 0
+
+
+def render_options(options: PdfOptions) -> dict:
+    """
+    Returns the keyword arguments of HTML.render() for the installed WeasyPrint version.
+    Before version 59, the size optimizations are options of the layout instead of the
+    PDF output (see write_pdf_options()).
+    """
+    if not 53 <= _weasyprint_major_version() < 59:
+        return {}
+    # older versions only know which parts to optimize, the streams are always compressed
+    return {
+        "optimize_size": tuple(
+            part for part, enabled in (("fonts", options.subset_fonts), ("images", options.optimize_images))
+            if enabled
+        )
+    }
+
+
+def write_pdf_options(options: PdfOptions) -> dict:
+    """
+    Returns the keyword arguments of Document.write_pdf() for the installed WeasyPrint version.
+    """
+    kwargs = {}
+    version = _weasyprint_major_version()
+    if version >= 59:
+        kwargs["full_fonts"] = not options.subset_fonts
+        kwargs["uncompressed_pdf"] = not options.compress
+        if options.optimize_images:
+            kwargs["optimize_images"] = True
+        if options.image_dpi > 0:
+            kwargs["dpi"] = options.image_dpi
+        if options.jpeg_quality > 0:
+            kwargs["jpeg_quality"] = options.jpeg_quality
+        if options.pdf_variant:
+            kwargs["pdf_variant"] = options.pdf_variant
+    elif options.pdf_variant and version >= 53:
+        kwargs["variant"] = options.pdf_variant
+    return kwargs
+
+
+def render_document(html, options: PdfOptions | None = None):
+    """
+    Lays out a WeasyPrint HTML document with the options for the installed version.
+    """
+    return html.render(**render_options(options or PdfOptions()))
+
+
+# ratios of the size and write time of the default options to other PdfOptions, see _savings_ratios()
+_measured_ratios: dict[PdfOptions, tuple[float, float]] = {}
+
+
+def _savings_ratios(document, options: PdfOptions) -> tuple[float, float]:
+    """
+    Returns the ratios of the size and write time of a PDF written with the default options
+    to one written with the options. They are measured once per process and options on the
+    first page of the first document, so the savings of the options can be reported without
+    writing every document twice.
+    """
+    ratios = _measured_ratios.get(options)
+    if ratios is None:
+        first_page = document.copy(document.pages[:1])
+        measured = []
+        for measured_options in (PdfOptions(), options):
+            start = time.perf_counter()
+            size = len(first_page.write_pdf(**write_pdf_options(measured_options)))
+            measured.append((size, time.perf_counter() - start))
+        (default_size, default_seconds), (size, seconds) = measured
+        ratios = _measured_ratios[options] = (default_size / max(size, 1), default_seconds / max(seconds, 1e-6))
+    return ratios
+
+
+def write_pdf(document, options: PdfOptions | None = None, timings: JobTimings | None = None) -> bytes:
+    """
+    Writes a laid out WeasyPrint document to PDF. All PDF output of the plugin goes
+    through this function, so the options are applied consistently.
+
+    With options writing the PDF differently than the defaults, the bytes and time saved
+    by them are estimated (see _savings_ratios()) and added to the timings.
+    """
+    options = options or PdfOptions()
+    timings = timings or JobTimings()
+    kwargs = write_pdf_options(options)
+    start = time.perf_counter()
+    with timings.phase("write_pdf", pages=len(document.pages)):
+        pdf = document.write_pdf(**kwargs)
+    seconds = time.perf_counter() - start
+    counts = {"pdf_bytes": len(pdf)}
+    # older WeasyPrint versions apply most options while laying out, which can't be compared here
+    if kwargs != write_pdf_options(PdfOptions()) and document.pages:
+        size_ratio, time_ratio = _savings_ratios(document, options)
+        counts["saved_bytes"] = round(len(pdf) * (size_ratio - 1))
+        counts["saved_ms"] = round(seconds * (time_ratio - 1) * 1000, 1)
+    timings.add("write_pdf", 0, **counts)
+    _log.debug(f"Wrote {len(document.pages)} pages with {options}: {counts}, {seconds * 1000:.1f} ms")
+    return pdf
+
+
+class PageCountMismatch(ValueError):
+    """
+    Raised when a document did not result in the expected number of pages,
+    so its pages can't be reordered.
+    """
+
+
+def _check_page_count(actual: int, page_order: list[int]) -> None:
+    expected = max(page_order, default=-1) + 1
+    if actual != expected:
+        raise PageCountMismatch(f"Expected {expected} pages, got {actual}")
+
+
+def render_pdf(
+    html_data: str,
+    options: RenderOptions | None = None,
+    page_order: list[int] | None = None,
+    timings: JobTimings | None = None
+) -> bytes:
+    """
+    Lays out an entire HTML document and renders it to a PDF in a single pass.
+
+    Arguments:
+        html_data: the HTML document
+        options: options for the conversion
+        page_order: optional indices of the laid out pages to output in order. Pages
+            can be repeated, which only serializes them again without another layout.
+        timings: optional collector of the duration of the render and write_pdf phases
+    """
+    options = options or RenderOptions()
+    timings = timings or JobTimings()
+    html = get_weasyprint().HTML(string=html_data, url_fetcher=get_url_fetcher(options))
+    with timings.phase("render", html_bytes=len(html_data)):
+        document = render_document(html, options.pdf)
+    if page_order is not None:
+        _check_page_count(len(document.pages), page_order)
+        document = document.copy([document.pages[idx] for idx in page_order])
+    return write_pdf(document, options.pdf, timings)
+
+
+def _render_chunk(html_data: str, options: RenderOptions) -> tuple[bytes, dict]:
+    """
+    Renders a chunk of the parallel engine in a worker process, returning the
+    PDF and the timings of the worker.
+    """
+    timings = JobTimings()
+    return render_pdf(html_data, options, timings=timings), timings.phases
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Returns the process pool used for parallel rendering, (re-)creating it if
+    the number of workers has changed. The pool is kept alive between jobs so the
+    worker startup cost (importing WeasyPrint) is only paid once.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn instead of fork, as forking a multi-threaded server process is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def write_pypdf(writer, compress: bool = True) -> bytes:
+    """
+    Writes a pypdf PdfWriter to bytes. With compress, objects repeated in the merged
+    documents (e.g. the fonts embedded in every chunk) are only written once, if the
+    installed pypdf version supports it.
+    """
+    if compress and hasattr(writer, "compress_identical_objects"):
+        writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def add_indirect_object(writer, obj):
+    """
+    Adds an object to a pypdf PdfWriter as an indirect object and returns its reference.
+    pypdf has no public API for this, so the private method is only used here, for the
+    pypdf versions pinned by the "parallel" extra.
+    """
+    return writer._add_object(obj)
+
+
+def merge_pdfs(documents: list[bytes], compress: bool = True) -> bytes:
+    """
+    Concatenates the pages of multiple PDF documents in order.
+    """
+    pypdf = get_pypdf()
+    writer = pypdf.PdfWriter()
+    for document in documents:
+        writer.append(pypdf.PdfReader(io.BytesIO(document)))
+    return write_pypdf(writer, compress)
+
+
+def reorder_pdf(document: bytes, page_order: list[int]) -> bytes:
+    """
+    Returns a PDF with the pages of a document in the specified order. Repeated
+    pages share their contents and resources.
+    """
+    pypdf = get_pypdf()
+    reader = pypdf.PdfReader(io.BytesIO(document))
+    _check_page_count(len(reader.pages), page_order)
+    writer = pypdf.PdfWriter()
+    for idx in page_order:
+        writer.add_page(reader.pages[idx])
+    return write_pypdf(writer, compress=False)
+
+
+class IncrementalPdfWriter:
+    """
+    Writes the pages of PDF documents to a file one document after another. The objects
+    of a document are copied to the file one at a time as soon as it is added, so unlike
+    with pypdf's PdfWriter, which holds all objects until the merged document is written,
+    the memory usage doesn't grow with the number of documents. Only the pages and the
+    objects they reference are copied, document level structures like outlines are
+    dropped. Streams repeated in multiple documents (e.g. images and fonts) are only
+    stored once, only their hashes are kept for this. Requires pypdf.
+    """
+
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, file):
+        self._file = file
+        self._file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        # offset of every object by object number - 1, the catalog and page tree are written last
+        self._offsets: list[int] = [0, 0]
+        self._pages: list[int] = []
+        # hashes of the written streams -> their object number
+        self._streams: dict[bytes, int] = {}
+
+    @property
+    def pages(self) -> int:
+        return len(self._pages)
+
+    def _allocate(self) -> int:
+        self._offsets.append(0)
+        return len(self._offsets)
+
+    def _write_object(self, number: int, obj) -> None:
+        data = io.BytesIO()
+        obj.write_to_stream(data, None)
+        self._write_data(number, data.getvalue())
+
+    def _write_data(self, number: int, data: bytes) -> None:
+        self._offsets[number - 1] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n".encode())
+        self._file.write(data)
+        self._file.write(b"\nendobj\n")
+
+    def _write_unique(self, obj) -> int:
+        """
+        Writes an object with a new number, unless it is a stream which was written before.
+        """
+        if not isinstance(obj, get_pypdf().generic.StreamObject):
+            number = self._allocate()
+            self._write_object(number, obj)
+            return number
+        data = io.BytesIO()
+        obj.write_to_stream(data, None)
+        data = data.getvalue()
+        digest = hashlib.sha256(data).digest()
+        if (number := self._streams.get(digest)) is None:
+            number = self._streams[digest] = self._allocate()
+            self._write_data(number, data)
+        return number
+
+    def add(self, document: bytes) -> None:
+        """
+        Appends the pages of a PDF document.
+        """
+        pypdf = get_pypdf()
+        generic = pypdf.generic
+        reader = pypdf.PdfReader(io.BytesIO(document))
+        # the pages include the attributes inherited from their page tree. Their numbers are
+        # allocated up front, as other objects (e.g. links) refer to them.
+        pages = list(reader.pages)
+        numbers = {page.indirect_reference.idnum: self._allocate() for page in pages}   # in the document -> file
+        copying: set[int] = set()
+
+        def copy(reference):
+            # the objects are written after the objects they refer to, so their references
+            # are known and identical streams referring to identical objects are found
+            idnum = reference.idnum
+            if idnum not in numbers:
+                if idnum in copying:
+                    # a reference cycle (e.g. between form fields and widgets) requires the number up front
+                    numbers[idnum] = self._allocate()
+                else:
+                    copying.add(idnum)
+                    obj = translate(reader.get_object(reference))
+                    obj = obj if obj is not None else generic.NullObject()
+                    copying.discard(idnum)
+                    if idnum in numbers:
+                        self._write_object(numbers[idnum], obj)
+                    else:
+                        numbers[idnum] = self._write_unique(obj)
+            return generic.IndirectObject(numbers[idnum], 0, None)
+
+        def translate(obj):
+            # replaces the references in an object in place, its objects are read only once
+            if isinstance(obj, generic.IndirectObject):
+                return copy(obj)
+            if isinstance(obj, generic.DictionaryObject):
+                if isinstance(obj, generic.StreamObject):
+                    obj.pop(generic.NameObject("/Length"), None)    # written with the stream
+                for key, value in obj.items():
+                    obj[key] = translate(value)
+            elif isinstance(obj, generic.ArrayObject):
+                for idx, value in enumerate(obj):
+                    obj[idx] = translate(value)
+            return obj
+
+        for page in pages:
+            # the page tree of the document is replaced by the one of the file
+            page.pop(generic.NameObject("/Parent"), None)
+            translate(page)
+            page[generic.NameObject("/Parent")] = generic.IndirectObject(self.PAGES, 0, None)
+            number = numbers[page.indirect_reference.idnum]
+            self._write_object(number, page)
+            self._pages.append(number)
+
+    def finish(self) -> None:
+        """
+        Writes the page tree, the catalog and the cross reference table, completing the file.
+        """
+        generic = get_pypdf().generic
+        self._write_object(self.PAGES, generic.DictionaryObject({
+            generic.NameObject("/Type"): generic.NameObject("/Pages"),
+            generic.NameObject("/Kids"): generic.ArrayObject(
+                generic.IndirectObject(number, 0, None) for number in self._pages
+            ),
+            generic.NameObject("/Count"): generic.NumberObject(len(self._pages)),
+        }))
+        self._write_object(self.CATALOG, generic.DictionaryObject({
+            generic.NameObject("/Type"): generic.NameObject("/Catalog"),
+            generic.NameObject("/Pages"): generic.IndirectObject(self.PAGES, 0, None),
+        }))
+        xref = self._file.tell()
+        self._file.write(f"xref\n0 {len(self._offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in self._offsets:
+            self._file.write(f"{offset:010d} 00000 n \n".encode())
+        self._file.write(
+            f"trailer\n<< /Size {len(self._offsets) + 1} /Root {self.CATALOG} 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode()
+        )
+
+
+def render_pdf_parallel(
+    pages: list[str],
+    wrap_pages: Callable[[list[str]], str],
+    workers: int,
+    chunk_pages: int,
+    options: RenderOptions | None = None,
+    progress: Callable[[int, int], None] | None = None,
+    page_order: list[int] | None = None,
+    timings: JobTimings | None = None
+) -> bytes:
+    """
+    Renders the provided pages to a PDF, splitting them into chunks of
+    chunk_pages pages which are laid out in separate worker processes and
+    merged back together in page order.
+
+    Falls back to rendering everything in a single pass if parallel rendering is
+    disabled (workers <= 1), the job only consists of a single chunk or pypdf
+    is not installed.
+
+    Arguments:
+        pages: HTML of the individual pages as generated by print_page()
+        wrap_pages: function wrapping a list of pages into a complete HTML document
+        workers: maximum number of worker processes
+        chunk_pages: number of pages laid out by one worker at a time
+        options: options for the conversion, used by every worker
+        progress: optional callback receiving the number of rendered chunks and the total number of chunks
+        page_order: optional indices into pages in output order, used when pages are
+            repeated in the output. Every page is then only laid out once.
+        timings: optional collector of the duration of the phases, the durations of
+            the worker processes are added up
+    """
+    try:
+        return _render_pdf_parallel(pages, wrap_pages, workers, chunk_pages, options, progress, page_order, timings)
+    except PageCountMismatch as exc:
+        # some page didn't result in exactly one laid out page, so lay out every page of the output
+        _log.warning(f"Could not reuse repeated pages ({exc}), rendering all pages")
+        return _render_pdf_parallel(
+            [pages[idx] for idx in page_order], wrap_pages, workers, chunk_pages, options, progress, None, timings
+        )
+
+
+def _render_pdf_parallel(
+    pages: list[str],
+    wrap_pages: Callable[[list[str]], str],
+    workers: int,
+    chunk_pages: int,
+    options: RenderOptions | None,
+    progress: Callable[[int, int], None] | None,
+    page_order: list[int] | None,
+    timings: JobTimings | None
+) -> bytes:
+    chunk_pages = max(chunk_pages, 1)
+    timings = timings or JobTimings()
+
+    options = options or RenderOptions()
+    if options.pdf.pdf_variant and workers > 1:
+        # merging the chunks would drop the metadata required by the PDF variant
+        _log.debug(f"Rendering in a single pass for {options.pdf.pdf_variant}")
+        workers = 1
+
+    if workers <= 1 or len(pages) <= chunk_pages:
+        with timings.phase("html"):
+            html_data = wrap_pages(pages)
+        return render_pdf(html_data, options, page_order, timings)
+
+    if get_pypdf() is None:
+        _log.warning("Parallel rendering requires the 'pypdf' package, falling back to single pass rendering")
+        with timings.phase("html"):
+            html_data = wrap_pages(pages)
+        return render_pdf(html_data, options, page_order, timings)
+
+    with timings.phase("html"):
+        chunks = [
+            wrap_pages(pages[idx : idx + chunk_pages])
+            for idx in range(0, len(pages), chunk_pages)
+        ]
+    _log.debug(f"Rendering {len(pages)} pages in {len(chunks)} chunks on up to {workers} processes")
+
+    # map() returns the results in submission order, so pages stay in order
+    results = []
+    for result, worker_phases in _get_pool(workers).map(_render_chunk, chunks, itertools.repeat(options)):
+        results.append(result)
+        timings.merge(worker_phases)
+        if progress is not None:
+            progress(len(results), len(chunks))
+    with timings.phase("compose", chunks=len(chunks)):
+        document = merge_pdfs(results, options.pdf.compress)
+        if page_order is not None:
+            document = reorder_pdf(document, page_order)
+    return document
+
+
+class PdfFile:
+    """
+    PDF (or zip archive of PDFs) written to a temporary file by render_pdf_streamed()
+    or zip_outputs(), which has to be deleted once it has been stored.
+    """
+
+    def __init__(self, path: str, filename: str = "labels.pdf"):
+        self.path = path
+        self.filename = filename    # name of the stored output
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def delete(self) -> None:
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def zip_outputs(parts: list[bytes | PdfFile], name: str = "labels") -> PdfFile:
+    """
+    Packs the PDFs of the parts of a split job into a zip archive in a temporary file.
+    The parts are stored uncompressed, as PDF streams are already compressed, and
+    temporary files of parts are deleted once they have been added.
+    """
+    fd, path = tempfile.mkstemp(prefix="adv-sheet-labels-", suffix=".zip")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as archive:
+            for idx, part in enumerate(parts, start=1):
+                if isinstance(part, PdfFile):
+                    archive.write(part.path, f"{name}-{idx}.pdf")
+                    part.delete()
+                else:
+                    archive.writestr(f"{name}-{idx}.pdf", part)
+    except BaseException:
+        os.remove(path)
+        raise
+    return PdfFile(path, f"{name}.zip")
+
+
+def render_pdf_streamed(
+    batches: Iterable[list[str]],
+    wrap_pages: Callable[[list[str]], str],
+    options: RenderOptions | None = None,
+    progress: Callable[[int], None] | None = None,
+    timings: JobTimings | None = None
+) -> PdfFile:
+    """
+    Renders pages batch by batch to a temporary file, so only the HTML, the laid out
+    document and the PDF of a single batch are held in memory at a time. The pages of
+    every batch are appended to the file right away (see IncrementalPdfWriter).
+    Requires pypdf.
+
+    Arguments:
+        batches: iterable of the pages of every batch, e.g. generated lazily
+        wrap_pages: function wrapping a list of pages into a complete HTML document
+        options: options for the conversion
+        progress: optional callback receiving the number of rendered pages
+        timings: optional collector of the duration of the phases
+    """
+    options = options or RenderOptions()
+    timings = timings or JobTimings()
+
+    fd, path = tempfile.mkstemp(prefix="adv-sheet-labels-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer = IncrementalPdfWriter(f)
+            rendered = 0
+            batch_count = 0
+            for batch in batches:
+                with timings.phase("html"):
+                    html_data = wrap_pages(batch)
+                part = render_pdf(html_data, options, timings=timings)
+                del html_data
+                with timings.phase("compose", chunks=1):
+                    writer.add(part)
+                del part
+                # the laid out document and the PDF reader of the batch are reference cycles, which
+                # are collected right away, so their memory is reused for the next batch
+                gc.collect()
+                rendered += len(batch)
+                batch_count += 1
+                if progress is not None:
+                    progress(rendered)
+            with timings.phase("compose"):
+                writer.finish()
+    except BaseException:
+        os.remove(path)
+        raise
+
+    _log.debug(f"Streamed {rendered} pages in {batch_count} batches to {path}")
+    return PdfFile(path)
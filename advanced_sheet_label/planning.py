@@ -0,0 +1,50 @@
+"""
+Planning of the label positions of a print job.
+
+The positions are worked out lazily from the number of items, labels per item and
+skipped positions, so the expanded list of all physical labels of a job is never built.
+"""
+
+import itertools
+from typing import Iterable, Iterator
+
+
+def total_positions(item_count: int, label_count: int, skip_count: int) -> int:
+    """
+    Returns the number of label positions used by a job, including skipped ones.
+    """
+    return skip_count + item_count * label_count
+
+
+def page_count(item_count: int, label_count: int, skip_count: int, cells: int) -> int:
+    """
+    Returns the number of pages a job is printed on.
+    """
+    return -(-total_positions(item_count, label_count, skip_count) // cells)
+
+
+def next_skip_count(item_count: int, label_count: int, skip_count: int, cells: int) -> int:
+    """
+    Returns the number of used up label positions on the last page of a job,
+    which is the number of positions to skip for the next job.
+    """
+    return total_positions(item_count, label_count, skip_count) % cells
+
+
+def plan_pages(items: Iterable, label_count: int, skip_count: int, cells: int) -> Iterator[list]:
+    """
+    Yields the items of every page of a job in order, one list of at most
+    cells entries per page. Skipped positions are represented by None and every
+    item is repeated label_count times.
+
+    Only the items of the current page are held in memory at a time.
+    """
+    positions = itertools.chain(
+        itertools.repeat(None, skip_count),
+        itertools.chain.from_iterable(
+            itertools.repeat(item, label_count)
+            for item in items
+        )
+    )
+    while page := list(itertools.islice(positions, cells)):
+        yield page
@@ -0,0 +1,138 @@
+"""
+Bulk prefetching of the related objects shown on labels.
+
+Label templates usually show data of related objects (e.g. the part, location and
+supplier of a stock item), which Django loads lazily with separate queries for every
+item. Before rendering, the items of a job are therefore loaded again in bulk with
+select_related() and prefetch_related() according to a plan for their model, which
+can be overridden by the template metadata.
+"""
+
+import dataclasses
+import logging
+
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.db import connections
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+
+@dataclasses.dataclass(frozen=True)
+class PrefetchPlan:
+    select_related: tuple[str, ...] = ()     # foreign keys loaded with a join
+    prefetch_related: tuple[str, ...] = ()   # reverse and many-to-many relations loaded in bulk
+
+    @property
+    def empty(self) -> bool:
+        return len(self.select_related) == 0 and len(self.prefetch_related) == 0
+
+    @property
+    def lazy_queries_per_item(self) -> int:
+        """
+        Number of queries the lookups of this plan would cause for every item if loaded
+        lazily, i.e. one per traversed relation.
+        """
+        relations = set()
+        for lookup in self.select_related + self.prefetch_related:
+            parts = lookup.split("__")
+            relations.update("__".join(parts[:idx]) for idx in range(1, len(parts) + 1))
+        return len(relations)
+
+
+# default plans by model label, for the models InvenTree can print labels for
+PREFETCH_PLANS: dict[str, PrefetchPlan] = {
+    "stock.stockitem": PrefetchPlan(
+        select_related=(
+            "part",
+            "part__category",
+            "location",
+            "supplier_part",
+            "supplier_part__supplier",
+            "supplier_part__manufacturer_part__manufacturer",
+        ),
+        prefetch_related=("part__parameters__template",),
+    ),
+    "stock.stocklocation": PrefetchPlan(
+        select_related=("parent", "location_type"),
+    ),
+    "part.part": PrefetchPlan(
+        select_related=("category",),
+        prefetch_related=("parameters__template",),
+    ),
+    "build.buildline": PrefetchPlan(
+        select_related=("build", "build__part", "bom_item", "bom_item__sub_part"),
+    ),
+}
+
+
+def get_prefetch_plan(model_label: str, metadata) -> PrefetchPlan | None:
+    """
+    Returns the plan for a model, which can be replaced by the "prefetch" key of the
+    template metadata, e.g. {"select_related": ["part"], "prefetch_related": ["part__parameters"]},
+    or disabled with false. Returns None if nothing should be prefetched.
+    """
+    if isinstance(metadata, dict) and "prefetch" in metadata:
+        value = metadata["prefetch"]
+        if not value:
+            return None
+        if not isinstance(value, dict):
+            _log.warning(f"Invalid prefetch plan in template metadata: {value!r}")
+            return None
+        plan = PrefetchPlan(
+            select_related=tuple(str(lookup) for lookup in value.get("select_related", ())),
+            prefetch_related=tuple(str(lookup) for lookup in value.get("prefetch_related", ())),
+        )
+    else:
+        plan = PREFETCH_PLANS.get(model_label)
+
+    if plan is None or plan.empty:
+        return None
+    return plan
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the executed queries.
+    """
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def prefetch_items(items: list, metadata) -> list:
+    """
+    Loads the items of a job again in a single pass with their related objects according
+    to the prefetch plan of their model. Returns the new items in the original order (repeated
+    items are the same object), or the original items if there is nothing to prefetch or the
+    plan is invalid for the model.
+    """
+    if len(items) == 0:
+        return items
+    model = type(items[0])
+    if not hasattr(model, "_meta") or any(type(item) is not model for item in items):
+        return items
+    if (plan := get_prefetch_plan(model._meta.label_lower, metadata)) is None:
+        return items
+
+    pks = list(dict.fromkeys(item.pk for item in items))
+    queryset = model._default_manager.filter(pk__in=pks)
+    counter = QueryCounter()
+    try:
+        with connections[queryset.db].execute_wrapper(counter):
+            loaded = queryset.select_related(*plan.select_related).prefetch_related(*plan.prefetch_related).in_bulk()
+    except (FieldError, FieldDoesNotExist, AttributeError, ValueError) as exc:
+        _log.warning(f"Could not prefetch related objects of {model._meta.label_lower} ({exc}), loading them lazily")
+        return items
+
+    saved = len(pks) * plan.lazy_queries_per_item - counter.queries
+    _log.info(
+        f"Prefetched related objects of {len(pks)} {model._meta.label_lower} items in {counter.queries} queries, "
+        f"saving up to {max(saved, 0)} queries"
+    )
+    # items which don't exist anymore are kept as they are
+    return [loaded.get(item.pk, item) for item in items]
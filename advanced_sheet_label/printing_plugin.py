@@ -3,20 +3,31 @@ Label printing plugin which supports printing multiple labels on a single page
 arranged according to standard label sheets.
 """
 
+import contextlib
+import dataclasses
 import logging
-import math
-
+import os
+import itertools
+import json
+import time
+from typing import Callable, Iterable, Iterator
+
+from django.apps import apps
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
-from django.core.validators import MinValueValidator
+from django.core.files.base import ContentFile, File
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
 from django.http import JsonResponse
+from django.utils import timezone, translation
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework.request import Request
-import weasyprint
 from rest_framework import serializers
 from plugin import InvenTreePlugin
 from plugin.mixins import LabelPrintingMixin, SettingsMixin
+from plugin.models import PluginSetting
 
 version_pre_0_16_x: bool = ...
 try:
@@ -26,10 +37,42 @@ except ImportError:
     from report.models import LabelOutput, LabelTemplate    # for newer versions (0.16.x)
     version_pre_0_16_x = False
 
-from .layouts import SheetLayout, LAYOUTS, LAYOUT_SELECT_OPTIONS
+from .layouts import (
+    SheetLayout, LAYOUTS, AUTO_LAYOUT_OPTIONS, get_layout_select_options, compile_layout, find_layout, get_layout_key
+)
+from .rendering import CellRenderer, RenderAborted, RenderFailures
+from .assets import AssetTable
+from .pdf_engine import (
+    PageCountMismatch, PdfFile, PdfOptions, RenderOptions, render_pdf_parallel, render_pdf_streamed, get_pypdf,
+    zip_outputs
+)
+from .pdf_compose import SheetComposer, render_stamped_pdf, render_label_pdf
+from .fetcher import FetcherConfig, get_fetcher_stats
+from .cell_cache import CellStore, DiskCellStore, DjangoCellStore, template_fingerprint, cell_key
+from .planning import plan_pages, next_skip_count, page_count
+from .instrumentation import JobHistory, JobTimings, profile_job
+from .prefetch import prefetch_items
+from .job_cache import JobResultCache, job_fingerprint
+from .skip_counter import SkipCounters, SKIP_COUNTER_SETTINGS
+from .disk_cache import private_directory
 
 
 _log = logging.getLogger('inventree-adv-sheet-label')
+
+RENDER_ENGINES = {
+    "html": "Single document",
+    "stamp": "Render once, stamp many",
+    "impose": "Impose individual labels",
+}
+# initial estimate of the PDF size per page for splitting jobs, until a template has been rendered
+DEFAULT_BYTES_PER_PAGE = 64 * 1024
+
+PDF_OPTIMIZATIONS = {
+    "settings": "Plugin settings",
+    "standard": "Standard (WeasyPrint defaults)",
+    "small": "Small (150 DPI images, JPEG quality 80)",
+    "archive": "Archive (plugin settings as PDF/A-3b)",
+}
 #_log.setLevel(logging.DEBUG)
 _plugin_instance: "AdvancedLabelSheetPlugin" = ...
 
@@ -41,7 +84,7 @@ def get_default_layout() -> str:
     if _plugin_instance is not ...: 
         return _plugin_instance.get_setting("DEFAULT_LAYOUT")
     else:
-        return LAYOUT_SELECT_OPTIONS[0][0]    # use the first one if there is no other option (is)
+        return AUTO_LAYOUT_OPTIONS[0][0]    # use the first one if there is no other option (is)
 
 def get_default_skip() -> int:
     """
@@ -50,19 +93,23 @@ def get_default_skip() -> int:
     positions.
     """
     if _plugin_instance is not ...: 
-        return _plugin_instance.label_skip_counter
+        return _plugin_instance.get_skip_counter()
     return 0
 
 
 class AdvancedLabelPrintingOptionsSerializer(serializers.Serializer):
     """Custom printing options for the advanced label sheet plugin."""
 
-    sheet_layout = serializers.ChoiceField(
-        label='Sheet layout',
-        help_text='Page size and label arrangement',
-        choices=LAYOUT_SELECT_OPTIONS,
-        default=get_default_layout,
-    )
+    def get_fields(self):
+        # The layout choices are only built when the form is first requested
+        # instead of when the plugin is loaded.
+        sheet_layout = serializers.ChoiceField(
+            label='Sheet layout',
+            help_text='Page size and label arrangement',
+            choices=get_layout_select_options(),
+            default=get_default_layout,
+        )
+        return {"sheet_layout": sheet_layout, **super().get_fields()}
 
     count = serializers.IntegerField(
         label='Number of labels',
@@ -96,6 +143,26 @@ class AdvancedLabelPrintingOptionsSerializer(serializers.Serializer):
         default="unset"
     )
 
+    pdf_optimization = serializers.ChoiceField(
+        label="PDF optimization",
+        help_text="Options for writing the PDF file. The default is configured in the plugin settings.",
+        choices=list(PDF_OPTIMIZATIONS.items()),
+        default="settings"
+    )
+
+    backend = serializers.ChoiceField(
+        label="Render engine",
+        help_text="How the PDF is generated. The default is configured in the plugin settings.",
+        choices=[("default", "Plugin default")] + list(RENDER_ENGINES.items()),
+        default="default"
+    )
+
+    preflight = serializers.BooleanField(
+        label="Preflight only",
+        help_text="Only plan the job (layout, pages, skip counter and estimated duration) without printing it. The plan is shown as message (InvenTree 0.15) or downloaded as JSON file instead of the PDF (InvenTree 0.16)",
+        default=False,
+    )
+
 
 
 class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugin):
@@ -117,8 +184,8 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
         "DEFAULT_LAYOUT": {
             "name": "Default sheet layout",
             "description": "The default sheet layout selection when printing labels",
-            "choices": LAYOUT_SELECT_OPTIONS,
-            "default": LAYOUT_SELECT_OPTIONS[0][0],
+            "choices": get_layout_select_options,  # evaluated lazily
+            "default": AUTO_LAYOUT_OPTIONS[0][0],
             "required": True
         },
         "LABEL_SKIP_COUNTER": {
@@ -130,6 +197,250 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
                 MinValueValidator(0)
             ],
             "hidden": True  # maybe shoudl actually show this for manual reset? but for now I'll not show it
+        },
+        "SKIP_COUNTER_SCOPE": {
+            "name": "Label skip counter scope",
+            "description": "Whether the automatic skip counter is shared by all sheet layouts or kept separately for every layout, e.g. when printing on different label sheets alternately.",
+            "choices": [
+                ("global", "Global"),
+                ("layout", "Per sheet layout"),
+            ],
+            "default": "global",
+        },
+        "LABEL_SKIP_COUNTERS": {
+            "name": "Label skip counters per layout",
+            "description": "Skip counters of the individual sheet layouts (JSON), used if the skip counter is kept per layout.",
+            "default": "{}",
+            "hidden": True
+        },
+        "BACKGROUND_PRINTING": {
+            "name": "Print in background",
+            "description": "Render jobs in the background worker instead of the web request and report their progress (InvenTree 0.16+ only). Requires a running background worker.",
+            "default": False,
+            "validator": bool
+        },
+        "PREFETCH_RELATED": {
+            "name": "Prefetch related objects",
+            "description": "Load the related objects shown on the labels (e.g. part and location of stock items) for all items of a job in bulk instead of one by one.",
+            "default": True,
+            "validator": bool
+        },
+        "RENDER_THREADS": {
+            "name": "Label render threads",
+            "description": "Number of threads used to render the label templates of a job concurrently. 1 renders all labels sequentially.",
+            "default": 1,
+            "validator": [
+                int,
+                MinValueValidator(1)
+            ]
+        },
+        "CELL_CACHE": {
+            "name": "Rendered label cache",
+            "description": "Keep rendered labels between jobs, so reprinting labels of unchanged items with an unchanged template doesn't render them again. Don't enable this for templates showing changing data of related objects (e.g. the current date or stock of a related part).",
+            "choices": [
+                ("off", "Disabled"),
+                ("disk", "On disk"),
+                ("django", "Django cache"),
+            ],
+            "default": "off",
+        },
+        "CELL_CACHE_SIZE": {
+            "name": "Rendered label cache size",
+            "description": "Size limit (MB) of the on-disk rendered label cache. The size of the Django cache is configured in InvenTree.",
+            "default": 64,
+            "validator": [
+                int,
+                MinValueValidator(1)
+            ]
+        },
+        "JOB_CACHE": {
+            "name": "Job cache",
+            "description": "Keep the PDFs of recent jobs, so submitting an identical job again (same template, items, item versions and options) returns the previous PDF without rendering it. Like the rendered label cache, changes of related objects shown on the labels are not detected.",
+            "default": False,
+            "validator": bool
+        },
+        "JOB_CACHE_SIZE": {
+            "name": "Job cache size",
+            "description": "Size limit (MB) of the job cache, the oldest jobs are removed first.",
+            "default": 128,
+            "validator": [
+                int,
+                MinValueValidator(1)
+            ]
+        },
+        "JOB_CACHE_TTL": {
+            "name": "Job cache lifetime",
+            "description": "Time (seconds) for which the PDF of a job is kept in the job cache.",
+            "default": 3600,
+            "validator": [
+                int,
+                MinValueValidator(0)
+            ]
+        },
+        "FETCH_CACHE_SIZE": {
+            "name": "Resource cache size",
+            "description": "Size limit (MB) of the in-memory cache for images and fonts referenced by label templates. 0 disables the cache.",
+            "default": 32,
+            "validator": [
+                int,
+                MinValueValidator(0)
+            ]
+        },
+        "FETCH_CACHE_TTL": {
+            "name": "Resource cache lifetime",
+            "description": "Time (seconds) after which cached images and fonts are loaded again, so changes are picked up.",
+            "default": 300,
+            "validator": [
+                int,
+                MinValueValidator(0)
+            ]
+        },
+        "FETCH_DISK_CACHE": {
+            "name": "Resource disk cache",
+            "description": "Additionally cache media and static files fetched via HTTP on disk, shared with the worker processes of the parallel render engine.",
+            "default": False,
+            "validator": bool
+        },
+        "CACHE_DIRECTORY": {
+            "name": "Cache directory",
+            "description": "Directory of the disk caches (rendered labels, job results and resources) and profiles, shared by all InvenTree processes including the background workers. It is created if it doesn't exist and must only be accessible by the server user (mode 0700), otherwise the disk caches are disabled. Empty uses 'adv-sheet-label-cache' next to the media directory of InvenTree.",
+            "default": "",
+        },
+        "RENDER_ENGINE": {
+            "name": "Render engine",
+            "description": "How the PDF is generated by default. 'Render once, stamp many' lays out every distinct label only once and places it on the sheets as often as needed, which is much faster and smaller for repetitive jobs. 'Impose individual labels' renders every label on its own with the template page size, which keeps memory usage low for huge jobs. Both require the 'pypdf' package.",
+            "choices": list(RENDER_ENGINES.items()),
+            "default": "html",
+        },
+        "RENDER_ERROR_THRESHOLD": {
+            "name": "Render error threshold",
+            "description": "Stop rendering the label template once it failed this many times with the same error in a job, e.g. because the template is broken. 0 renders every label regardless (default).",
+            "default": 0,
+            "validator": [
+                int,
+                MinValueValidator(0)
+            ]
+        },
+        "RENDER_ERROR_ACTION": {
+            "name": "Render error action",
+            "description": "What happens once the render error threshold is reached: abort the job with an error, or fill the remaining labels with error cells without rendering them.",
+            "choices": [
+                ("abort", "Abort the job"),
+                ("fill", "Fill with error cells"),
+            ],
+            "default": "abort",
+        },
+        "PAGE_MARKUP": {
+            "name": "Page markup",
+            "description": "Markup of the sheets generated by the 'Single document' render engine. 'Flat' places the labels as absolutely positioned boxes instead of a table grid, which avoids the table layout. Compare both with benchmarks/bench_markup.py before switching.",
+            "choices": [
+                ("table", "Table grid"),
+                ("flat", "Flat"),
+            ],
+            "default": "table",
+        },
+        "RENDER_WORKERS": {
+            "name": "Parallel render processes",
+            "description": "Number of processes used to lay out large jobs in parallel. 1 disables parallel rendering. Requires the 'pypdf' package.",
+            "default": 1,
+            "validator": [
+                int,
+                MinValueValidator(1)
+            ]
+        },
+        "PDF_SUBSET_FONTS": {
+            "name": "PDF: subset fonts",
+            "description": "Only embed the characters of fonts which are used on the labels instead of the full fonts.",
+            "default": True,
+            "validator": bool
+        },
+        "PDF_IMAGE_DPI": {
+            "name": "PDF: image resolution",
+            "description": "Maximum resolution (DPI) of images at the size they are printed on the labels, larger images are downsampled. 0 keeps the original images.",
+            "default": 0,
+            "validator": [
+                int,
+                MinValueValidator(0)
+            ]
+        },
+        "PDF_JPEG_QUALITY": {
+            "name": "PDF: JPEG quality",
+            "description": "Quality (1-95) of recompressed JPEG images. 0 keeps the original images.",
+            "default": 0,
+            "validator": [
+                int,
+                MinValueValidator(0),
+                MaxValueValidator(95)
+            ]
+        },
+        "PDF_COMPRESS": {
+            "name": "PDF: compress",
+            "description": "Compress the contents of the PDF and only store resources repeated in the labels once.",
+            "default": True,
+            "validator": bool
+        },
+        "PDF_VARIANT": {
+            "name": "PDF: variant",
+            "description": "Write PDF/A files for archiving, which requires the single document render engine.",
+            "choices": [
+                ("none", "Standard PDF"),
+                ("pdf/a-1b", "PDF/A-1b"),
+                ("pdf/a-2b", "PDF/A-2b"),
+                ("pdf/a-3b", "PDF/A-3b"),
+            ],
+            "default": "none",
+        },
+        "STREAM_OUTPUT": {
+            "name": "Streaming output",
+            "description": "Render jobs of the single document engine in batches of pages and write the PDF to a temporary file, which keeps the memory usage of very large jobs low. Requires the 'pypdf' package.",
+            "default": False,
+            "validator": bool
+        },
+        "STREAM_BATCH_PAGES": {
+            "name": "Streaming batch size",
+            "description": "Number of pages laid out at once in streaming mode. Lower values use less memory.",
+            "default": 50,
+            "validator": [
+                int,
+                MinValueValidator(1)
+            ]
+        },
+        "SPLIT_MAX_PAGES": {
+            "name": "Split jobs: maximum pages",
+            "description": "Split jobs with more pages than this into multiple PDF files, which are rendered independently. 0 disables splitting by page count.",
+            "default": 0,
+            "validator": [
+                int,
+                MinValueValidator(0)
+            ]
+        },
+        "SPLIT_MAX_SIZE": {
+            "name": "Split jobs: maximum size",
+            "description": "Split jobs into multiple PDF files of at most about this size (MB), estimated from previous jobs with the same template. 0 disables splitting by size.",
+            "default": 0,
+            "validator": [
+                int,
+                MinValueValidator(0)
+            ]
+        },
+        "PROFILE": {
+            "name": "Profile next job",
+            "description": "Profile the next print job with cProfile (CPU time) or tracemalloc (memory) and write the result to the 'profiles' directory in the cache directory. The setting is reset to disabled once the job has started.",
+            "choices": [
+                ("off", "Disabled"),
+                ("cprofile", "cProfile"),
+                ("tracemalloc", "tracemalloc"),
+            ],
+            "default": "off",
+        },
+        "RENDER_CHUNK_PAGES": {
+            "name": "Parallel render chunk size",
+            "description": "Number of pages laid out by one render process at a time. Jobs with no more pages than this are always rendered in a single pass.",
+            "default": 10,
+            "validator": [
+                int,
+                MinValueValidator(1)
+            ]
         }
     }
 
@@ -141,14 +452,47 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
         # save instance so serializers can access it.
         global _plugin_instance
         _plugin_instance = self
+        self._cell_store: CellStore | None = None
+        self._cell_store_config: tuple = ()
+        # checked private directories of the disk caches and profiles, see _private_dir()
+        self._private_dirs: set[str] = set()
+        self._skip_counters = SkipCounters(self)
+        # running average of the PDF size per page of every template (pk), for splitting jobs
+        self._bytes_per_page: dict[int, float] = {}
+        # timings of recent jobs by template (pk) and render engine, for estimating the duration of jobs
+        self._job_history = JobHistory()
     
     @property
     def label_skip_counter(self) -> int:
-        return self.get_setting("LABEL_SKIP_COUNTER")
-    
-    @label_skip_counter.setter
-    def label_skip_counter(self, counter: int) -> None:
-        self.set_setting("LABEL_SKIP_COUNTER", counter)
+        return self.get_skip_counter()
+
+    def get_skip_counter(self, sheet_layout: SheetLayout | None = None) -> int:
+        """
+        Returns the automatic skip counter (cached in process). With a counter per layout
+        and no layout specified, the counter of the default layout is returned, or if
+        the default is automatic detection, the one of the most recently used layout.
+        """
+        if not self._skip_counters.per_layout():
+            return self._skip_counters.get()
+
+        if sheet_layout is not None:
+            layout_key = get_layout_key(sheet_layout)
+        elif (default_layout := self._skip_counters.default_layout()) in LAYOUTS:
+            layout_key = default_layout
+        else:
+            layout_key = self._skip_counters.last_used_layout()
+        return 0 if layout_key is None else self._skip_counters.get(layout_key)
+
+    def _commit_label_skip_counter(self, counter: int, sheet_layout: SheetLayout) -> None:
+        """
+        Stores the skip counter of the layout used by a job, or the global one.
+        """
+        layout_key = None
+        if self._skip_counters.per_layout():
+            layout_key = get_layout_key(sheet_layout)
+            if layout_key is None:
+                _log.warning(f"Layout {sheet_layout} is not registered, storing the global skip counter instead")
+        self._skip_counters.commit(counter, layout_key)
 
     def _find_closest_match(self, label: LabelTemplate, prefer_round: bool) -> tuple[SheetLayout, bool, bool]:
         """
@@ -165,55 +509,14 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
             specified: whether the layout was specified in metadata or looked for via size
             exact: whether the result size matches exactly or not
         """
-        # check for specified info in metadata:
+        # check for specified info in metadata
+        metadata_layout = None
         if isinstance(label.metadata, dict) and "sheet_layout" in label.metadata:
-            layout_code = str(label.metadata["sheet_layout"])
-            if layout_code in LAYOUTS:
-                layout = LAYOUTS[layout_code]
-                return (
-                    layout,
-                    True,
-                    layout.label_height == label.height and layout.label_width == label.width
-                )
-        
-        # find match according to size
-        # define cost function: geometric average of size and width deviation. too small is always infinite cost
-        cost_function = lambda dw, dh: float("inf") if dw < 0 or dh < 0 else math.sqrt(dw**2 + dh**2)
-        # collect exact size matches
-        exact_matches: list[SheetLayout] = []
-        # collect the closest match if nothing exact is found
-        closest_match: tuple[float, SheetLayout] = ...
-
-        # go through all layouts to find best solution
-        for _, layout in LAYOUTS.items():
-            if (    # if we have exact matches, no need to check for closest contender
-                (layout.label_height == label.height and layout.label_width == label.width)
-                or len(exact_matches) > 0
-            ):
-                exact_matches.append(layout)
-                continue
+            metadata_layout = str(label.metadata["sheet_layout"])
 
-            # calculate the cost and save if it was better than the last one
-            cost = cost_function(
-                layout.label_width - label.width,
-                layout.label_height - label.height,
-            )
-            _log.debug(f"{layout=}: costs {cost}")
-            if closest_match is ... or cost < closest_match[0]:
-                closest_match = (cost, layout)
-        
-        if len(exact_matches) > 0:  # exact matches have been found
-            # find the prefered match
-            for match in exact_matches:
-                if prefer_round and match.corner_radius > 0:
-                    return match, False, True
-                elif not prefer_round and match.corner_radius == 0:
-                    return match, False, True
-            # otherwise just return the first one
-            return exact_matches[0], False, True
-
-        # no exact matches found
-        return closest_match[1], False, False
+        # otherwise find match according to size, preferring exact matches
+        # and otherwise the closest contender. Results are cached per template geometry.
+        return find_layout(label.width, label.height, metadata_layout, prefer_round)
     
     if version_pre_0_16_x:
         def print_labels(
@@ -222,12 +525,22 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
             """
             Printing interface for InvenTree 0.15.x (current stable)
             """
-            output_file = ContentFile(self._print_labels(label, items, request, **kwargs), 'labels.pdf')
-            output = LabelOutput.objects.create(label=output_file, user=request.user)
+            if kwargs['printing_options'].get("preflight", False):
+                plan = self.preflight(label, items, kwargs['printing_options'])
+                return JsonResponse({
+                    'success': True,
+                    'message': preflight_message(plan),
+                    'preflight': plan,
+                })
+
+            timings = JobTimings()
+            with pdf_output_file(self._print_labels(label, items, request, timings=timings, **kwargs)) as output_file:
+                output = LabelOutput.objects.create(label=output_file, user=request.user)
             return JsonResponse({
                 'file': output.label.url,
                 'success': True,
                 'message': f'{len(items)} labels generated',
+                'timings': timings.as_dict(),
             })
         
     else:
@@ -237,33 +550,161 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
             """
             Printing interface for InvenTree 0.16.x (currently not released yet)
             """
-            output.output = ContentFile(self._print_labels(label, items, request, **kwargs), 'labels.pdf')
-            output.progress = 100
-            output.complete = True
-            output.save()
+            if kwargs['printing_options'].get("preflight", False):
+                # the plan is returned as the output, it is fast enough to never run in the background
+                store_preflight(output, self.preflight(label, items, kwargs['printing_options']))
+                return
+
+            if self.get_setting("BACKGROUND_PRINTING"):
+                # resolve the layout right away, so configuration errors are still shown to the user
+                printing_options = dict(kwargs['printing_options'])
+                self._resolve_layout(label, printing_options)
+
+                from InvenTree.tasks import offload_task
+                model = type(items[0]) if len(items) > 0 else None
+                offload_task(
+                    print_labels_task,
+                    self.slug,
+                    label.pk,
+                    output.pk,
+                    model._meta.label if model is not None else None,
+                    [item.pk for item in items],
+                    printing_options
+                )
+                return
+
+            timings = JobTimings()
+            pdf = self._print_labels(
+                label, items, request, progress=self._progress_updater(output), timings=timings, **kwargs
+            )
+            store_output(output, pdf, timings)
+
+        def _progress_updater(self, output: LabelOutput) -> Callable[[int], None]:
+            """
+            Returns a progress callback storing the progress in the output,
+            writing to the database only when the percentage has changed.
+            """
+            last_progress = output.progress
+
+            def update(progress: int):
+                nonlocal last_progress
+                progress = min(progress, 99)    # 100 is only reported once the output is saved
+                if progress > last_progress:
+                    LabelOutput.objects.filter(pk=output.pk).update(progress=progress)
+                    last_progress = progress
+
+            return update
         
-    def _print_labels(
-        self, label: LabelTemplate, input_items: list, request, **kwargs
-    ) -> bytes:
+    def _private_dir(self, name: str) -> str | None:
         """
-        Handle printing of the provided labels.
-        Note that we override the entire print_label**s** method for this plugin
-        so we can arrange them all on pages.
+        Returns the directory of the disk cache (or profiles) name in the cache directory,
+        which is the same for all processes, so e.g. the background workers and the web
+        server share the cached labels and jobs. The directories are created and checked
+        to be private to the server user (see private_directory()). Returns None and logs
+        a warning if they can't be used, which disables the disk cache.
+        """
+        # by default in the data directory of InvenTree containing the media directory, which is
+        # also shared between the containers of a docker installation (unlike the temporary directory)
+        base = self.get_setting("CACHE_DIRECTORY") or os.path.join(
+            os.path.dirname(os.path.normpath(settings.MEDIA_ROOT)), "adv-sheet-label-cache"
+        )
+        directory = os.path.join(base, name)
+        if directory not in self._private_dirs:
+            try:
+                private_directory(base)
+                private_directory(directory)
+            except OSError as exc:
+                _log.warning(f"Cache directory {directory} can't be used, disabling the {name} disk cache: {exc}")
+                return None
+            self._private_dirs.add(directory)
+        return directory
+
+    def _get_fetcher_config(self) -> FetcherConfig | None:
+        """
+        Returns the configuration of the caching url_fetcher from the plugin settings.
+        """
+        max_bytes = self.get_setting("FETCH_CACHE_SIZE") * 1024 * 1024
+        if max_bytes <= 0:
+            return None
+        disk_dir = None
+        if self.get_setting("FETCH_DISK_CACHE"):
+            disk_dir = self._private_dir("fetch")   # None if it can't be used
+        return FetcherConfig(
+            max_bytes=max_bytes,
+            ttl=self.get_setting("FETCH_CACHE_TTL"),
+            disk_dir=disk_dir,
+            disk_url_prefixes=tuple(
+                prefix for prefix in (settings.MEDIA_URL, settings.STATIC_URL)
+                if prefix
+            )
+        )
 
-        This function is an internal function which returns the rendered PDF document.
-        The responding and uploading is handled by one of the two defined print_label()
-        functions depending on whether we are running in InvenTree v0.15.x or v0.16.x because
-        the API has changed since then
+    @property
+    def url_fetcher_stats(self) -> dict | None:
         """
+        Hit/miss statistics of the caching url_fetcher of this process
+        (not including the worker processes of the parallel engine).
+        """
+        return get_fetcher_stats()
 
-        # extract the printing options from request
-        printing_options = kwargs['printing_options']
+    def _get_cell_store(self) -> CellStore | None:
+        """
+        Returns the persistent store of rendered cells according to the plugin
+        settings, or None if it is disabled.
+        """
+        config = (self.get_setting("CELL_CACHE"), self.get_setting("CELL_CACHE_SIZE"))
+        if config != self._cell_store_config:
+            backend, size = config
+            if backend == "disk":
+                directory = self._private_dir("cells")
+                self._cell_store = DiskCellStore(directory, size * 1024 * 1024) if directory is not None else None
+            elif backend == "django":
+                self._cell_store = DjangoCellStore()
+            else:
+                self._cell_store = None
+            self._cell_store_config = config
+        return self._cell_store
+
+    @property
+    def cell_cache_stats(self) -> dict | None:
+        """
+        Hit/miss statistics of the rendered label cache in this process, None if it is disabled.
+        """
+        if (store := self._get_cell_store()) is None:
+            return None
+        return store.stats()
+
+    def _get_job_cache(self) -> JobResultCache | None:
+        """
+        Returns the cache of job results according to the plugin settings, or None if it is disabled.
+        """
+        if not self.get_setting("JOB_CACHE") or (directory := self._private_dir("jobs")) is None:
+            return None
+        return JobResultCache(
+            directory,
+            self.get_setting("JOB_CACHE_SIZE") * 1024 * 1024,
+            self.get_setting("JOB_CACHE_TTL")
+        )
+
+    def _output_settings(self, engine: str, printing_options: dict) -> dict:
+        """
+        Returns the resolved plugin settings which change the PDF of a job,
+        so they are part of the job cache fingerprint.
+        """
+        return {
+            "engine": engine,
+            "pdf": dataclasses.asdict(self._get_pdf_options(printing_options)),
+            "markup": self.get_setting("PAGE_MARKUP"),
+            "render_errors": [self.get_setting("RENDER_ERROR_THRESHOLD"), self.get_setting("RENDER_ERROR_ACTION")],
+        }
+
+    def _resolve_layout(self, label: LabelTemplate, printing_options: dict) -> SheetLayout:
+        """
+        Determines the sheet layout to use for a job from the printing options,
+        raising a ValidationError if it can't be used with the label template.
+        """
         sheet_layout_code: str = printing_options.get("sheet_layout", get_default_layout())
-        label_count: int = printing_options.get("count", 1)
-        skip_count: int = printing_options.get("skip", 0)
         ignore_size_mismatch: bool = printing_options.get("ignore_size_mismatch", False)
-        border: bool = printing_options.get("border", False)
-        fill_color: str = printing_options.get("fill_color", "")
 
         # get sheet layout information
         sheet_layout: SheetLayout = ...
@@ -278,49 +719,649 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
         else:   # explicit layout selection
             try:
                 sheet_layout = LAYOUTS[sheet_layout_code]
-            except IndexError:
+            except KeyError:
                 raise ValidationError(f"Sheet layout '<i>{sheet_layout_code}</i>' does not exist.")
 
-            if ((sheet_layout.label_height != label.height 
-                or sheet_layout.label_width != label.width)
-                and not ignore_size_mismatch):
+            if not sheet_layout.matches_size(label.width, label.height) and not ignore_size_mismatch:
                 raise ValidationError(f"Label size ({label.width}mm x {label.height}mm) does not match the label size required for the selected layout (<i>{str(sheet_layout)}</i>). Select '<i>Ignore label size mismatch</i>' to continue anyway.")
 
-        # generate the actual list of labels to print by prepending the
-        # required number of skipped null labels and multiplying each lable by the
-        # specified amount
-        items = [None] * skip_count + [
-            label
-            for item in input_items
-            for label in [item] * label_count
-        ]
+        return sheet_layout
+
+    def _print_labels(
+        self,
+        label: LabelTemplate,
+        input_items: list,
+        request,
+        progress: Callable[[int], None] | None = None,
+        timings: JobTimings | None = None,
+        **kwargs
+    ) -> bytes | PdfFile:
+        """
+        Handle printing of the provided labels.
+        Note that we override the entire print_label**s** method for this plugin
+        so we can arrange them all on pages.
+
+        This function is an internal function which returns the rendered PDF document,
+        or in streaming mode the temporary file it was written to (see pdf_output_file()).
+        Split jobs return a zip archive of their parts (see zip_outputs()).
+        The responding and uploading is handled by one of the two defined print_label()
+        functions depending on whether we are running in InvenTree v0.15.x or v0.16.x because
+        the API has changed since then
+
+        Arguments:
+            progress: optional callback receiving the progress of the job in percent,
+                called once per generated page and rendered chunk of pages
+            timings: optional collector of the duration of the phases of the job
+        """
+
+        # extract the printing options from request
+        printing_options = kwargs['printing_options']
+        label_count: int = printing_options.get("count", 1)
+        skip_count: int = printing_options.get("skip", 0)
+        timings = timings if timings is not None else JobTimings()
+
+        # profiling is only ever enabled for a single job
+        profile_mode = self.get_setting("PROFILE")
+        profile_dir = None
+        if profile_mode != "off":
+            self.set_setting("PROFILE", "off")
+            profile_dir = self._private_dir("profiles")
+
+        with profile_job(profile_mode, profile_dir):
+            with timings.phase("layout"):
+                sheet_layout = self._resolve_layout(label, printing_options)
+
+            # large jobs are split into parts at sheet boundaries, which are rendered independently
+            total_pages = page_count(len(input_items), label_count, skip_count, sheet_layout.cells)
+            engine = self._get_render_engine(printing_options)
+            job_cache = self._get_job_cache()
+            prefetched = False
+            rendered_pages = 0
+            parts = []
+            try:
+                for page_range in self._split_job(label, total_pages):
+                    split = len(page_range) < total_pages
+                    part_progress = progress
+                    if progress is not None and split:
+                        part_progress = lambda percent, page_range=page_range: progress(
+                            (page_range.start * 100 + percent * len(page_range)) // total_pages
+                        )
+
+                    # identical jobs (or parts) submitted again are returned from the job cache
+                    pdf = None
+                    if job_cache is not None:
+                        with timings.phase("job_cache", items=len(input_items)):
+                            fingerprint = job_fingerprint(
+                                label,
+                                input_items,
+                                dict(printing_options, pages=[page_range.start, page_range.stop]) if split
+                                else printing_options,
+                                self._output_settings(engine, printing_options)
+                            )
+                            pdf = job_cache.get(fingerprint)
+                        if pdf is not None:
+                            _log.info("Returning the PDF of an identical previous job from the job cache")
+
+                    if pdf is None:
+                        if not prefetched and self.get_setting("PREFETCH_RELATED"):
+                            with timings.phase("prefetch", items=len(input_items)):
+                                input_items = prefetch_items(input_items, label.metadata)
+                        prefetched = True
+                        pdf = self._render_job(
+                            label, input_items, request, sheet_layout, engine, printing_options, part_progress,
+                            timings, page_range if split else None
+                        )
+                        rendered_pages += len(page_range)
+                        if job_cache is not None:
+                            job_cache.put(fingerprint, pdf.path if isinstance(pdf, PdfFile) else pdf)
+                        self._record_page_size(label, pdf, len(page_range))
+                    parts.append(pdf)
+
+                # InvenTree shows a single output per job, so the parts are returned in a zip archive
+                result = parts[0] if len(parts) == 1 else zip_outputs(parts)
+            except BaseException:
+                # the temporary files of the parts rendered so far
+                for part in parts:
+                    if isinstance(part, PdfFile):
+                        part.delete()
+                raise
+            if len(parts) > 1:
+                _log.info(f"Split the job with {total_pages} pages into {len(parts)} parts")
+
+        timings.finish()
+        _log.info(f"Printed {len(input_items)} items on {sheet_layout}, {timings.summary()}")
+        # jobs returned from the job cache would distort the estimates of the preflight plan
+        self._job_history.record((label.pk, engine), timings, rendered_pages)
+
+        if (fetcher_stats := self.url_fetcher_stats) is not None:
+            _log.debug(f"Resource cache: {fetcher_stats}")
 
         # calculate all the used up label positions and store the new automatic skip
-        # count for next time.
-        self.label_skip_counter = len(items) % sheet_layout.cells   # only count skips on last page
+        # count for next time, now that the job has been rendered successfully.
+        self._commit_label_skip_counter(next_skip_count(     # only count skips on last page
+            len(input_items), label_count, skip_count, sheet_layout.cells
+        ), sheet_layout)
+
+        return result
+
+    def preflight(self, label: LabelTemplate, items: list, printing_options: dict) -> dict:
+        """
+        Plans a print job without rendering anything or updating the skip counter and returns
+        the resolved layout, the number of pages and free positions on the last sheet, the
+        resulting skip counter and the duration estimated from the recent jobs of this process.
+        Raises the same ValidationError as printing if the layout can't be used.
+        """
+        label_count: int = printing_options.get("count", 1)
+        skip_count: int = printing_options.get("skip", 0)
+
+        sheet_layout = self._resolve_layout(label, printing_options)
+        engine = self._get_render_engine(printing_options)
+        total_pages = page_count(len(items), label_count, skip_count, sheet_layout.cells)
+        next_skip = next_skip_count(len(items), label_count, skip_count, sheet_layout.cells)
+        distinct_labels = len({id(item) for item in items}) if label_count > 0 else 0
+
+        return {
+            "layout": get_layout_key(sheet_layout),
+            "layout_name": str(sheet_layout),
+            "render_engine": engine,
+            "items": len(items),
+            "labels": len(items) * label_count,
+            "skipped_positions": skip_count,
+            "pages": total_pages,
+            "positions_per_sheet": sheet_layout.cells,
+            "free_positions_last_sheet": sheet_layout.cells - next_skip if next_skip > 0 else 0,
+            "skip_counter": {
+                "current": self.get_skip_counter(sheet_layout),
+                "after_job": next_skip,
+            },
+            "parts": sum(1 for _ in self._split_job(label, total_pages)),
+            "estimate": self._job_history.estimate((label.pk, engine), total_pages, distinct_labels),
+        }
+
+    def _render_job(
+        self,
+        label: LabelTemplate,
+        input_items: list,
+        request,
+        sheet_layout: SheetLayout,
+        engine: str,
+        printing_options: dict,
+        progress: Callable[[int], None] | None,
+        timings: JobTimings,
+        page_range: range | None = None
+    ) -> bytes | PdfFile:
+        """
+        Renders the PDF of a job, or only of the pages in page_range, with the render engine
+        selected by _get_render_engine().
+        """
+        # a broken template aborts the job (or is no longer rendered) after repeated equal failures
+        failures = RenderFailures(
+            self.get_setting("RENDER_ERROR_THRESHOLD"),
+            abort=self.get_setting("RENDER_ERROR_ACTION") == "abort"
+        )
+        try:
+            if engine == "impose":
+                pdf = self._impose_labels(
+                    label, input_items, request, sheet_layout, printing_options, progress, timings, page_range, failures
+                )
+            else:
+                cells = self._cell_renderer(label, request, timings, failures)
+                try:
+                    pdf = self._render_sheets(
+                        label, input_items, request, sheet_layout, engine, printing_options, progress, timings,
+                        page_range, cells
+                    )
+                except PageCountMismatch as exc:
+                    if engine != "stamp":
+                        raise
+                    # a label overflowed onto a second page, which the single document engine lays out as is
+                    _log.warning(
+                        f"Could not stamp the labels ({exc}), probably because a label is larger than its cell. "
+                        "Rendering the job with the single document engine instead"
+                    )
+                    # the cells rendered for the stamps are reused, so the templates are neither rendered
+                    # nor their failures counted again. Streaming would drop them, so it is done in memory.
+                    engine = "html"
+                    pdf = self._render_sheets(
+                        label, input_items, request, sheet_layout, engine, printing_options, progress, timings,
+                        page_range, cells, stream=False
+                    )
+        except RenderAborted as exc:
+            raise ValidationError(str(exc))
+        finally:
+            failures.finish()
+            if failures.failures:
+                timings.add("cells", 0, failed=failures.failures, not_rendered=failures.skipped)
+        _log.debug(f"Rendered the job with the '{engine}' engine")
+        return pdf
+
+    def _plan_job(
+        self, input_items: list, printing_options: dict, sheet_layout: SheetLayout, page_range: range | None = None
+    ) -> tuple[Iterable[list], int, list]:
+        """
+        Plans the pages of a job, or only the pages in page_range for a part of a job.
+
+        Returns:
+            pages: the items of every page (None for skipped positions), planned lazily for whole jobs
+            total_pages: number of planned pages
+            items: the items shown on the planned pages
+        """
+        label_count: int = printing_options.get("count", 1)
+        skip_count: int = printing_options.get("skip", 0)
+        pages = plan_pages(input_items, label_count, skip_count, sheet_layout.cells)
+        total_pages = page_count(len(input_items), label_count, skip_count, sheet_layout.cells)
+        if page_range is None:
+            return pages, total_pages, input_items
 
-        # generate all pages
-        pages = []
-        idx = 0
-        while idx < len(items):
-            if page := self.print_page(
-                label, items[idx : idx + sheet_layout.cells], request, sheet_layout
-            ):
-                pages.append(page)
+        pages = list(itertools.islice(pages, page_range.start, page_range.stop))
+        return pages, len(pages), [item for page in pages for item in page if item is not None]
+
+    def _split_job(self, label: LabelTemplate, total_pages: int) -> Iterator[range]:
+        """
+        Yields the page ranges of the parts a job is split into according to the maximum
+        number of pages and the maximum estimated size of a part. The size is estimated
+        from the PDFs previously rendered with the template, which includes the parts of
+        this job rendered so far. Always yields at least one range.
+        """
+        max_pages: int = self.get_setting("SPLIT_MAX_PAGES")
+        max_bytes: int = self.get_setting("SPLIT_MAX_SIZE") * 1024 * 1024
+        start = 0
+        while True:
+            pages = total_pages - start
+            if max_pages > 0:
+                pages = min(pages, max_pages)
+            if max_bytes > 0:
+                bytes_per_page = self._bytes_per_page.get(label.pk, DEFAULT_BYTES_PER_PAGE)
+                pages = min(pages, max(1, int(max_bytes // bytes_per_page)))
+            yield range(start, start + pages)
+            start += pages
+            if start >= total_pages:
+                return
+
+    def _record_page_size(self, label: LabelTemplate, pdf: bytes | PdfFile, pages: int) -> None:
+        """
+        Updates the running average of the PDF size per page of a template, used for splitting jobs.
+        """
+        if pages <= 0:
+            return
+        size = pdf.size if isinstance(pdf, PdfFile) else len(pdf)
+        previous = self._bytes_per_page.get(label.pk)
+        current = size / pages
+        self._bytes_per_page[label.pk] = current if previous is None else (previous + current) / 2
+
+    def _get_render_engine(self, printing_options: dict) -> str:
+        """
+        Returns the render engine selected for a job, falling back to the
+        single document engine if the selected one is not available.
+        """
+        engine = printing_options.get("backend", "default")
+        if engine not in RENDER_ENGINES:
+            engine = self.get_setting("RENDER_ENGINE")
+        if engine in ("stamp", "impose") and get_pypdf() is None:
+            _log.warning(f"The '{engine}' render engine requires the 'pypdf' package, falling back to a single document")
+            engine = "html"
+        if engine != "html" and (pdf_variant := self._get_pdf_options(printing_options).pdf_variant):
+            # the sheets composed by the other engines don't carry the required metadata
+            _log.warning(f"{pdf_variant} requires the single document render engine, using it instead")
+            engine = "html"
+        return engine
+
+    def _get_pdf_options(self, printing_options: dict) -> PdfOptions:
+        """
+        Returns the options for writing the PDF of a job, from the plugin settings
+        or the preset selected for the job.
+        """
+        optimization = printing_options.get("pdf_optimization", "settings")
+        if optimization == "standard":
+            return PdfOptions()
+        if optimization == "small":
+            return PdfOptions(image_dpi=150, jpeg_quality=80)
+
+        variant = self.get_setting("PDF_VARIANT")
+        options = PdfOptions(
+            subset_fonts=self.get_setting("PDF_SUBSET_FONTS"),
+            image_dpi=self.get_setting("PDF_IMAGE_DPI"),
+            jpeg_quality=self.get_setting("PDF_JPEG_QUALITY"),
+            compress=self.get_setting("PDF_COMPRESS"),
+            pdf_variant="" if variant == "none" else variant
+        )
+        if optimization == "archive":
+            options = dataclasses.replace(options, pdf_variant="pdf/a-3b")
+        return options
+
+    def _render_sheets(
+        self,
+        label: LabelTemplate,
+        input_items: list,
+        request,
+        sheet_layout: SheetLayout,
+        engine: str,
+        printing_options: dict,
+        progress: Callable[[int], None] | None,
+        timings: JobTimings,
+        page_range: range | None = None,
+        cells: tuple[CellRenderer, AssetTable] | None = None,
+        stream: bool = True
+    ) -> bytes | PdfFile:
+        """
+        Renders a job with the single document ("html") or "stamp" engine.
+
+        Arguments:
+            cells: renderer and asset table of the job (see _cell_renderer()), which keep
+                the cells rendered by a previous attempt, or None to render all cells
+            stream: whether the job may be rendered in streaming mode (see _use_streaming())
+        """
+        label_count: int = printing_options.get("count", 1)
+        planned_pages, total_pages, part_items = self._plan_job(input_items, printing_options, sheet_layout, page_range)
+        border: bool = printing_options.get("border", False)
+        fill_color: str = printing_options.get("fill_color", "")
+        markup: str = self.get_setting("PAGE_MARKUP")
+
+        # render all distinct labels, possibly concurrently. Repeated items are only rendered once per job.
+        renderer, assets = cells or self._cell_renderer(label, request, timings)
+        reused_cells = renderer.hits
+        if engine == "html" and stream and self._use_streaming(printing_options):
+            # the labels are rendered (and prerendered) batch by batch
+            return self._stream_sheets(
+                label, planned_pages, total_pages, request, sheet_layout, printing_options, renderer, assets,
+                progress, timings
+            )
+
+        if label_count > 0:
+            renderer.prerender(part_items, self.get_setting("RENDER_THREADS"))
+
+        # generate all pages. The items of each page are planned lazily by
+        # prepending the required number of skipped null labels and repeating
+        # each label by the specified amount. Generating the pages accounts for
+        # the first half of the progress, the PDF conversion for the second.
+        # The stamp engine doesn't need the page HTML, only which distinct cell is shown where.
+        # Pages showing the same cells (e.g. full sheets of the same item) are
+        # only generated and laid out once and repeated in the output.
+        pages = []                      # HTML of every distinct page
+        page_keys: dict[tuple, int] = {}    # cells of every distinct page -> index in pages
+        page_order = []                 # index in pages of every output page
+        stamps: dict[str, int] = {}     # stamp engine: HTML of every distinct cell -> stamp index
+        sheets = []                     # stamp engine: stamp index of every cell of every page
+        cell_count = 0
+        # the labels rendered while generating the pages are accounted to the cells phase
+        assembly_start, cells_seconds = time.perf_counter(), timings.seconds("cells")
+        for page_items in planned_pages:
+            cell_count += len(page_items)
+            if engine == "stamp":
+                sheets.append([
+                    None if item is None else stamps.setdefault(renderer.render(item), len(stamps))
+                    for item in page_items
+                ])
+            else:
+                page_key = tuple(None if item is None else id(item) for item in page_items)
+                if (page_idx := page_keys.get(page_key)) is None:
+                    if page := self.print_page(
+                        label, page_items, request, sheet_layout, renderer, markup, border, fill_color
+                    ):
+                        page_idx = page_keys[page_key] = len(pages)
+                        pages.append(page)
+                if page_idx is not None:
+                    page_order.append(page_idx)
+            if progress is not None:
+                progress(50 * (len(page_order) + len(sheets)) // total_pages)
+
+        timings.add(
+            "html",
+            time.perf_counter() - assembly_start - (timings.seconds("cells") - cells_seconds),
+            pages=len(page_order) + len(sheets),
+            distinct_pages=len(pages) if engine != "stamp" else len(sheets),
+            cells=cell_count
+        )
+        timings.add("cells", 0, reused=renderer.hits - reused_cells)
+
+        if len(page_order) == 0 and len(sheets) == 0:
+            raise ValidationError(_('No labels were generated'))
+
+        _log.info(
+            "Rendered %d distinct label cells, %d cells reused from memo",
+            renderer.misses,
+            renderer.hits
+        )
+
+        render_options = RenderOptions(
+            data_uris=assets.data_uris,
+            fetcher=self._get_fetcher_config(),
+            pdf=self._get_pdf_options(printing_options)
+        )
+        if engine == "stamp":
+            # render every distinct cell once and place it on the sheets as often as needed
+            pdf = render_stamped_pdf(
+                list(stamps), sheets, sheet_layout, border, fill_color, assets.head_styles(), render_options, timings
+            )
+        else:
+            # render HTML to PDF, either as a single document or in chunks on multiple processes
+            pdf = render_pdf_parallel(
+                pages,
+                lambda chunk: self.wrap_pages(chunk, border, fill_color, sheet_layout, assets.head_styles(), markup),
+                self.get_setting("RENDER_WORKERS"),
+                self.get_setting("RENDER_CHUNK_PAGES"),
+                render_options,
+                progress=None if progress is None else lambda done, total: progress(50 + 50 * done // total),
+                page_order=page_order if len(pages) < len(page_order) else None,
+                timings=timings
+            )
+            _log.debug(f"Laid out {len(pages)} distinct pages for {len(page_order)} output pages")
+
+        if (store := self._get_cell_store()) is not None:
+            _log.debug(f"Rendered label cache: {store.stats()}")
+
+        return pdf
+
+    def _cell_renderer(
+        self, label: LabelTemplate, request, timings: JobTimings, failures: RenderFailures | None = None
+    ) -> tuple[CellRenderer, AssetTable]:
+        """
+        Returns the renderer of the label cells of a job, which are rendered without their own
+        page style, and the asset table the stylesheets and images repeated in every cell are
+        moved to, so they only appear once in the document.
+        """
+        render_func = lambda item: self._render_label(label, item, request)
+        if (store := self._get_cell_store()) is not None:
+            render_func = self._cached_render_func(label, request, store)
+        assets = AssetTable()
+        renderer = CellRenderer(
+            timings.timed_items(render_func),
+            thread_cleanup=connections.close_all,    # render threads use their own DB connections
+            thread_context=render_thread_context(),
+            postprocess=assets.hoist,
+            failures=failures
+        )
+        return renderer, assets
+
+    def _use_streaming(self, printing_options: dict) -> bool:
+        """
+        Returns whether a job with the single document engine is rendered in streaming mode.
+        """
+        if not self.get_setting("STREAM_OUTPUT"):
+            return False
+        if get_pypdf() is None:
+            _log.warning("Streaming output requires the 'pypdf' package, rendering the job in memory")
+            return False
+        if variant := self._get_pdf_options(printing_options).pdf_variant:
+            _log.warning(f"Streaming output is not supported for {variant}, rendering the job in memory")
+            return False
+        return True
+
+    def _stream_sheets(
+        self,
+        label: LabelTemplate,
+        planned_pages: Iterable[list],
+        total_pages: int,
+        request,
+        sheet_layout: SheetLayout,
+        printing_options: dict,
+        renderer: CellRenderer,
+        assets: AssetTable,
+        progress: Callable[[int], None] | None,
+        timings: JobTimings
+    ) -> PdfFile:
+        """
+        Renders a job with the single document engine in batches of pages, writing the PDF
+        to a temporary file. The labels and pages of a batch are only rendered once the
+        previous batch has been converted, and the rendered labels and hoisted assets of
+        the previous batch are dropped, so memory usage is bounded by the batch size.
+        Labels shown in multiple batches are rendered once per batch.
+        """
+        border: bool = printing_options.get("border", False)
+        fill_color: str = printing_options.get("fill_color", "")
+        batch_pages: int = self.get_setting("STREAM_BATCH_PAGES")
+        markup: str = self.get_setting("PAGE_MARKUP")
+        threads: int = self.get_setting("RENDER_THREADS")
+
+        if total_pages == 0:
+            raise ValidationError(_('No labels were generated'))
 
-            idx += sheet_layout.cells
+        def batches():
+            planned = iter(planned_pages)
+            while batch_items := list(itertools.islice(planned, batch_pages)):
+                # the previous batch has been converted, so its cells and assets aren't needed anymore
+                renderer.clear()
+                assets.clear()
+                renderer.prerender((item for page_items in batch_items for item in page_items), threads)
+
+                batch = []
+                for page_items in batch_items:
+                    # the labels rendered while generating the page are accounted to the cells phase
+                    start, cells_seconds = time.perf_counter(), timings.seconds("cells")
+                    page = self.print_page(
+                        label, page_items, request, sheet_layout, renderer, markup, border, fill_color
+                    )
+                    timings.add(
+                        "html",
+                        time.perf_counter() - start - (timings.seconds("cells") - cells_seconds),
+                        pages=1,
+                        cells=len(page_items)
+                    )
+                    if page:
+                        batch.append(page)
+                if batch:
+                    yield batch
+
+        render_options = RenderOptions(
+            data_uris=assets.data_uris,     # filled while the cells are rendered
+            fetcher=self._get_fetcher_config(),
+            pdf=self._get_pdf_options(printing_options)
+        )
+        pdf = render_pdf_streamed(
+            batches(),
+            # the styles of the cells in a batch are known once its pages have been generated
+            lambda batch: self.wrap_pages(batch, border, fill_color, sheet_layout, assets.head_styles(), markup),
+            render_options,
+            progress=None if progress is None else lambda done: progress(100 * done // total_pages),
+            timings=timings
+        )
+        timings.add("cells", 0, reused=renderer.hits)
+        _log.info(f"Streamed {total_pages} pages in batches of {batch_pages} pages, {pdf.size} bytes")
+        return pdf
+
+    def _impose_labels(
+        self,
+        label: LabelTemplate,
+        input_items: list,
+        request,
+        sheet_layout: SheetLayout,
+        printing_options: dict,
+        progress: Callable[[int], None] | None,
+        timings: JobTimings,
+        page_range: range | None = None,
+        failures: RenderFailures | None = None
+    ) -> bytes:
+        """
+        Renders a job with the "impose" engine: every distinct label is rendered to a PDF
+        on its own, with the page size of the template, and then placed onto the sheets.
+        Only a single label is ever laid out at a time, so memory usage doesn't grow with
+        the size of the job (except for the resulting PDF).
+        """
+        border: bool = printing_options.get("border", False)
+        fill_color: str = printing_options.get("fill_color", "")
 
-        if len(pages) == 0:
+        render_options = RenderOptions(
+            fetcher=self._get_fetcher_config(),
+            pdf=self._get_pdf_options(printing_options)
+        )
+        render_func = timings.timed_items(lambda item: self._render_label(label, item, request, page_style=True))
+        composer = SheetComposer(sheet_layout, border, fill_color, clip=True)
+        stamps: dict[int, int | None] = {}     # item id -> stamp index (None if failed)
+        sheets = 0
+        planned_pages, total_pages, _ = self._plan_job(input_items, printing_options, sheet_layout, page_range)
+
+        for page_items in planned_pages:
+            cells = []
+            for item in page_items:
+                if item is not None and id(item) not in stamps:
+                    stamps[id(item)] = None     # failed labels are left empty
+                    # once the breaker is open, the template is broken and not rendered again
+                    if failures is None or not failures.check():
+                        try:
+                            label_pdf = render_label_pdf(render_func(item), render_options, timings)
+                            with timings.phase("compose"):
+                                stamps[id(item)] = composer.add_stamps(label_pdf)[0]
+                        except Exception as exc:
+                            if failures is None:
+                                _log.exception('Error rendering label: %s', str(exc))
+                            else:
+                                failures.record(exc)
+                cells.append(None if item is None else stamps[id(item)])
+            with timings.phase("compose", sheets=1, cells=len(cells)):
+                composer.add_sheet(cells)
+            sheets += 1
+            if progress is not None:
+                progress(100 * sheets // total_pages)
+
+        if sheets == 0:
             raise ValidationError(_('No labels were generated'))
 
-        # render to a single HTML document
-        html_data = self.wrap_pages(pages, border, fill_color, sheet_layout)
+        _log.info("Imposed %d distinct labels onto %d sheets", len(stamps), sheets)
+        with timings.phase("compose"):
+            return composer.write(render_options.pdf.compress)
 
-        # render HTML to PDF
-        html = weasyprint.HTML(string=html_data)
-        return html.render().write_pdf()
+    def _render_label(self, label: LabelTemplate, item, request, page_style: bool = False) -> str:
+        """
+        Renders the label template for a single item to HTML.
+        Note that we disable @page styling for this, unless the label is rendered on its own
+        """
+        if version_pre_0_16_x:
+            return label.render_as_string(
+                request, target_object=item, insert_page_style=page_style
+            )
+        else:
+            return label.render_as_string(
+                item, request, insert_page_style=page_style
+            )
 
-    def print_page(self, label: LabelTemplate, items: list, request, sheet_layout: SheetLayout):
+    def _cached_render_func(self, label: LabelTemplate, request, store: CellStore) -> Callable[[object], str]:
+        """
+        Returns a render function which looks up the rendered cells of items
+        in the persistent store before rendering them.
+        """
+        template_hash = template_fingerprint(label)
+
+        def render(item) -> str:
+            key = cell_key(label.pk, template_hash, item)
+            if (html := store.get(label.pk, key)) is not None:
+                return html
+            html = self._render_label(label, item, request)
+            store.put(label.pk, key, html)
+            return html
+
+        return render
+
+    def print_page(
+        self,
+        label: LabelTemplate,
+        items: list,
+        request,
+        sheet_layout: SheetLayout,
+        renderer: CellRenderer | None = None,
+        markup: str = "table",
+        enable_border: bool = False,
+        fill_color: str = ""
+    ):
         """Generate a single page of labels.
 
         For a single page, generate a table grid of labels.
@@ -331,13 +1372,25 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
             items: The list of database items to print (e.g. StockItem instances)
             request: The HTTP request object which triggered this print job
             sheet_layout: the layout information of a page
+            renderer: cell renderer of the print job, used to reuse already rendered cells
+            markup: "table" for the table grid, or "flat" for absolutely positioned boxes,
+                which WeasyPrint lays out faster (see print_flat_page())
+            enable_border, fill_color: debug options of the job, only used by the flat markup
         """
 
+        if renderer is None:
+            renderer = CellRenderer(lambda item: self._render_label(label, item, request))
+
+        if markup == "flat":
+            return self.print_flat_page(items, sheet_layout, renderer, enable_border, fill_color)
+
+        cell_open_tags = compile_layout(sheet_layout).cell_open_tags
+
         # Generate a table of labels
-        html = """<table class='label-sheet-table'>"""
+        html = ["<table class='label-sheet-table'>"]
 
         for row in range(sheet_layout.rows):
-            html += "<tr class='label-sheet-row'>"
+            html.append("<tr class='label-sheet-row'>")
 
             for col in range(sheet_layout.columns):
                 # Cell index
@@ -346,119 +1399,227 @@ class AdvancedLabelSheetPlugin(LabelPrintingMixin, SettingsMixin, InvenTreePlugi
                 if idx >= len(items):
                     break
 
-                html += f"<td class='label-sheet-cell label-sheet-row-{row} label-sheet-col-{col}'>"
+                html.append(cell_open_tags[idx])
+
+                # Render the individual label template, or an empty cell if skipped (None)
+                html.append(renderer.render(items[idx]))
 
-                # If the label is empty (skipped), render an empty cell
-                if items[idx] is None:
-                    html += """<div class='label-sheet-cell-skip'></div>"""
-                else:
-                    try:
-                        # Render the individual label template
-                        # Note that we disable @page styling for this
-                        if version_pre_0_16_x:
-                            cell = label.render_as_string(
-                                request, target_object=items[idx], insert_page_style=False
-                            )
-                        else:
-                            cell = label.render_as_string(
-                                items[idx], request, insert_page_style=False
-                            )
-                        html += cell
-                    except Exception as exc:
-                        _log.exception('Error rendering label: %s', str(exc))
-                        html += """
-                        <div class='label-sheet-cell-error'></div>
-                        """
-                
                 # overlay for border
-                html += "<div class='label-sheet-cell-overlay'></div>"
+                html.append("<div class='label-sheet-cell-overlay'></div></td>")
 
-                html += '</td>'
+            html.append('</tr>')
 
-            html += '</tr>'
+        html.append('</table>')
 
-        html += '</table>'
+        return ''.join(html)
 
-        return html
+    def print_flat_page(
+        self, items: list, sheet_layout: SheetLayout, renderer: CellRenderer, enable_border: bool, fill_color: str
+    ):
+        """Generate a single page of labels as a flat list of absolutely positioned cells.
 
-    def wrap_pages(self, pages, enable_border: bool, fill_color: str, sheet_layout: SheetLayout):
-        """Wrap the generated pages into a single document."""
+        The cells are placed by inline offsets, so WeasyPrint doesn't have to lay out
+        a table grid which the absolute positioning discards anyway. The border overlay
+        is only added if the border is enabled, and skipped cells are left out entirely
+        unless they are visible (border or fill color).
+        """
+        cell_open_tags = compile_layout(sheet_layout).flat_cell_open_tags
+        show_skipped = enable_border or fill_color not in ["", "unset"]
+        overlay = "<div class='label-sheet-cell-overlay'></div></div>" if enable_border else "</div>"
 
-        inner = ''.join(pages)
+        html = ["<div class='label-sheet-page'>"]
+        for idx, item in enumerate(items[:sheet_layout.cells]):
+            if item is None and not show_skipped:
+                continue
+            html.append(cell_open_tags[idx])
+            html.append(renderer.render(item))
+            html.append(overlay)
+        html.append("</div>")
+
+        return ''.join(html)
+
+    def wrap_pages(
+        self,
+        pages,
+        enable_border: bool,
+        fill_color: str,
+        sheet_layout: SheetLayout,
+        head_styles: list[str] = (),
+        markup: str = "table"
+    ):
+        """Wrap the generated pages into a single document.
 
-        # Generate styles for individual cells (on each page)
-        cell_styles = []
+        Arguments:
+            head_styles: additional style blocks to insert into the document head,
+                e.g. the label template styles hoisted out of the cells
+            markup: markup the pages were generated with, see print_page()
+        """
 
-        for row in range(sheet_layout.rows):
-            cell_styles.append(
-                f"""
-            .label-sheet-row-{row} {{
-                top: {sheet_layout.row_position_top(row)}mm;
-            }}
-            """
-            )
+        stylesheet = compile_layout(sheet_layout).stylesheet(enable_border, fill_color, markup)
 
-        for col in range(sheet_layout.columns):
-            cell_styles.append(
-                f"""
-            .label-sheet-col-{col} {{
-                left: {sheet_layout.column_position_left(col)}mm;
-            }}
+        return ''.join((
             """
-            )
-
-        cell_styles = '\n'.join(cell_styles)
-
-        return f"""
         <head>
-            <style>
-                @page {{
-                    size: {sheet_layout.page_size.width}mm {sheet_layout.page_size.height}mm;
-                    margin: 0mm;
-                    padding: 0mm;
-                }}
-
-                .label-sheet-table {{
-                    page-break-after: always;
-                    table-layout: fixed;
-                    width: {sheet_layout.page_size.width}mm;
-                    border-spacing: 0mm 0mm;
-                }}
-
-                .label-sheet-cell-error {{
-                    background-color: #F00;
-                }}
-
-                .label-sheet-cell {{
-                    width: {sheet_layout.label_width}mm;
-                    height: {sheet_layout.label_height}mm;
-                    padding: 0mm;
-                    position: absolute;
-                    {'background-color: ' + fill_color + ';' if fill_color not in ["", "unset"] else ''};
-                    border-radius: {sheet_layout.corner_radius}mm;
-                }}
-
-                .label-sheet-cell-overlay {{
-                    border: {'0.25mm solid #000' if enable_border else '0mm'};
-                    border-radius: {sheet_layout.corner_radius}mm;
-                    box-sizing: border-box;
-                    width: {sheet_layout.label_width}mm;
-                    height: {sheet_layout.label_height}mm;
-                    padding: 0mm;
-                    position: absolute;
-                    top: 0px;
-                    left: 0px;
-                }}
-
-                {cell_styles}
-
-                body {{
-                    margin: 0mm !important;
-                }}
-            </style>
+            <style>""",
+            stylesheet,
+            """</style>
+            """,
+            *head_styles,
+            """
         </head>
         <body>
-            {inner}
+            """,
+            *pages,
+            """
         </body>
         </html>
-        """
\ No newline at end of file
+        """
+        ))
+
+
+def render_thread_context() -> Callable[[], contextlib.AbstractContextManager]:
+    """
+    Returns a factory of context managers activating the language and time zone of the
+    calling thread (i.e. of the request), which are thread local in Django, so labels
+    rendered on other threads are translated and localized the same way.
+    """
+    language = translation.get_language()
+    time_zone = timezone.get_current_timezone()
+
+    @contextlib.contextmanager
+    def context():
+        with translation.override(language), timezone.override(time_zone):
+            yield
+
+    return context
+
+
+def print_labels_task(
+    plugin_slug: str,
+    template_pk: int,
+    output_pk: int,
+    model_label: str | None,
+    item_pks: list,
+    printing_options: dict
+):
+    """
+    Background task rendering a print job in non-blocking mode (InvenTree 0.16+).
+    All arguments are primary keys and plain values, so the task can be serialized.
+    """
+    from plugin.registry import registry
+    from InvenTree.exceptions import log_error
+
+    plugin: AdvancedLabelSheetPlugin = registry.get_plugin(plugin_slug)
+    label = LabelTemplate.objects.get(pk=template_pk)
+    output = LabelOutput.objects.get(pk=output_pk)
+
+    items = []
+    if model_label is not None:
+        items_by_pk = apps.get_model(model_label).objects.in_bulk(item_pks)
+        items = [items_by_pk[pk] for pk in item_pks if pk in items_by_pk]
+
+    timings = JobTimings()
+    try:
+        pdf = plugin._print_labels(
+            label, items, None,
+            progress=plugin._progress_updater(output),
+            timings=timings,
+            printing_options=printing_options
+        )
+    except Exception:
+        log_error('plugin.advanced_sheet_label.print_labels_task')
+        # an incomplete output would be shown as pending forever
+        output.delete()
+        return
+
+    store_output(output, pdf, timings)
+
+
+def store_output(output: LabelOutput, result: bytes | PdfFile, timings: JobTimings) -> None:
+    """
+    Stores the result of a job (a PDF, or a zip archive of the parts of a split job)
+    in its output and marks it as complete.
+    """
+    with pdf_output_file(result) as output_file:
+        output.output = output_file
+        attach_timings(output, timings)
+        output.progress = 100
+        output.complete = True
+        output.save()
+
+
+@contextlib.contextmanager
+def pdf_output_file(pdf: bytes | PdfFile, name: str | None = None):
+    """
+    Wraps the result of a job into a file for storing it in a LabelOutput. A streamed PDF
+    (or zip archive) is read from its temporary file while it is stored, so it is never
+    held in memory, and deleted afterwards.
+    """
+    if isinstance(pdf, PdfFile):
+        try:
+            with open(pdf.path, "rb") as f:
+                yield File(f, name=name or pdf.filename)
+        finally:
+            pdf.delete()
+    else:
+        yield ContentFile(pdf, name or 'labels.pdf')
+
+
+def preflight_message(plan: dict) -> str:
+    """
+    Returns a single line summary of a preflight plan for the user.
+    """
+    estimate = plan["estimate"]
+    return (
+        f"{plan['labels']} labels on {plan['pages']} sheets of {plan['layout_name']}, "
+        f"{plan['free_positions_last_sheet']} free positions on the last sheet, "
+        f"next skip count {plan['skip_counter']['after_job']}, "
+        + ("no estimate yet" if estimate is None else f"estimated {estimate['seconds']:.1f} s")
+    )
+
+
+def store_preflight(output: LabelOutput, plan: dict) -> None:
+    """
+    Stores a preflight plan as the (JSON) file of an output, which the user downloads instead
+    of the PDF, and marks it as complete. The plan is also stored in the metadata of the
+    output if the output model supports metadata (not in InvenTree 0.16).
+    """
+    if hasattr(output, "set_metadata"):
+        output.set_metadata("adv_sheet_label_preflight", plan, commit=False)
+    output.output = ContentFile(json.dumps(plan, indent=2), 'preflight.json')
+    output.progress = 100
+    output.complete = True
+    output.save()
+    _log.info(f"Preflight: {preflight_message(plan)}")
+
+
+def attach_timings(output: LabelOutput, timings: JobTimings) -> None:
+    """
+    Stores the timings of a job in the metadata of its output, if the output model supports
+    metadata. The output has to be saved afterwards. The LabelOutput of InvenTree 0.16
+    has no metadata, so the timings are only logged there.
+    """
+    if hasattr(output, "set_metadata"):
+        output.set_metadata("adv_sheet_label_timings", timings.as_dict(), commit=False)
+
+
+def _invalidate_template_cells(sender, instance, **kwargs):
+    """
+    Removes the cached cells of a label template when it is saved or deleted.
+    """
+    if _plugin_instance is not ... and (store := _plugin_instance._get_cell_store()) is not None:
+        store.invalidate_template(instance.pk)
+
+
+def _invalidate_skip_counters(sender, instance, **kwargs):
+    """
+    Drops the cached skip counters when they or the settings selecting them are changed,
+    e.g. in the admin interface.
+    """
+    if _plugin_instance is not ... and instance.key in SKIP_COUNTER_SETTINGS:
+        _plugin_instance._skip_counters.invalidate()
+
+
+post_save.connect(_invalidate_template_cells, sender=LabelTemplate, dispatch_uid="adv_sheet_label_template_saved")
+post_delete.connect(_invalidate_template_cells, sender=LabelTemplate, dispatch_uid="adv_sheet_label_template_deleted")
+post_save.connect(_invalidate_skip_counters, sender=PluginSetting, dispatch_uid="adv_sheet_label_skip_counter_saved")
@@ -0,0 +1,273 @@
+"""
+Rendering of the individual label cells of a print job.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+
+SKIP_CELL_HTML = """<div class='label-sheet-cell-skip'></div>"""
+ERROR_CELL_HTML = """
+                        <div class='label-sheet-cell-error'></div>
+                        """
+
+# minimum number of seconds between the summaries of repeated render failures in the log
+FAILURE_LOG_INTERVAL = 10.0
+
+
+class RenderAborted(Exception):
+    """
+    Raised when a job is aborted because the same render failure occurred too often.
+    """
+
+
+class RenderFailures:
+    """
+    Circuit breaker for the label render failures of a single print job.
+
+    Failures are grouped by exception type and message. Only the first failure of
+    every group is logged with its traceback, repeated failures are summarized in
+    the log at most every FAILURE_LOG_INTERVAL seconds. Once a group reaches the
+    threshold, the template is considered broken and the breaker opens: the job is
+    either aborted (RenderAborted) or the remaining cells are filled with error cells
+    without rendering them.
+    """
+
+    def __init__(self, threshold: int = 0, abort: bool = True, log_interval: float = FAILURE_LOG_INTERVAL):
+        """
+        Arguments:
+            threshold: number of equal failures opening the breaker, 0 never opens it
+            abort: whether to abort the job when the breaker opens, or fill the remaining cells
+        """
+        self.threshold = threshold
+        self.abort = abort
+        self.log_interval = log_interval
+        self.groups: dict[tuple[str, str], int] = {}    # (exception type, message) -> count
+        self.failures = 0
+        self.skipped = 0        # cells filled without rendering while open
+        self.tripped: tuple[str, str] | None = None
+        self._last_log = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def open(self) -> bool:
+        return self.tripped is not None
+
+    def check(self) -> bool:
+        """
+        Returns whether the breaker is open, i.e. the next cell should be filled without
+        rendering it. Raises RenderAborted if it is open and the job should be aborted.
+        """
+        if self.tripped is None:
+            return False
+        if self.abort:
+            raise RenderAborted(self.message())
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def record(self, exc: Exception) -> None:
+        """
+        Records a render failure. Raises RenderAborted if the failure opens the breaker
+        and the job should be aborted.
+        """
+        key = (type(exc).__name__, str(exc))
+        with self._lock:
+            self.failures += 1
+            count = self.groups[key] = self.groups.get(key, 0) + 1
+            log_summary = count > 1 and time.monotonic() - self._last_log >= self.log_interval
+            if log_summary:
+                self._last_log = time.monotonic()
+            tripped = self.tripped is None and 0 < self.threshold <= count
+            if tripped:
+                self.tripped = key
+
+        if count == 1:
+            _log.error('Error rendering label: %s', str(exc), exc_info=exc)
+        elif log_summary:
+            _log.warning(f"Label render failures so far: {self.summary()}")
+        if tripped:
+            _log.error(
+                f"Label render failed {count} times with {key[0]}: {key[1]}, "
+                + ("aborting the job" if self.abort else "filling the remaining cells without rendering them")
+            )
+            if self.abort:
+                raise RenderAborted(self.message()) from exc
+
+    def summary(self) -> str:
+        """
+        Returns the failure groups, most frequent first, e.g. "12x KeyError: 'part'".
+        """
+        with self._lock:
+            groups = sorted(self.groups.items(), key=lambda entry: -entry[1])
+        return ", ".join(f"{count}x {name}: {message}" for (name, message), count in groups)
+
+    def message(self) -> str:
+        """
+        Returns the aggregated error shown to the user when the job is aborted.
+        """
+        return f"Rendering the label template failed {self.failures} times ({self.summary()})"
+
+    def finish(self) -> None:
+        """
+        Logs the summary of all failures once the job is done, if any failure was repeated
+        (and therefore not logged individually).
+        """
+        if self.failures > len(self.groups) or self.skipped:
+            _log.warning(
+                f"{self.failures} label render failures"
+                + (f", {self.skipped} cells not rendered" if self.skipped else "")
+                + f": {self.summary()}"
+            )
+
+
+class CellRenderer:
+    """
+    Renders the contents of label sheet cells for a single print job.
+
+    The same item is usually printed many times in a job (number of labels > 1),
+    but the rendered template only depends on the item itself. The rendered HTML
+    is therefore memoized by item identity so every distinct item is only rendered
+    once per job. Skipped positions (None) always produce the same empty cell.
+
+    The renderer must only be used for one job, as the memo is keyed by the identity
+    of the item objects which are only guaranteed to be unique while they are alive.
+    """
+
+    def __init__(
+        self,
+        render_func: Callable[[Any], str],
+        thread_cleanup: Callable[[], None] | None = None,
+        thread_context: Callable[[], contextlib.AbstractContextManager] | None = None,
+        postprocess: Callable[[str], str] | None = None,
+        failures: RenderFailures | None = None
+    ):
+        """
+        Arguments:
+            render_func: function rendering the label template for a single item to HTML
+            thread_cleanup: called by every render thread of prerender() before it exits,
+                e.g. to close the database connections opened by that thread
+            thread_context: returns a context manager every render thread of prerender()
+                renders in, e.g. to activate the language of the request in that thread
+            postprocess: applied once to the HTML of every distinct rendered item before
+                it is memoized, e.g. AssetTable.hoist
+            failures: circuit breaker of the job, by default every failure is logged
+        """
+        self._render_func = render_func
+        self._thread_cleanup = thread_cleanup
+        self._thread_context = thread_context
+        self._postprocess = postprocess
+        self._failures = failures
+        # item id -> (item, html). The item is kept so the id cannot be reused.
+        self._memo: dict[int, tuple[Any, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, item) -> str:
+        """
+        Returns the HTML contents of the cell for the provided item,
+        rendering it only if it hasn't been rendered before in this job.
+        """
+        if item is None:
+            self.hits += 1
+            return SKIP_CELL_HTML
+
+        entry = self._memo.get(id(item))
+        if entry is not None and entry[0] is item:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return self._render_item(item)
+
+    def _render_item(self, item) -> str:
+        """
+        Renders a single item and stores the result in the memo.
+        """
+        if self._failures is not None and self._failures.check():
+            html = ERROR_CELL_HTML      # the template is broken, don't render it again
+        else:
+            try:
+                html = self._render_func(item)
+                if self._postprocess is not None:
+                    html = self._postprocess(html)
+            except Exception as exc:
+                # the failure would be the same for every copy, so it is memoized as well
+                if self._failures is None:
+                    _log.exception('Error rendering label: %s', str(exc))
+                else:
+                    self._failures.record(exc)
+                html = ERROR_CELL_HTML
+
+        with self._lock:
+            self._memo[id(item)] = (item, html)
+        return html
+
+    def clear(self) -> None:
+        """
+        Drops all memoized cells, e.g. once the pages showing them have been converted.
+        """
+        with self._lock:
+            self._memo.clear()
+
+    def prerender(self, items: Iterable, threads: int) -> None:
+        """
+        Renders all distinct items of a job up front on a bounded pool of threads,
+        so the pages can afterwards be assembled from the memo in grid order.
+
+        Rendering a label runs template tags which query the database and generate
+        barcodes, so most of the time is spent waiting on I/O or in C code which
+        releases the GIL.
+
+        Arguments:
+            items: the items of the job (without skipped positions)
+            threads: maximum number of render threads. With 1 or less, nothing is prerendered
+                and all cells are rendered sequentially when they are first needed.
+        """
+        if threads <= 1:
+            return
+
+        pending = []
+        seen: set[int] = set()
+        for item in items:
+            if item is None or id(item) in seen or id(item) in self._memo:
+                continue
+            seen.add(id(item))
+            pending.append(item)
+
+        if len(pending) <= 1:
+            return
+
+        self.misses += len(pending)
+        queue = iter(pending)
+        queue_lock = threading.Lock()
+
+        # thread local state of the calling thread (e.g. the active language) isn't inherited
+        thread_context = self._thread_context or contextlib.nullcontext
+
+        def worker():
+            try:
+                with thread_context():
+                    while True:
+                        with queue_lock:
+                            item = next(queue, None)
+                        if item is None:
+                            return
+                        self._render_item(item)
+            finally:
+                if self._thread_cleanup is not None:
+                    self._thread_cleanup()
+
+        thread_count = min(threads, len(pending))
+        _log.debug(f"Rendering {len(pending)} distinct labels on {thread_count} threads")
+        with ThreadPoolExecutor(max_workers=thread_count, thread_name_prefix="adv-sheet-label-render") as executor:
+            for future in [executor.submit(worker) for _ in range(thread_count)]:
+                future.result()
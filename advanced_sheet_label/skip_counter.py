@@ -0,0 +1,133 @@
+"""
+Automatic label skip counter, i.e. the number of used up positions on the current sheet.
+
+The counters are stored in plugin settings, either as a single global counter or as
+one counter per sheet layout. They are cached in process together with the settings
+selecting the counter (scope and default layout), as they are read every time the
+printing options form is requested, and updated in a transaction locking the setting
+row once a job has been rendered successfully.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from django.db import transaction
+
+from plugin.models import PluginSetting
+
+
+_log = logging.getLogger('inventree-adv-sheet-label')
+
+# setting storing the global counter
+GLOBAL_COUNTER_KEY = "LABEL_SKIP_COUNTER"
+# setting storing the per layout counters as a JSON object (layout key -> counter)
+LAYOUT_COUNTERS_KEY = "LABEL_SKIP_COUNTERS"
+# settings selecting which counter is used
+SCOPE_KEY = "SKIP_COUNTER_SCOPE"
+DEFAULT_LAYOUT_KEY = "DEFAULT_LAYOUT"
+# settings cached by SkipCounters, whose changes have to invalidate the cache
+SKIP_COUNTER_SETTINGS = (GLOBAL_COUNTER_KEY, LAYOUT_COUNTERS_KEY, SCOPE_KEY, DEFAULT_LAYOUT_KEY)
+# seconds after which cached counters are read again, so updates by other processes are picked up
+CACHE_TTL = 5.0
+# maximum number of stored per layout counters, the least recently used are dropped
+# so the value fits into the setting
+MAX_LAYOUT_COUNTERS = 40
+
+
+class SkipCounters:
+    """
+    In-process cache of the skip counters of a plugin instance and of the settings
+    selecting the counter.
+    """
+
+    def __init__(self, plugin, ttl: float = CACHE_TTL):
+        self._plugin = plugin
+        self.ttl = ttl
+        # setting key -> (expiry time, parsed value)
+        self._cache: dict[str, tuple[float, object]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(key: str, value) -> object:
+        if key == GLOBAL_COUNTER_KEY:
+            return int(value or 0)
+        if key != LAYOUT_COUNTERS_KEY:
+            return value
+        try:
+            counters = json.loads(value or "{}")
+        except ValueError:
+            _log.warning(f"Invalid per layout skip counters '{value}', resetting them")
+            return {}
+        return counters if isinstance(counters, dict) else {}
+
+    def _load(self, key: str) -> object:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+        value = self._parse(key, self._plugin.get_setting(key))
+        self._store(key, value)
+        return value
+
+    def _store(self, key: str, value: object) -> None:
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self) -> None:
+        """
+        Drops the cached counters and settings, e.g. after the settings were changed.
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def per_layout(self) -> bool:
+        """
+        Returns whether there is a counter per layout instead of a global one.
+        """
+        return self._load(SCOPE_KEY) == "layout"
+
+    def default_layout(self) -> str:
+        """
+        Returns the default layout setting (a layout key or an automatic detection option).
+        """
+        return self._load(DEFAULT_LAYOUT_KEY)
+
+    def get(self, layout_key: str | None = None) -> int:
+        """
+        Returns the counter of a layout, or the global counter if layout_key is None.
+        """
+        if layout_key is None:
+            return self._load(GLOBAL_COUNTER_KEY)
+        return int(self._load(LAYOUT_COUNTERS_KEY).get(layout_key, 0))
+
+    def last_used_layout(self) -> str | None:
+        """
+        Returns the key of the layout whose counter was updated last.
+        """
+        return next(reversed(self._load(LAYOUT_COUNTERS_KEY)), None)
+
+    def commit(self, counter: int, layout_key: str | None = None) -> None:
+        """
+        Stores the counter of a layout, or the global counter if layout_key is None.
+        The setting row is locked during the update, so concurrent (e.g. background)
+        jobs don't interleave their updates. The per layout counters are merged with
+        the current value in the database, so updates of other layouts aren't lost.
+        """
+        key = GLOBAL_COUNTER_KEY if layout_key is None else LAYOUT_COUNTERS_KEY
+        with transaction.atomic():
+            setting = PluginSetting.objects.select_for_update().filter(
+                plugin=self._plugin.plugin_config(), key=key
+            ).first()
+            if layout_key is None:
+                value = counter
+                self._plugin.set_setting(key, counter)
+            else:
+                value = self._parse(key, setting.value if setting is not None else None)
+                value.pop(layout_key, None)
+                value[layout_key] = counter     # most recently used last
+                while len(value) > MAX_LAYOUT_COUNTERS:
+                    value.pop(next(iter(value)))
+                self._plugin.set_setting(key, json.dumps(value))
+        self._store(key, value)
@@ -0,0 +1,101 @@
+"""
+Measures how long it takes to import the plugin modules in a fresh interpreter,
+i.e. the cost the plugin adds to the startup of every InvenTree worker and
+management command.
+
+Usage (from the repository root):
+    python benchmarks/bench_import.py [--repeat N] [--plugin]
+
+With --plugin, the full plugin module (including the InvenTree plugin registry
+imports) is measured as well. This has to be run in an InvenTree environment,
+e.g. from the InvenTree source directory with DJANGO_SETTINGS_MODULE set.
+
+For comparison, the script also reports the time to import WeasyPrint itself,
+which the plugin no longer pays at load time.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# code executed in the fresh interpreter, prints import time and whether weasyprint was loaded
+PROBE = """
+import sys, time, json
+{setup}
+start = time.perf_counter()
+import {module}
+{touch}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "weasyprint_loaded": "weasyprint" in sys.modules}}))
+"""
+
+DJANGO_SETUP = "import django; django.setup()"
+
+
+def measure(module: str, repeat: int, setup: str = "", touch: str = "", name: str | None = None) -> dict | None:
+    """
+    Imports the module in repeat fresh interpreters and returns the timing statistics,
+    or None if the module cannot be imported in this environment.
+    """
+    samples = []
+    weasyprint_loaded = False
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(setup=setup, module=module, touch=touch)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            print(f"{module}: import failed\n{result.stderr.strip()}", file=sys.stderr)
+            return None
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        samples.append(data["seconds"])
+        weasyprint_loaded |= data["weasyprint_loaded"]
+
+    return {
+        "name": name or module,
+        "median_ms": statistics.median(samples) * 1000,
+        "min_ms": min(samples) * 1000,
+        "weasyprint_loaded": weasyprint_loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="number of fresh interpreters per measurement")
+    parser.add_argument("--plugin", action="store_true", help="also measure the plugin module (requires InvenTree)")
+    args = parser.parse_args()
+
+    results = [
+        measure("advanced_sheet_label.layouts", args.repeat),
+        # building the layout choices on first access
+        measure(
+            "advanced_sheet_label.layouts", args.repeat,
+            touch="advanced_sheet_label.layouts.get_layout_select_options()",
+            name="layouts + layout select options"
+        ),
+        measure("advanced_sheet_label.pdf_engine", args.repeat),
+        measure("weasyprint", args.repeat),
+    ]
+    if args.plugin:
+        results.append(measure("advanced_sheet_label.printing_plugin", args.repeat, setup=DJANGO_SETUP))
+
+    for result in results:
+        if result is None:
+            continue
+        print(
+            f"{result['name']:<40} median {result['median_ms']:8.2f} ms  "
+            f"min {result['min_ms']:8.2f} ms  "
+            f"weasyprint loaded: {result['weasyprint_loaded']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
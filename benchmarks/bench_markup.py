@@ -0,0 +1,138 @@
+"""
+Compares the table grid and flat page markup (see AdvancedLabelSheetPlugin.print_page())
+for every layout in LAYOUTS: the WeasyPrint layout time (render) of the same job in
+both markups and whether the rasterized pages are identical.
+
+The InvenTree stand-ins of bench_pipeline.py are used. WeasyPrint is required, the
+pixel comparison additionally needs pypdfium2 (pip install pypdfium2) and is skipped
+without it.
+
+Usage (from the repository root):
+    python benchmarks/bench_markup.py [--layouts KEY ...] [--items 50] [--skip 7]
+        [--repeat 3] [--dpi 100]
+
+Every layout is rendered with the given number of items and skipped positions, once
+without and once with the border and a fill color, as the flat markup leaves out the
+border overlay and skipped cells when they are invisible. The run fails (exit code 1)
+if any page differs between the markups.
+"""
+
+import argparse
+import sys
+import time
+
+from bench_pipeline import ROOT, StubItem, StubTemplate, install_inventree_stubs
+
+
+MARKUPS = ("table", "flat")
+
+
+def rasterize(pdf: bytes, dpi: int) -> list[bytes] | None:
+    """
+    Returns the RGB pixels of every page of a PDF, None if pypdfium2 isn't installed.
+    """
+    try:
+        import pypdfium2
+    except ImportError:
+        return None
+    document = pypdfium2.PdfDocument(pdf)
+    try:
+        return [
+            page.render(scale=dpi / 72).to_pil().convert("RGB").tobytes()
+            for page in document
+        ]
+    finally:
+        document.close()
+
+
+def run_case(layout_key: str, items: int, skip: int, debug: bool, repeat: int, dpi: int) -> dict:
+    """
+    Renders one job in both markups and returns the fastest layout time of each,
+    the page count and whether the pages are identical (None if not compared).
+    """
+    from advanced_sheet_label.layouts import LAYOUTS
+    from advanced_sheet_label.pdf_engine import get_weasyprint
+    from advanced_sheet_label.planning import plan_pages
+    from advanced_sheet_label.printing_plugin import AdvancedLabelSheetPlugin
+    from advanced_sheet_label.rendering import CellRenderer
+
+    weasyprint = get_weasyprint()
+    plugin = AdvancedLabelSheetPlugin()
+    layout = LAYOUTS[layout_key]
+    template = StubTemplate(1, layout.label_width, layout.label_height, {"sheet_layout": layout_key})
+    job_items = [StubItem(pk) for pk in range(1, items + 1)]
+    border, fill_color = (True, "#eee") if debug else (False, "unset")
+
+    result = {}
+    for markup in MARKUPS:
+        renderer = CellRenderer(lambda item: plugin._render_label(template, item, None))
+        pages = [
+            plugin.print_page(template, page_items, None, layout, renderer, markup, border, fill_color)
+            for page_items in plan_pages(job_items, 1, skip, layout.cells)
+        ]
+        html_data = plugin.wrap_pages(pages, border, fill_color, layout, (), markup)
+
+        seconds = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            document = weasyprint.HTML(string=html_data).render()
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+        result[markup] = {
+            "seconds": seconds,
+            "pages": len(document.pages),
+            "html_bytes": len(html_data.encode()),
+            "pdf": document.write_pdf(),
+        }
+
+    table_pixels = rasterize(result["table"].pop("pdf"), dpi)
+    flat_pixels = rasterize(result["flat"].pop("pdf"), dpi)
+    result["identical"] = None if table_pixels is None else table_pixels == flat_pixels
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layouts", nargs="*", help="layout keys to benchmark (default: all)")
+    parser.add_argument("--items", type=int, default=50, help="number of items per job")
+    parser.add_argument("--skip", type=int, default=7, help="skipped positions on the first sheet")
+    parser.add_argument("--repeat", type=int, default=3, help="layout runs per markup, the fastest is reported")
+    parser.add_argument("--dpi", type=int, default=100, help="resolution of the pixel comparison")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    install_inventree_stubs()
+
+    from advanced_sheet_label.layouts import LAYOUTS
+
+    differences = []
+    compared = True
+    for layout_key in args.layouts or list(LAYOUTS):
+        for debug in (False, True):
+            result = run_case(layout_key, args.items, args.skip, debug, args.repeat, args.dpi)
+            table, flat = result["table"], result["flat"]
+            if result["identical"] is None:
+                compared = False
+                pixels = "not compared"
+            else:
+                pixels = "identical" if result["identical"] else "DIFFERENT"
+            if result["identical"] is False or table["pages"] != flat["pages"]:
+                differences.append(f"{layout_key} (border/fill {'on' if debug else 'off'})")
+            print(
+                f"{layout_key:<16} border/fill {'on ' if debug else 'off'}  "
+                f"table {table['seconds'] * 1000:9.2f} ms  flat {flat['seconds'] * 1000:9.2f} ms  "
+                f"({table['seconds'] / flat['seconds']:5.2f}x)  "
+                f"HTML {table['html_bytes'] / 1024:7.1f} -> {flat['html_bytes'] / 1024:7.1f} KiB  "
+                f"pages {table['pages']}/{flat['pages']}  pixels {pixels}"
+            )
+
+    if not compared:
+        print("Install pypdfium2 to compare the pixel output", file=sys.stderr)
+    for difference in differences:
+        print(f"DIFFERENCE {difference}", file=sys.stderr)
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Benchmarks the stages of the sheet rendering pipeline without an InvenTree server:
+layout matching (_find_closest_match), page generation (print_page, including rendering
+the labels and hoisting their styles and images as in a print job), document assembly
+(wrap_pages) and the PDF conversion of the plugin (render_pdf) with the url_fetcher and
+PDF options of the default plugin settings, split into the WeasyPrint layout (render)
+and PDF output (write_pdf).
+
+Every layout in LAYOUTS is swept across the configured item counts, copy counts
+and skip values. The InvenTree modules imported by the plugin are replaced by
+minimal stand-ins, the labels are rendered from stub templates for synthetic
+items. Django and Django REST framework have to be installed, WeasyPrint is
+only needed for the render and write_pdf stages (they are skipped otherwise).
+
+Usage (from the repository root):
+    python benchmarks/bench_pipeline.py [--layouts KEY ...] [--counts 1,50] [--copies 1,4]
+        [--skips 0,7] [--repeat N] [--isolate] [--no-render]
+        [--save BASELINE.json] [--compare BASELINE.json] [--threshold 0.25]
+
+Reported per case and stage: wall time (fastest of --repeat runs), peak RSS of the
+process after the stage and, for write_pdf, the size of the PDF. The peak RSS is a
+high-water mark, so use --isolate to run every case in a fresh process to get
+meaningful values per case.
+
+With --compare, the run fails (exit code 1) if any stage got slower than the
+baseline by more than --threshold (a fraction, ignoring differences below
+--min-delta-ms) or produced a PDF larger by more than --threshold.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import types
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ("find_closest_match", "print_page", "wrap_pages", "render", "write_pdf")
+
+
+class StubTemplate:
+    """
+    Stand-in for an InvenTree LabelTemplate, rendering a small label with
+    a style block and a few lines of item data.
+    """
+
+    def __init__(self, pk: int, width: float, height: float, metadata: dict | None = None):
+        self.pk = pk
+        self.width = width
+        self.height = height
+        self.metadata = metadata or {}
+
+    def render_as_string(self, item, request, insert_page_style: bool = True) -> str:
+        page_style = f"@page {{ size: {self.width}mm {self.height}mm; margin: 0mm; }}" if insert_page_style else ""
+        return (
+            f"<style>{page_style} .bench-label {{ font-family: sans-serif; font-size: 2.5mm; padding: 1mm; }}</style>"
+            f"<div class='bench-label'><b>{item.name}</b><br>IPN {item.ipn}<br>Qty {item.quantity}</div>"
+        )
+
+
+class StubItem:
+    def __init__(self, pk: int):
+        self.pk = pk
+        self.name = f"Item {pk}"
+        self.ipn = f"BENCH-{pk:05d}"
+        self.quantity = pk * 3 % 97
+
+
+def install_inventree_stubs() -> None:
+    """
+    Registers minimal versions of the InvenTree modules imported by the plugin
+    and configures Django, so the plugin module can be imported on its own.
+    """
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        settings.configure(INSTALLED_APPS=[], USE_I18N=False)
+        django.setup()
+
+    class InvenTreePlugin:
+        def __init__(self):
+            self._settings: dict = {}
+
+    class SettingsMixin:
+        def get_setting(self, key: str):
+            return self._settings.get(key, self.SETTINGS[key].get("default"))
+
+        def set_setting(self, key: str, value) -> None:
+            self._settings[key] = value
+
+    class LabelPrintingMixin:
+        pass
+
+    modules = {
+        "plugin": {"InvenTreePlugin": InvenTreePlugin},
+        "plugin.mixins": {"LabelPrintingMixin": LabelPrintingMixin, "SettingsMixin": SettingsMixin},
+        "plugin.models": {"PluginSetting": type("PluginSetting", (), {})},
+        "report": {},
+        "report.models": {
+            "LabelOutput": type("LabelOutput", (), {}),
+            "LabelTemplate": StubTemplate,
+        },
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules.setdefault(name, module)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def case_id(case: dict) -> str:
+    return f"{case['layout']}/items={case['items']}/copies={case['copies']}/skip={case['skip']}"
+
+
+def run_case(case: dict, repeat: int, render: bool) -> dict:
+    """
+    Runs all stages of one case repeat times and returns the fastest time of each stage.
+    """
+    from advanced_sheet_label import layouts
+    from advanced_sheet_label.instrumentation import JobTimings
+    from advanced_sheet_label.pdf_engine import RenderOptions, get_weasyprint, render_pdf
+    from advanced_sheet_label.planning import plan_pages
+    from advanced_sheet_label.printing_plugin import AdvancedLabelSheetPlugin
+
+    if render:
+        try:
+            get_weasyprint()
+        except ImportError:
+            render = False
+
+    plugin = AdvancedLabelSheetPlugin()
+    markup = plugin.get_setting("PAGE_MARKUP")
+    layout = layouts.LAYOUTS[case["layout"]]
+    items = [StubItem(pk) for pk in range(1, case["items"] + 1)]
+    # without metadata, so the size based search is measured
+    search_template = StubTemplate(1, layout.label_width, layout.label_height)
+    template = StubTemplate(1, layout.label_width, layout.label_height, {"sheet_layout": case["layout"]})
+
+    results: dict[str, dict] = {}
+
+    def record(stage: str, seconds: float, **extra) -> None:
+        result = results.setdefault(stage, {"seconds": seconds})
+        result["seconds"] = min(result["seconds"], seconds)
+        result["peak_rss_mb"] = peak_rss_mb()
+        result.update(extra)
+
+    for _ in range(repeat):
+        # the layout search is cached per template geometry, so measure it cold
+        layouts.match_layout.cache_clear()
+        start = time.perf_counter()
+        plugin._find_closest_match(search_template, False)
+        record("find_closest_match", time.perf_counter() - start)
+
+        # the cells are rendered and their styles and images hoisted as in a print job
+        timings = JobTimings()
+        renderer, assets = plugin._cell_renderer(template, None, timings)
+        start = time.perf_counter()
+        pages = [
+            page
+            for page_items in plan_pages(items, case["copies"], case["skip"], layout.cells)
+            if (page := plugin.print_page(template, page_items, None, layout, renderer, markup, False, "unset"))
+        ]
+        record("print_page", time.perf_counter() - start, pages=len(pages))
+
+        start = time.perf_counter()
+        html_data = plugin.wrap_pages(pages, False, "unset", layout, assets.head_styles(), markup)
+        record("wrap_pages", time.perf_counter() - start, html_bytes=len(html_data.encode()))
+
+        if not render or len(pages) == 0:
+            continue
+
+        # with the url_fetcher and PDF options of the plugin settings
+        render_options = RenderOptions(
+            data_uris=assets.data_uris,
+            fetcher=plugin._get_fetcher_config(),
+            pdf=plugin._get_pdf_options({})
+        )
+        pdf = render_pdf(html_data, render_options, timings=timings)
+        record("render", timings.seconds("render"))
+        record("write_pdf", timings.seconds("write_pdf"), pdf_bytes=len(pdf))
+
+    return results
+
+
+def run_isolated(case: dict, repeat: int, render: bool) -> dict:
+    """
+    Runs a case in a fresh interpreter, so its peak RSS isn't affected by other cases.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--case", json.dumps(case), "--repeat", str(repeat)]
+    if not render:
+        command.append("--no-render")
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{case_id(case)} failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float) -> list[str]:
+    """
+    Returns a description of every stage that regressed compared to the baseline.
+    """
+    regressions = []
+    for case, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if base is None:
+                continue
+            if (
+                result["seconds"] > base["seconds"] * (1 + threshold)
+                and result["seconds"] - base["seconds"] > min_delta
+            ):
+                regressions.append(
+                    f"{case} {stage}: {result['seconds'] * 1000:.2f} ms "
+                    f"(baseline {base['seconds'] * 1000:.2f} ms)"
+                )
+            if "pdf_bytes" in result and "pdf_bytes" in base and result["pdf_bytes"] > base["pdf_bytes"] * (1 + threshold):
+                regressions.append(
+                    f"{case} {stage}: PDF {result['pdf_bytes']} bytes (baseline {base['pdf_bytes']} bytes)"
+                )
+    return regressions
+
+
+def parse_ints(value: str) -> list[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layouts", nargs="*", help="layout keys to benchmark (default: all)")
+    parser.add_argument("--counts", type=parse_ints, default=[1, 50], help="comma separated item counts")
+    parser.add_argument("--copies", type=parse_ints, default=[1, 4], help="comma separated copy counts")
+    parser.add_argument("--skips", type=parse_ints, default=[0, 7], help="comma separated skip values")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest is reported")
+    parser.add_argument("--isolate", action="store_true", help="run every case in a fresh process")
+    parser.add_argument("--no-render", action="store_true", help="skip the WeasyPrint stages")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="fail on regressions compared to a baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore slowdowns below this")
+    parser.add_argument("--case", help=argparse.SUPPRESS)     # internal, used by --isolate
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    install_inventree_stubs()
+    render = not args.no_render
+
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case), args.repeat, render)))
+        return
+
+    from advanced_sheet_label.layouts import LAYOUTS
+
+    layout_keys = args.layouts or list(LAYOUTS)
+    results: dict[str, dict] = {}
+    for layout, items, copies, skip in itertools.product(layout_keys, args.counts, args.copies, args.skips):
+        case = {"layout": layout, "items": items, "copies": copies, "skip": skip}
+        if args.isolate:
+            stages = run_isolated(case, args.repeat, render)
+        else:
+            stages = run_case(case, args.repeat, render)
+        results[case_id(case)] = stages
+        print(case_id(case))
+        for stage in STAGES:
+            if (result := stages.get(stage)) is None:
+                continue
+            size = f"  PDF {result['pdf_bytes'] / 1024:8.1f} KiB" if "pdf_bytes" in result else ""
+            print(
+                f"    {stage:<20} {result['seconds'] * 1000:10.3f} ms  "
+                f"peak RSS {result['peak_rss_mb']:8.1f} MiB{size}"
+            )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "meta": {"python": platform.python_version(), "platform": platform.platform()},
+                "results": results,
+            }, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms / 1000)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions compared to {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
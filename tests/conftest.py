@@ -0,0 +1,28 @@
+import sys
+
+import pytest
+
+from stubs import FakeWeasyPrint, install_inventree_stubs
+
+install_inventree_stubs()
+
+
+@pytest.fixture
+def weasyprint(monkeypatch):
+    """
+    Replaces WeasyPrint with a FakeWeasyPrint of the latest version.
+    """
+    pytest.importorskip("pypdf")
+    module = FakeWeasyPrint()
+    monkeypatch.setitem(sys.modules, "weasyprint", module)
+    return module
+
+
+@pytest.fixture
+def plugin():
+    """
+    Plugin instance with the default settings.
+    """
+    from advanced_sheet_label.printing_plugin import AdvancedLabelSheetPlugin
+
+    return AdvancedLabelSheetPlugin()
@@ -0,0 +1,130 @@
+"""
+Stand-ins for the InvenTree modules imported by the plugin and for WeasyPrint,
+so the plugin can be tested without an InvenTree server or the native libraries
+of WeasyPrint.
+"""
+
+import io
+import sys
+import types
+
+
+class StubTemplate:
+    """
+    Stand-in for an InvenTree LabelTemplate, rendering a label with a style block.
+    """
+
+    def __init__(self, pk: int, width: float, height: float, metadata: dict | None = None):
+        self.pk = pk
+        self.width = width
+        self.height = height
+        self.metadata = metadata or {}
+
+    def render_as_string(self, item, request, insert_page_style: bool = True) -> str:
+        page_style = f"@page {{ size: {self.width}mm {self.height}mm; margin: 0mm; }}" if insert_page_style else ""
+        return f"<style>{page_style} .label {{ padding: 1mm; }}</style><div class='label'>{item.name}</div>"
+
+
+class StubItem:
+    def __init__(self, pk: int):
+        self.pk = pk
+        self.name = f"Item {pk}"
+
+
+def install_inventree_stubs() -> None:
+    """
+    Registers minimal versions of the InvenTree modules imported by the plugin
+    and configures Django, so the plugin module can be imported on its own.
+    """
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        settings.configure(INSTALLED_APPS=[], USE_I18N=False)
+        django.setup()
+
+    class InvenTreePlugin:
+        def __init__(self):
+            self._settings: dict = {}
+
+    class SettingsMixin:
+        def get_setting(self, key: str):
+            return self._settings.get(key, self.SETTINGS[key].get("default"))
+
+        def set_setting(self, key: str, value) -> None:
+            self._settings[key] = value
+
+    class LabelPrintingMixin:
+        pass
+
+    modules = {
+        "plugin": {"InvenTreePlugin": InvenTreePlugin},
+        "plugin.mixins": {"LabelPrintingMixin": LabelPrintingMixin, "SettingsMixin": SettingsMixin},
+        "plugin.models": {"PluginSetting": type("PluginSetting", (), {})},
+        "report": {},
+        "report.models": {
+            "LabelOutput": type("LabelOutput", (), {}),
+            "LabelTemplate": StubTemplate,
+        },
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules.setdefault(name, module)
+
+
+class FakeDocument:
+    """
+    Laid out document of FakeWeasyPrint, with one page per page of the sheet markup.
+    """
+
+    def __init__(self, pages: list):
+        self.pages = pages
+
+    def copy(self, pages):
+        return FakeDocument(list(pages))
+
+    def write_pdf(self, target=None, **kwargs):
+        import pypdf
+
+        writer = pypdf.PdfWriter()
+        for _ in self.pages:
+            writer.add_blank_page(100, 100)
+        output = io.BytesIO()
+        writer.write(output)
+        FakeWeasyPrint.write_calls.append(kwargs)
+        return output.getvalue()
+
+
+class FakeHTML:
+    def __init__(self, string: str, url_fetcher=None, **kwargs):
+        self.string = string
+        FakeWeasyPrint.documents.append(string)
+
+    def render(self, **kwargs):
+        FakeWeasyPrint.render_calls.append(kwargs)
+        pages = self.string.count("class='label-sheet-table'") + self.string.count("class='label-sheet-page'")
+        return FakeDocument([None] * max(pages, 1))
+
+
+class FakeWeasyPrint(types.ModuleType):
+    """
+    Module replacing weasyprint, which records the documents and options it is called with
+    and writes a blank page (requires pypdf) for every page of the table or flat sheet markup.
+    """
+
+    HTML = FakeHTML
+    documents: list[str] = []
+    render_calls: list[dict] = []
+    write_calls: list[dict] = []
+
+    def __init__(self, version: str = "62.3"):
+        super().__init__("weasyprint")
+        self.__version__ = version
+        FakeWeasyPrint.documents = []
+        FakeWeasyPrint.render_calls = []
+        FakeWeasyPrint.write_calls = []
+
+    @staticmethod
+    def default_url_fetcher(url: str, *args, **kwargs) -> dict:
+        return {"string": b"", "mime_type": "text/plain", "redirected_url": url}
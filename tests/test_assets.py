@@ -0,0 +1,87 @@
+from urllib.parse import quote
+
+from advanced_sheet_label.assets import ASSET_URL_SCHEME, AssetTable, make_url_fetcher
+
+IMAGE = "data:image/png;base64," + "A" * 400
+
+
+def test_hoist_moves_distinct_styles_to_the_head():
+    assets = AssetTable()
+    first = assets.hoist("<style>.a { color: red; }</style><div class='a'>1</div>")
+    second = assets.hoist("<style>.a { color: red; }</style><div class='a'>2</div>")
+    assert (first, second) == ("<div class='a'>1</div>", "<div class='a'>2</div>")
+    assert assets.head_styles() == ["<style>.a { color: red; }</style>"]
+
+
+def test_hoist_keeps_the_styles_of_inline_svg_images():
+    html = (
+        "<style>.label { margin: 0; }</style>"
+        "<svg><style>.bar { fill: black; }</style><svg><style>.x {}</style></svg><rect class='bar'/></svg>"
+        "<STYLE type='text/css'>.b {}</STYLE>"
+    )
+    assets = AssetTable()
+    assert assets.hoist(html) == (
+        "<svg><style>.bar { fill: black; }</style><svg><style>.x {}</style></svg><rect class='bar'/></svg>"
+    )
+    assert assets.head_styles() == ["<style>.label { margin: 0; }</style>", "<STYLE type='text/css'>.b {}</STYLE>"]
+
+
+def test_hoist_replaces_large_data_uris_with_references():
+    assets = AssetTable()
+    small = "data:image/png;base64,AAAA"
+    html = assets.hoist(f"<img src='{IMAGE}'><img src='{small}'>")
+    (key, uri), = assets.data_uris.items()
+    assert uri == IMAGE
+    assert html == f"<img src='{ASSET_URL_SCHEME}:{key}'><img src='{small}'>"
+
+    fetcher = make_url_fetcher(assets.data_uris, lambda url: {"fallback": url})
+    assert fetcher(f"{ASSET_URL_SCHEME}:{key}")["mime_type"] == "image/png"
+    assert fetcher("https://example.com/a.png") == {"fallback": "https://example.com/a.png"}
+
+
+def test_clear_keeps_the_shared_dictionaries():
+    assets = AssetTable()
+    data_uris = assets.data_uris
+    assets.hoist(f"<style>.a {{}}</style><img src='{IMAGE}'>")
+    assets.clear()
+    assert assets.head_styles() == []
+    assert assets.data_uris is data_uris and data_uris == {}
+
+
+def test_hoist_keeps_percent_encoded_data_uris_intact():
+    svg = (
+        "<svg xmlns='http://www.w3.org/2000/svg' width='10' height='10'>"
+        + "<rect width='10' height='10' style='fill: rgb(255,0,0)'/>" * 5
+        + "</svg>"
+    )
+    uri = "data:image/svg+xml," + quote(svg, safe="=:/,()")
+    assert len(uri) >= 256 and "(" in uri
+    assets = AssetTable()
+    html = assets.hoist(
+        f"<img src=\"{uri}\"><div style=\"background: url('{uri}')\"></div>"
+        f"<style>.a {{ background-image: url('{uri}'); }}</style>"
+    )
+
+    (key, hoisted), = assets.data_uris.items()
+    reference = f"{ASSET_URL_SCHEME}:{key}"
+    assert hoisted == uri
+    assert html == f"<img src=\"{reference}\"><div style=\"background: url('{reference}')\"></div>"
+    assert assets.head_styles() == [f"<style>.a {{ background-image: url('{reference}'); }}</style>"]
+
+    fetcher = make_url_fetcher(assets.data_uris, None)
+    assert fetcher(reference)["string"] == svg.encode()
+
+
+def test_hoist_replaces_unquoted_url_data_uris():
+    assets = AssetTable()
+    html = assets.hoist(f"<style>.a {{ background: url( {IMAGE} ) }}</style><b>label</b>")
+    (key, uri), = assets.data_uris.items()
+    assert html == "<b>label</b>"
+    assert assets.head_styles() == [f"<style>.a {{ background: url( {ASSET_URL_SCHEME}:{key} ) }}</style>"]
+
+
+def test_hoist_ignores_text_which_is_not_a_data_uri():
+    assets = AssetTable(min_data_uri_length=0)
+    html = "<p>\"data: the measured value\"</p>"
+    assert assets.hoist(html) == html
+    assert assets.data_uris == {}
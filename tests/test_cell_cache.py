@@ -0,0 +1,69 @@
+import pytest
+
+from advanced_sheet_label.cell_cache import CellStore, DiskCellStore, DjangoCellStore, cell_key
+from stubs import StubItem, StubTemplate
+
+
+class Meta:
+    label = "part.part"
+
+
+class Part(StubItem):
+    _meta = Meta()
+
+    def __init__(self, pk: int, updated: str = "2024-01-01"):
+        super().__init__(pk)
+        self.updated = updated
+
+
+def test_cell_store_is_abstract():
+    with pytest.raises(TypeError):
+        CellStore()
+
+
+@pytest.fixture(params=["disk", "django"])
+def store(request, tmp_path):
+    if request.param == "disk":
+        return DiskCellStore(str(tmp_path), max_bytes=1024)
+    return DjangoCellStore(alias="default")
+
+
+def test_store_and_invalidate_cells(store):
+    assert store.get(1, "key") is None
+    store.put(1, "key", "<b>label</b>")
+    store.put(2, "key", "<b>other</b>")
+    assert store.get(1, "key") == "<b>label</b>"
+
+    store.invalidate_template(1)
+    assert store.get(1, "key") is None
+    assert store.get(2, "key") == "<b>other</b>"
+    assert (store.stats()["hits"], store.stats()["misses"]) == (2, 2)
+
+
+def test_disk_store_evicts_the_least_recently_used_cells(tmp_path):
+    store = DiskCellStore(str(tmp_path), max_bytes=250)
+    for idx in range(DiskCellStore.EVICTION_INTERVAL):
+        store.put(1, f"key-{idx}", "x" * 100)
+    assert store.stats()["evictions"] == DiskCellStore.EVICTION_INTERVAL - 2
+    assert sum(store.get(1, f"key-{idx}") is not None for idx in range(DiskCellStore.EVICTION_INTERVAL)) == 2
+
+
+def test_cell_key_changes_with_the_item_version():
+    key = cell_key(1, "hash", Part(1))
+    assert cell_key(1, "hash", Part(1)) == key
+    assert cell_key(1, "other", Part(1)) != key
+    assert cell_key(1, "hash", Part(1, "2024-02-01")) != key
+    assert cell_key(1, "hash", Part(2)) != key
+
+
+def test_cached_render_func_renders_missing_cells_once(plugin, tmp_path):
+    calls = []
+    plugin._render_label = lambda label, item, request: calls.append(item.pk) or f"<b>{item.pk}</b>"
+    store = DiskCellStore(str(tmp_path), max_bytes=1024)
+    template = StubTemplate(1, 50, 30)
+
+    render = plugin._cached_render_func(template, None, store)
+    assert [render(Part(1)), render(Part(2))] == ["<b>1</b>", "<b>2</b>"]
+    render = plugin._cached_render_func(template, None, store)
+    assert [render(Part(1)), render(Part(2, "2024-02-01"))] == ["<b>1</b>", "<b>2</b>"]
+    assert calls == [1, 2, 2]
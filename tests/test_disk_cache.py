@@ -0,0 +1,65 @@
+import os
+import stat
+import time
+
+import pytest
+
+from advanced_sheet_label.disk_cache import STALE_TMP_SECONDS, atomic_write, evict, private_directory
+
+posix_only = pytest.mark.skipif(not hasattr(os, "getuid"), reason="no owners and modes")
+
+
+def age(path, seconds: float) -> None:
+    os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+
+@posix_only
+def test_private_directory_is_created_for_the_user_only(tmp_path):
+    directory = str(tmp_path / "cache" / "jobs")
+    assert private_directory(directory) == directory
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert private_directory(directory) == directory
+
+
+@posix_only
+def test_private_directory_rejects_shared_directories(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o755)
+    shared.chmod(0o755)
+    with pytest.raises(PermissionError):
+        private_directory(str(shared))
+
+
+@posix_only
+def test_private_directory_rejects_symlinks(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir(mode=0o700)
+    (tmp_path / "link").symlink_to(target)
+    with pytest.raises(NotADirectoryError):
+        private_directory(str(tmp_path / "link"))
+
+
+def test_atomic_write_replaces_the_file_when_complete(tmp_path):
+    path = str(tmp_path / "entry")
+    with atomic_write(path, "w") as f:
+        f.write("old")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, "w") as f:
+            f.write("partial")
+            raise RuntimeError("write failed")
+    assert os.listdir(tmp_path) == ["entry"]
+    assert (tmp_path / "entry").read_text() == "old"
+
+
+def test_evict_removes_expired_and_oldest_files(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name, seconds in (("expired", 100), ("old", 30), ("sub/newer", 20), ("new", 10)):
+        (tmp_path / name).write_bytes(b"x" * 4)
+        age(tmp_path / name, seconds)
+    (tmp_path / "writing.tmp").write_bytes(b"x" * 100)
+    (tmp_path / "stale.tmp").write_bytes(b"x")
+    age(tmp_path / "stale.tmp", STALE_TMP_SECONDS + 1)
+
+    assert evict(str(tmp_path), max_bytes=8, ttl=60) == 1
+    remaining = {os.path.relpath(os.path.join(root, name), tmp_path) for root, _, files in os.walk(tmp_path) for name in files}
+    assert remaining == {os.path.join("sub", "newer"), "new", "writing.tmp"}
@@ -0,0 +1,71 @@
+import io
+
+from advanced_sheet_label.fetcher import CachingURLFetcher, FetcherConfig, LRUCache
+
+MEDIA_URL = "http://inventree.local/media/part_images/logo.png"
+
+
+class Fallback:
+    """
+    Fetcher counting its calls, returning the URL as file object.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, url: str, *args, **kwargs) -> dict:
+        self.calls.append(url)
+        return {"file_obj": io.BytesIO(url.encode()), "mime_type": "image/png", "redirected_url": url}
+
+
+def test_lru_cache_evicts_the_least_recently_used_entries():
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.put("a", "A", 4)
+    cache.put("b", "B", 4)
+    assert cache.get("a") == "A"
+    cache.put("c", "C", 4)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("A", None, "C")
+    assert cache.size == 8
+    cache.put("d", "D", 11)
+    assert cache.get("d") is None
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(max_bytes=10, ttl=-1)
+    cache.put("a", "A", 1)
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_fetcher_caches_resources_in_memory():
+    fallback = Fallback()
+    fetcher = CachingURLFetcher(FetcherConfig(max_bytes=1024, ttl=60), fallback)
+    first = fetcher(MEDIA_URL)
+    second = fetcher(MEDIA_URL)
+
+    assert first == second == {"string": MEDIA_URL.encode(), "mime_type": "image/png", "redirected_url": MEDIA_URL}
+    assert first is not second
+    assert fallback.calls == [MEDIA_URL]
+    assert fetcher.stats() == {"hits": 1, "misses": 1, "disk_hits": 0, "cached_bytes": len(MEDIA_URL)}
+
+
+def test_fetcher_passes_other_schemes_on():
+    fallback = Fallback()
+    fetcher = CachingURLFetcher(FetcherConfig(max_bytes=1024, ttl=60), fallback)
+    fetcher("adv-sheet-asset:123")
+    fetcher("adv-sheet-asset:123")
+    assert fallback.calls == ["adv-sheet-asset:123"] * 2
+
+
+def test_fetcher_shares_media_files_on_disk(tmp_path):
+    config = FetcherConfig(max_bytes=1024, ttl=60, disk_dir=str(tmp_path), disk_url_prefixes=("/media/",))
+    fallback = Fallback()
+    CachingURLFetcher(config, fallback)(MEDIA_URL)
+    CachingURLFetcher(config, fallback)("http://inventree.local/api/other.png")
+
+    # e.g. another process
+    fetcher = CachingURLFetcher(config, fallback)
+    assert fetcher(MEDIA_URL)["string"] == MEDIA_URL.encode()
+    fetcher("http://inventree.local/api/other.png")
+    assert fallback.calls == [MEDIA_URL] + ["http://inventree.local/api/other.png"] * 2
+    assert fetcher.stats()["disk_hits"] == 1
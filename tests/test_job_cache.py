@@ -0,0 +1,111 @@
+import os
+import stat
+import time
+
+from advanced_sheet_label.job_cache import JobResultCache, job_fingerprint
+
+
+class Meta:
+    label = "part.part"
+
+
+class Model:
+    _meta = Meta()
+
+    def __init__(self, pk: int, updated: str = "2024-01-01"):
+        self.pk = pk
+        self.updated = updated
+        self.metadata = {}
+        self.width = 50
+        self.height = 30
+
+
+def test_job_fingerprint_changes_with_every_input():
+    label, items = Model(1), [Model(1), Model(2)]
+    options = {"count": 1, "skip": 0}
+    settings = {"engine": "html", "markup": "table"}
+    fingerprint = job_fingerprint(label, items, options, settings)
+
+    assert job_fingerprint(label, items, dict(options), dict(settings)) == fingerprint
+    assert job_fingerprint(Model(1, "2024-02-01"), items, options, settings) != fingerprint
+    assert job_fingerprint(label, items[::-1], options, settings) != fingerprint
+    assert job_fingerprint(label, [Model(1), Model(2, "2024-02-01")], options, settings) != fingerprint
+    assert job_fingerprint(label, items, {**options, "skip": 1}, settings) != fingerprint
+    assert job_fingerprint(label, items, options, {**settings, "markup": "flat"}) != fingerprint
+
+
+def test_job_result_cache(tmp_path):
+    directory = str(tmp_path / "jobs")
+    cache = JobResultCache(directory, max_bytes=10, ttl=60)
+    assert cache.get("a") is None
+    cache.put("a", b"12345")
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert cache.get("a") == b"12345"
+
+    # the oldest entries are removed when the size exceeds the limit
+    os.utime(os.path.join(directory, "a.pdf"), (time.time() - 10, time.time() - 10))
+    cache.put("b", b"123456")
+    assert cache.get("a") is None
+    assert cache.get("b") == b"123456"
+    # larger than the whole cache
+    cache.put("c", b"x" * 11)
+    assert cache.get("c") is None
+    assert cache.stats() == {"hits": 2, "misses": 3}
+
+
+def test_job_result_cache_copies_files(tmp_path):
+    source = tmp_path / "job.pdf"
+    source.write_bytes(b"%PDF")
+    cache = JobResultCache(str(tmp_path / "jobs"), max_bytes=100, ttl=60)
+    cache.put("a", str(source))
+    assert cache.get("a") == b"%PDF"
+    assert os.listdir(tmp_path / "jobs") == ["a.pdf"]
+
+
+def test_job_result_cache_is_shared_by_instances(tmp_path):
+    # e.g. a background worker and the web server
+    JobResultCache(str(tmp_path), max_bytes=100, ttl=60).put("a", b"pdf")
+    assert JobResultCache(str(tmp_path), max_bytes=100, ttl=60).get("a") == b"pdf"
+
+
+def test_job_result_cache_expires_entries(tmp_path):
+    cache = JobResultCache(str(tmp_path), max_bytes=100, ttl=60)
+    cache.put("a", b"pdf")
+    os.utime(os.path.join(str(tmp_path), "a.pdf"), (time.time() - 61, time.time() - 61))
+    assert cache.get("a") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "a.pdf"))
+
+
+def test_plugin_caches_share_the_cache_directory(plugin, tmp_path, monkeypatch):
+    from advanced_sheet_label.layouts import LAYOUTS
+    from stubs import StubTemplate
+
+    plugin.set_setting("CACHE_DIRECTORY", str(tmp_path / "cache"))
+    plugin.set_setting("JOB_CACHE", True)
+    plugin.set_setting("PREFETCH_RELATED", False)
+    monkeypatch.setattr(plugin, "_render_job", lambda *args: b"%PDF")
+    monkeypatch.setattr(plugin, "_commit_label_skip_counter", lambda counter, layout: None)
+
+    layout = LAYOUTS["4780"]
+    template = StubTemplate(1, layout.label_width, layout.label_height)
+    template.updated = "2024-01-01"
+    plugin._print_labels(template, [Model(pk) for pk in range(3)], None, printing_options={"sheet_layout": "4780"})
+
+    # the job is found by other processes, and profiles are only created when enabled
+    assert os.listdir(tmp_path / "cache") == ["jobs"]
+    assert len(os.listdir(tmp_path / "cache" / "jobs")) == 1
+    assert plugin._get_job_cache().directory == str(tmp_path / "cache" / "jobs")
+
+
+def test_plugin_disables_disk_caches_in_shared_directories(plugin, tmp_path):
+    if not hasattr(os, "getuid"):
+        return
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o755)
+    plugin.set_setting("CACHE_DIRECTORY", str(shared))
+    plugin.set_setting("JOB_CACHE", True)
+    plugin.set_setting("CELL_CACHE", "disk")
+    assert plugin._get_job_cache() is None
+    assert plugin._get_cell_store() is None
+    assert os.listdir(shared) == []
@@ -0,0 +1,60 @@
+import os
+import zipfile
+
+from advanced_sheet_label import printing_plugin
+from advanced_sheet_label.layouts import LAYOUTS
+from advanced_sheet_label.pdf_engine import PdfFile
+from stubs import StubItem, StubTemplate
+
+LAYOUT = LAYOUTS["4780"]    # 40 labels per sheet
+
+
+class StubOutput:
+    def save(self):
+        self.saved_file = self.output.read()
+
+
+def test_split_job_by_pages(plugin):
+    template = StubTemplate(1, LAYOUT.label_width, LAYOUT.label_height)
+    assert list(plugin._split_job(template, 5)) == [range(0, 5)]
+    plugin.set_setting("SPLIT_MAX_PAGES", 2)
+    assert list(plugin._split_job(template, 5)) == [range(0, 2), range(2, 4), range(4, 5)]
+    assert list(plugin._split_job(template, 0)) == [range(0, 0)]
+
+
+def test_split_job_by_the_recorded_page_size(plugin):
+    template = StubTemplate(1, LAYOUT.label_width, LAYOUT.label_height)
+    plugin.set_setting("SPLIT_MAX_SIZE", 1)
+    plugin._record_page_size(template, b"x" * 1024 * 1024, 4)     # 256 KiB per page
+    assert list(plugin._split_job(template, 10)) == [range(0, 4), range(4, 8), range(8, 10)]
+
+
+def test_split_job_returns_a_zip_of_the_parts(plugin, monkeypatch):
+    ranges = []
+
+    def render_job(label, items, request, layout, engine, options, progress, timings, page_range=None):
+        ranges.append(page_range)
+        return f"%PDF {page_range.start}-{page_range.stop}".encode()
+
+    monkeypatch.setattr(plugin, "_render_job", render_job)
+    monkeypatch.setattr(plugin, "_commit_label_skip_counter", lambda counter, layout: None)
+    plugin.set_setting("SPLIT_MAX_PAGES", 2)
+    template = StubTemplate(1, LAYOUT.label_width, LAYOUT.label_height)
+
+    result = plugin._print_labels(
+        template, [StubItem(pk) for pk in range(100)], None, printing_options={"sheet_layout": "4780"}
+    )
+
+    assert ranges == [range(0, 2), range(2, 3)]
+    assert isinstance(result, PdfFile) and result.filename == "labels.zip"
+    with zipfile.ZipFile(result.path) as archive:
+        assert archive.namelist() == ["labels-1.pdf", "labels-2.pdf"]
+        assert archive.read("labels-2.pdf") == b"%PDF 2-3"
+
+    output = StubOutput()
+    printing_plugin.store_output(output, result, printing_plugin.JobTimings())
+    assert output.output.name == "labels.zip"
+    assert output.saved_file.startswith(b"PK")
+    assert output.complete and output.progress == 100
+    # the temporary file is deleted once it has been stored
+    assert not os.path.exists(result.path)
@@ -0,0 +1,87 @@
+from advanced_sheet_label.layouts import LAYOUTS, PAPER_SIZES, LayoutIndex, SheetLayout, find_layout
+
+
+def make_layout(name: str, width: float, height: float, corner_radius: float = 0) -> SheetLayout:
+    return SheetLayout(
+        display_name=name,
+        page_size=PAPER_SIZES["A4"],
+        label_width=width,
+        label_height=height,
+        columns=2,
+        rows=2,
+        column_spacing=0,
+        row_spacing=0,
+        corner_radius=corner_radius
+    )
+
+
+def test_corner_preference_only_picks_exact_matches():
+    # the layouts after the first exact match must not count as exact matches
+    layouts = {
+        "sharp": make_layout("sharp", 50, 30),
+        "round-larger": make_layout("round-larger", 60, 40, corner_radius=2),
+    }
+    index = LayoutIndex(layouts)
+    assert index.find(50, 30, prefer_round=True) == (layouts["sharp"], True)
+
+
+def test_corner_preference_between_exact_matches():
+    layouts = {
+        "sharp": make_layout("sharp", 50, 30),
+        "round": make_layout("round", 50, 30, corner_radius=2),
+    }
+    index = LayoutIndex(layouts)
+    assert index.find(50, 30, prefer_round=True) == (layouts["round"], True)
+    assert index.find(50, 30, prefer_round=False) == (layouts["sharp"], True)
+
+
+def test_exact_match_within_tolerance():
+    layouts = {"a": make_layout("a", 63.5, 29.6)}
+    index = LayoutIndex(layouts)
+    assert index.find(63.5 + 0.005, 29.6 - 0.005, prefer_round=False) == (layouts["a"], True)
+
+
+def test_closest_match_is_the_smallest_fitting_layout():
+    layouts = {
+        "small": make_layout("small", 40, 20),
+        "large": make_layout("large", 100, 100),
+        "medium": make_layout("medium", 55, 35),
+    }
+    index = LayoutIndex(layouts)
+    assert index.find(50, 30, prefer_round=False) == (layouts["medium"], False)
+    # nothing is large enough, the first layout is used
+    assert index.find(500, 500, prefer_round=False) == (layouts["small"], False)
+
+
+def test_closest_match_agrees_with_a_full_scan():
+    index = LayoutIndex(LAYOUTS)
+    for width in range(10, 120, 7):
+        for height in range(10, 120, 9):
+            fitting = [
+                layout for layout in LAYOUTS.values()
+                if layout.label_width >= width and layout.label_height >= height
+            ]
+            expected = min(
+                fitting,
+                key=lambda layout: ((layout.label_width - width) ** 2 + (layout.label_height - height) ** 2) ** 0.5,
+                default=next(iter(LAYOUTS.values()))
+            )
+            assert index.closest_match(width, height) == expected
+
+
+def test_find_layout_prefers_the_metadata_layout():
+    key, layout = next(iter(LAYOUTS.items()))
+    assert find_layout(layout.label_width, layout.label_height, key, False) == (layout, True, True)
+    assert find_layout(1, 1, key, False) == (layout, True, False)
+
+
+def test_find_layout_memo_is_invalidated_when_the_layouts_change():
+    layout = make_layout("test-only", 12.3, 45.6)
+    assert find_layout(12.3, 45.6, None, False)[2] is False
+    LAYOUTS["test-only"] = layout
+    try:
+        assert find_layout(12.3, 45.6, None, False) == (layout, False, True)
+    finally:
+        del LAYOUTS["test-only"]
+    assert find_layout(12.3, 45.6, None, False)[0] != layout
+
@@ -0,0 +1,83 @@
+import re
+
+from advanced_sheet_label.layouts import LAYOUTS, compile_layout
+from advanced_sheet_label.rendering import SKIP_CELL_HTML
+from stubs import StubItem, StubTemplate
+
+LAYOUT = LAYOUTS["4737"]    # 3 columns x 9 rows
+TEMPLATE = StubTemplate(1, LAYOUT.label_width, LAYOUT.label_height)
+
+
+def test_table_page_places_the_cells_in_grid_order(plugin):
+    items = [None, StubItem(1), StubItem(2), StubItem(3)]
+    html = plugin.print_page(TEMPLATE, items, None, LAYOUT)
+
+    assert html.startswith("<table class='label-sheet-table'>") and html.endswith("</table>")
+    assert html.count("<tr class='label-sheet-row'>") == LAYOUT.rows
+    cells = re.findall(r"<td class='label-sheet-cell label-sheet-row-(\d) label-sheet-col-(\d)'>(.*?)</td>", html)
+    assert [(int(row), int(col)) for row, col, _ in cells] == [(0, 0), (0, 1), (0, 2), (1, 0)]
+    assert cells[0][2].startswith(SKIP_CELL_HTML)
+    assert [content.count("Item ") for _, _, content in cells] == [0, 1, 1, 1]
+    assert all(content.endswith("<div class='label-sheet-cell-overlay'></div>") for _, _, content in cells)
+
+
+def test_table_page_renders_repeated_items_once(plugin):
+    calls = []
+    item = StubItem(1)
+    plugin._render_label = lambda label, item, request: calls.append(item) or "label"
+    html = plugin.print_page(TEMPLATE, [item] * 5, None, LAYOUT)
+    assert html.count("label<div") == 5
+    assert calls == [item]
+
+
+def test_wrap_pages_adds_the_layout_stylesheet_and_head_styles(plugin):
+    html = plugin.wrap_pages(["<table>1</table>", "<table>2</table>"], False, "unset", LAYOUT, ["<style>.a {}</style>"])
+    head, body = html.split("<body>")
+
+    assert f"size: {LAYOUT.page_size.width}mm {LAYOUT.page_size.height}mm;" in head
+    assert ".label-sheet-table {" in head and ".label-sheet-row-8 {" in head
+    assert "background-color: unset" not in head and "0.25mm solid" not in head
+    assert head.index("<style>.a {}</style>") > head.index("</style>")
+    assert body.index("<table>1</table>") < body.index("<table>2</table>")
+
+
+def test_stylesheet_applies_the_debug_options():
+    css = compile_layout(LAYOUT).stylesheet(True, "#eee")
+    assert "border: 0.25mm solid #000;" in css
+    assert "background-color: #eee;" in css
+    assert compile_layout(LAYOUT).stylesheet(True, "#eee") is css
+
+
+def test_compiled_geometry_matches_the_layout():
+    compiled = compile_layout(LAYOUT)
+    assert compiled.row_tops == tuple(LAYOUT.row_position_top(row) for row in range(LAYOUT.rows))
+    assert compiled.column_lefts == tuple(LAYOUT.column_position_left(col) for col in range(LAYOUT.columns))
+    assert len(compiled.cell_open_tags) == LAYOUT.cells
+
+
+def test_flat_page_positions_the_cells_and_leaves_out_hidden_skipped_cells(plugin):
+    items = [None, StubItem(1), None, StubItem(2)]
+    html = plugin.print_page(TEMPLATE, items, None, LAYOUT, markup="flat")
+
+    assert html.startswith("<div class='label-sheet-page'>") and html.endswith("</div>")
+    positions = re.findall(r"style='top: ([\d.]+)mm; left: ([\d.]+)mm;'", html)
+    assert positions == [
+        (str(LAYOUT.row_position_top(0)), str(LAYOUT.column_position_left(1))),
+        (str(LAYOUT.row_position_top(1)), str(LAYOUT.column_position_left(0))),
+    ]
+    # without a border, the cells have no overlay
+    assert SKIP_CELL_HTML not in html and "label-sheet-cell-overlay" not in html
+
+
+def test_flat_page_shows_skipped_cells_with_border_or_fill_color(plugin):
+    items = [None, StubItem(1)]
+    bordered = plugin.print_page(TEMPLATE, items, None, LAYOUT, markup="flat", enable_border=True)
+    assert bordered.count("<div class='label-sheet-cell-overlay'></div>") == 2
+    filled = plugin.print_page(TEMPLATE, items, None, LAYOUT, markup="flat", fill_color="#eee")
+    assert filled.count("class='label-sheet-cell'") == 2 and "label-sheet-cell-overlay" not in filled
+
+
+def test_wrap_pages_uses_the_stylesheet_of_the_markup(plugin):
+    html = plugin.wrap_pages(["<div class='label-sheet-page'></div>"], False, "", LAYOUT, markup="flat")
+    head = html.split("<body>")[0]
+    assert ".label-sheet-page {" in head and ".label-sheet-table {" not in head
@@ -0,0 +1,95 @@
+import io
+
+import pytest
+
+from advanced_sheet_label import printing_plugin
+from advanced_sheet_label.layouts import LAYOUTS
+from advanced_sheet_label.pdf_compose import BORDER_WIDTH, PT_PER_MM, SheetComposer, rounded_rect_path
+from advanced_sheet_label.pdf_engine import PageCountMismatch
+from stubs import StubItem, StubTemplate
+
+pypdf = pytest.importorskip("pypdf")
+
+LAYOUT = LAYOUTS["4780"]    # 4 columns x 10 rows, sharp corners
+
+
+def blank_pdf(width: float, height: float) -> bytes:
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(width, height)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def test_rounded_rect_path():
+    assert rounded_rect_path(1, 2, 30, 40, 0) == "1 2 30 40 re\n"
+    ops = rounded_rect_path(0, 0, 10, 4, 5).splitlines()
+    # the radius is limited to half the smaller side
+    assert ops[0] == "2 0 m" and ops[1] == "8 0 l"
+    assert ops[-2].endswith(" 2 0 c") and ops[-1] == "h"
+
+
+def test_cell_origin_is_the_bottom_left_corner_in_pdf_coordinates():
+    composer = SheetComposer(LAYOUT, False, "")
+    assert composer._cell_origin(0) == pytest.approx((
+        LAYOUT.column_position_left(0) * PT_PER_MM,
+        (LAYOUT.page_size.height - LAYOUT.row_position_top(0) - LAYOUT.label_height) * PT_PER_MM
+    ))
+    assert composer._cell_origin(LAYOUT.cells - 1) == pytest.approx((
+        LAYOUT.column_position_left(LAYOUT.columns - 1) * PT_PER_MM,
+        (LAYOUT.page_size.height - LAYOUT.row_position_top(LAYOUT.rows - 1) - LAYOUT.label_height) * PT_PER_MM
+    ))
+
+
+def test_sheet_places_stamps_and_insets_the_border():
+    composer = SheetComposer(LAYOUT, True, "")
+    label_height = LAYOUT.label_height * PT_PER_MM - 10     # shorter than the cell
+    assert composer.add_stamps(blank_pdf(LAYOUT.label_width * PT_PER_MM, label_height)) == [0]
+    composer.add_sheet([None, 0])
+
+    page = pypdf.PdfReader(io.BytesIO(composer.write())).pages[0]
+    ops = page.get_contents().get_data().decode().splitlines()
+    x, y = composer._cell_origin(1)
+    inset = BORDER_WIDTH * PT_PER_MM / 2
+    # the top of the label is aligned with the top of the cell
+    placement, = [op.split() for op in ops if op.endswith("/L0 Do Q")]
+    assert [float(value) for value in placement[4:6]] == pytest.approx([x, y + 10], abs=1e-3)
+    borders = [op for op in ops if op.endswith(" re")]
+    assert len(borders) == 2    # the skipped cell has a border as well
+    bx, by, bw, bh = (float(value) for value in borders[1].split()[:4])
+    assert (bx, by) == pytest.approx((x + inset, y + inset), abs=1e-3)
+    assert (bw, bh) == pytest.approx((composer.cell_width - 2 * inset, composer.cell_height - 2 * inset), abs=1e-3)
+    assert list(page["/Resources"]["/XObject"]) == ["/L0"]
+
+
+def test_stamp_overflow_falls_back_to_the_html_engine_reusing_the_cells(plugin, monkeypatch):
+    def stamp(*args):
+        raise PageCountMismatch("Expected 2 pages, got 3")
+
+    rendered = []
+
+    def render_label(label, item, request):
+        rendered.append(item.pk)
+        if item.pk == 0:
+            raise KeyError("part")
+        return f"<b>{item.pk}</b>"
+
+    documents = []
+    monkeypatch.setattr(printing_plugin, "render_stamped_pdf", stamp)
+    monkeypatch.setattr(printing_plugin, "render_pdf_parallel", lambda pages, wrap, *args, **kwargs: documents.append(
+        wrap(pages)) or b"%PDF")
+    monkeypatch.setattr(printing_plugin, "get_pypdf", lambda: pypdf)
+    monkeypatch.setattr(plugin, "_commit_label_skip_counter", lambda counter, layout: None)
+    plugin._render_label = render_label
+
+    timings = printing_plugin.JobTimings()
+    template = StubTemplate(1, LAYOUT.label_width, LAYOUT.label_height)
+    pdf = plugin._print_labels(
+        template, [StubItem(pk) for pk in range(3)], None, timings=timings,
+        printing_options={"count": 2, "skip": 0, "sheet_layout": "4780", "backend": "stamp"}
+    )
+
+    assert pdf == b"%PDF"
+    assert sorted(rendered) == [0, 1, 2]
+    assert "<b>2</b>" in documents[0]
+    assert timings.phases["cells"]["failed"] == 1
@@ -0,0 +1,203 @@
+import io
+import sys
+import tracemalloc
+
+import pytest
+
+from advanced_sheet_label import pdf_engine
+from advanced_sheet_label.instrumentation import JobTimings
+from advanced_sheet_label.pdf_engine import (
+    IncrementalPdfWriter, PageCountMismatch, PdfOptions, merge_pdfs, render_options, render_pdf_streamed,
+    reorder_pdf, write_pdf, write_pdf_options
+)
+from stubs import FakeWeasyPrint
+
+pypdf = pytest.importorskip("pypdf")
+
+
+def make_pdf(*widths: int) -> bytes:
+    writer = pypdf.PdfWriter()
+    for width in widths:
+        writer.add_blank_page(width, 100)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def page_widths(pdf: bytes) -> list[int]:
+    return [int(page.mediabox.width) for page in pypdf.PdfReader(io.BytesIO(pdf)).pages]
+
+
+def test_merge_pdfs_keeps_the_page_order():
+    assert page_widths(merge_pdfs([make_pdf(10, 20), make_pdf(30)])) == [10, 20, 30]
+
+
+def test_reorder_pdf_repeats_pages():
+    assert page_widths(reorder_pdf(make_pdf(10, 20), [1, 0, 0, 1])) == [20, 10, 10, 20]
+
+
+def test_reorder_pdf_checks_the_page_count():
+    with pytest.raises(PageCountMismatch):
+        reorder_pdf(make_pdf(10, 20, 30), [0, 1])
+
+
+@pytest.mark.parametrize("version, render_kwargs, write_kwargs", [
+    ("52.5", {}, {}),
+    ("58.1", {"optimize_size": ("images",)}, {"variant": "pdf/a-3b"}),
+    ("62.3", {}, {
+        "full_fonts": True, "uncompressed_pdf": False, "optimize_images": True, "dpi": 300,
+        "pdf_variant": "pdf/a-3b"
+    }),
+])
+def test_options_for_the_installed_weasyprint_version(monkeypatch, version, render_kwargs, write_kwargs):
+    monkeypatch.setitem(sys.modules, "weasyprint", FakeWeasyPrint(version))
+    options = PdfOptions(subset_fonts=False, image_dpi=300, pdf_variant="pdf/a-3b")
+    assert render_options(options) == render_kwargs
+    assert write_pdf_options(options) == write_kwargs
+
+
+class SizedDocument:
+    """
+    Document whose PDF is larger with full fonts, like a real one.
+    """
+
+    def __init__(self, pages: int):
+        self.pages = [None] * pages
+        self.writes = []
+
+    def copy(self, pages):
+        return SizedDocument(len(pages))
+
+    def write_pdf(self, full_fonts: bool = False, **kwargs):
+        self.writes.append(full_fonts)
+        return b"x" * len(self.pages) * (1000 if full_fonts else 400)
+
+
+def test_write_pdf_estimates_the_savings_once(monkeypatch):
+    monkeypatch.setitem(sys.modules, "weasyprint", FakeWeasyPrint("62.3"))
+    monkeypatch.setattr(pdf_engine, "_measured_ratios", {})
+    subset = PdfOptions(subset_fonts=True)
+
+    # the defaults subset the fonts, so there is nothing to estimate
+    timings = JobTimings()
+    write_pdf(SizedDocument(3), subset, timings)
+    assert "saved_bytes" not in timings.phases["write_pdf"]
+    assert pdf_engine._measured_ratios == {}
+
+    full_fonts = PdfOptions(subset_fonts=False)
+    for pages in (3, 5):
+        timings = JobTimings()
+        document = SizedDocument(pages)
+        assert len(write_pdf(document, full_fonts, timings)) == pages * 1000
+        assert timings.phases["write_pdf"]["saved_bytes"] == -pages * 600
+        # the job itself is written once
+        assert document.writes == [True]
+    assert list(pdf_engine._measured_ratios) == [full_fonts]
+
+
+def make_linked_pdf(tag: str, pages: int, payload: int = 0) -> bytes:
+    """
+    PDF with a content stream per page, an image shared by all pages and a link
+    on the first page to the last one.
+    """
+    from pypdf.annotations import Link
+    from pypdf.generic import NameObject, StreamObject
+
+    writer = pypdf.PdfWriter()
+    image = StreamObject()
+    image.set_data(b"logo" * 100)
+    image_reference = writer._add_object(image)
+    for idx in range(pages):
+        page = writer.add_blank_page(100 + idx, 100)
+        contents = StreamObject()
+        contents.set_data(f"% {tag}-{idx}\n".encode() + bytes(payload))
+        page[NameObject("/Contents")] = writer._add_object(contents)
+        page[NameObject("/Resources")] = pypdf.generic.DictionaryObject({
+            NameObject("/XObject"): pypdf.generic.DictionaryObject({NameObject("/Logo"): image_reference})
+        })
+    writer.add_annotation(0, Link(rect=(0, 0, 10, 10), target_page_index=pages - 1))
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def test_incremental_writer_appends_the_pages(tmp_path):
+    path = tmp_path / "merged.pdf"
+    with open(path, "wb") as f:
+        writer = IncrementalPdfWriter(f)
+        writer.add(make_linked_pdf("a", 2))
+        writer.add(make_linked_pdf("b", 3))
+        writer.finish()
+    assert writer.pages == 5
+
+    reader = pypdf.PdfReader(path, strict=True)
+    assert [int(page.mediabox.width) for page in reader.pages] == [100, 101, 100, 101, 102]
+    assert [page.get_contents().get_data().split()[1] for page in reader.pages] == [
+        b"a-0", b"a-1", b"b-0", b"b-1", b"b-2"
+    ]
+    # links point to the pages of their own document
+    link = reader.pages[2]["/Annots"][0].get_object()
+    assert link["/Dest"][0] == reader.pages[4].indirect_reference
+    assert link.raw_get("/P") == reader.pages[2].indirect_reference
+    # the image of both documents is stored once
+    images = {page["/Resources"]["/XObject"].raw_get("/Logo").idnum for page in reader.pages}
+    assert len(images) == 1
+
+
+def test_streamed_pdf_memory_does_not_grow_with_the_batches(monkeypatch):
+    parts = [make_linked_pdf(str(idx), 5, payload=100_000) for idx in range(3)]
+    monkeypatch.setattr(pdf_engine, "render_pdf", lambda html_data, options, timings=None: parts[int(html_data) % 3])
+
+    def peak(batches: int) -> int:
+        tracemalloc.start()
+        try:
+            pdf = render_pdf_streamed(([idx] for idx in range(batches)), lambda batch: str(batch[0]))
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            assert len(pypdf.PdfReader(pdf.path).pages) == batches * 5
+            pdf.delete()
+
+    # the batches add up to 10 MB
+    assert peak(20) < 2 * peak(4)
+
+
+def test_render_pdf_streamed(weasyprint):
+    progress = []
+    timings = JobTimings()
+    pdf = render_pdf_streamed(
+        iter([["a", "b"], ["c"]]),
+        lambda batch: "".join(f"<div class='label-sheet-page'>{page}</div>" for page in batch),
+        progress=progress.append, timings=timings
+    )
+    try:
+        assert len(pypdf.PdfReader(pdf.path).pages) == 3
+    finally:
+        pdf.delete()
+    assert progress == [2, 3]
+    assert len(weasyprint.documents) == 2
+    assert timings.phases["compose"]["chunks"] == 2
+
+
+def test_plugin_streams_large_jobs_in_batches(plugin, weasyprint, monkeypatch):
+    from advanced_sheet_label.layouts import LAYOUTS
+    from advanced_sheet_label.pdf_engine import PdfFile
+    from stubs import StubItem, StubTemplate
+
+    monkeypatch.setattr(plugin, "_commit_label_skip_counter", lambda counter, layout: None)
+    plugin.set_setting("STREAM_OUTPUT", True)
+    plugin.set_setting("STREAM_BATCH_PAGES", 2)
+    layout = LAYOUTS["4780"]
+    template = StubTemplate(1, layout.label_width, layout.label_height)
+
+    pdf = plugin._print_labels(
+        template, [StubItem(pk) for pk in range(200)], None, printing_options={"sheet_layout": "4780"}
+    )
+    try:
+        assert isinstance(pdf, PdfFile)
+        assert len(pypdf.PdfReader(pdf.path).pages) == 5
+    finally:
+        pdf.delete()
+    # 5 pages in batches of 2, each with only the labels of its own pages
+    assert len(weasyprint.documents) == 3
+    assert [document.count("Item ") for document in weasyprint.documents] == [80, 80, 40]
@@ -0,0 +1,26 @@
+from advanced_sheet_label.planning import next_skip_count, page_count, plan_pages
+
+
+def test_plan_pages_repeats_items_after_skipped_positions():
+    pages = list(plan_pages(["a", "b"], 2, 3, 4))
+    assert pages == [[None, None, None, "a"], ["a", "b", "b"]]
+
+
+def test_plan_pages_without_positions():
+    assert list(plan_pages([], 1, 0, 4)) == []
+    assert list(plan_pages(["a"], 0, 0, 4)) == []
+
+
+def test_plan_pages_is_lazy():
+    def items():
+        yield "a"
+        raise AssertionError("read past the first page")
+
+    assert next(plan_pages(items(), 1, 3, 4)) == [None, None, None, "a"]
+
+
+def test_page_count_and_next_skip_count_match_the_plan():
+    for items, labels, skip, cells in [(0, 1, 0, 4), (5, 1, 0, 4), (5, 2, 3, 4), (8, 1, 0, 4), (1, 3, 39, 40)]:
+        pages = list(plan_pages(range(items), labels, skip, cells))
+        assert page_count(items, labels, skip, cells) == len(pages)
+        assert next_skip_count(items, labels, skip, cells) == (len(pages[-1]) % cells if pages else 0)
@@ -0,0 +1,82 @@
+from django.core.exceptions import FieldError
+
+from advanced_sheet_label.prefetch import PREFETCH_PLANS, PrefetchPlan, get_prefetch_plan, prefetch_items
+
+
+class QuerySet:
+    """
+    Manager and queryset of a model, recording the lookups on the model.
+    """
+
+    db = "default"
+
+    def __init__(self, model):
+        self.model = model
+
+    def filter(self, pk__in):
+        self.model.filtered = pk__in
+        return self
+
+    def select_related(self, *lookups):
+        self.model.selected = lookups
+        if "missing" in lookups:
+            raise FieldError("Invalid field name(s) given in select_related: 'missing'")
+        return self
+
+    def prefetch_related(self, *lookups):
+        self.model.prefetched = lookups
+        return self
+
+    def in_bulk(self):
+        return {pk: self.model(pk, loaded=True) for pk in self.model.filtered if pk in self.model.existing}
+
+
+class Meta:
+    label_lower = "part.part"
+
+
+class Part:
+    _meta = Meta()
+    existing = {1, 2}
+
+    def __init__(self, pk: int, loaded: bool = False):
+        self.pk = pk
+        self.loaded = loaded
+
+
+Part._default_manager = QuerySet(Part)
+
+
+def test_prefetch_plan_from_the_template_metadata():
+    assert get_prefetch_plan("part.part", {}) is PREFETCH_PLANS["part.part"]
+    assert get_prefetch_plan("company.company", {}) is None
+    assert get_prefetch_plan("part.part", {"prefetch": False}) is None
+    assert get_prefetch_plan("part.part", {"prefetch": "part"}) is None
+    assert get_prefetch_plan("part.part", {"prefetch": {"select_related": ["category"]}}) == PrefetchPlan(("category",))
+
+
+def test_lazy_queries_per_item_counts_every_traversed_relation():
+    plan = PrefetchPlan(select_related=("part", "part__category"), prefetch_related=("part__parameters__template",))
+    assert plan.lazy_queries_per_item == 4
+
+
+def test_prefetch_items_loads_every_item_once_in_order():
+    items = [Part(2), Part(1), Part(2), Part(3)]
+    loaded = prefetch_items(items, {})
+
+    assert Part.filtered == [2, 1, 3]
+    assert Part.selected == PREFETCH_PLANS["part.part"].select_related
+    assert Part.prefetched == PREFETCH_PLANS["part.part"].prefetch_related
+    assert [item.pk for item in loaded] == [2, 1, 2, 3]
+    assert loaded[0] is loaded[2] and loaded[0].loaded
+    # items which don't exist anymore are kept
+    assert loaded[3] is items[3]
+
+
+def test_prefetch_items_keeps_the_items_if_the_plan_is_invalid():
+    items = [Part(1)]
+    assert prefetch_items(items, {"prefetch": {"select_related": ["missing"]}}) is items
+    assert prefetch_items(items, {"prefetch": False}) is items
+    # mixed models are never prefetched
+    mixed = [Part(1), object()]
+    assert prefetch_items(mixed, {}) is mixed
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from django.core.exceptions import ValidationError
+
+from advanced_sheet_label import printing_plugin
+from advanced_sheet_label.layouts import LAYOUTS
+from stubs import StubItem, StubTemplate
+
+LAYOUT = LAYOUTS["4780"]    # 4 columns x 10 rows
+
+
+class StubOutput:
+    def __init__(self):
+        self.saved = False
+
+    def save(self):
+        self.saved = True
+
+
+def test_preflight_plans_without_rendering(plugin, monkeypatch):
+    monkeypatch.setattr(plugin, "_render_job", None)    # any rendering fails
+    plugin.set_setting("LABEL_SKIP_COUNTER", 3)
+    template = StubTemplate(1, LAYOUT.label_width, LAYOUT.label_height)
+
+    plan = plugin.preflight(template, [StubItem(pk) for pk in range(25)], {
+        "count": 2, "skip": 5, "sheet_layout": "4780"
+    })
+
+    assert plan["layout"] == "4780"
+    assert plan["labels"] == 50
+    assert plan["pages"] == 2       # 5 skipped + 50 labels on sheets of 40
+    assert plan["free_positions_last_sheet"] == 25
+    assert plan["skip_counter"] == {"current": 3, "after_job": 15}
+    assert plan["parts"] == 1
+    assert plan["estimate"] is None     # no job printed yet
+    assert plugin.get_skip_counter() == 3
+    assert "50 labels on 2 sheets" in printing_plugin.preflight_message(plan)
+
+
+def test_preflight_raises_for_unknown_layouts(plugin):
+    template = StubTemplate(1, LAYOUT.label_width, LAYOUT.label_height)
+    with pytest.raises(ValidationError):
+        plugin.preflight(template, [StubItem(0)], {"sheet_layout": "no such layout"})
+
+
+def test_store_preflight_writes_the_plan_as_json_file():
+    plan = {
+        "labels": 1, "pages": 1, "layout_name": "4780", "free_positions_last_sheet": 39,
+        "skip_counter": {"current": 0, "after_job": 1}, "estimate": None,
+    }
+    output = StubOutput()       # like InvenTree 0.16, without metadata
+    printing_plugin.store_preflight(output, plan)
+
+    assert output.output.name == "preflight.json"
+    assert json.loads(output.output.read()) == plan
+    assert output.complete and output.progress == 100 and output.saved
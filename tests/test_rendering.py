@@ -0,0 +1,143 @@
+import contextlib
+import threading
+
+import pytest
+
+from advanced_sheet_label.rendering import (
+    ERROR_CELL_HTML, SKIP_CELL_HTML, CellRenderer, RenderAborted, RenderFailures
+)
+
+
+class Item:
+    def __init__(self, pk: int):
+        self.pk = pk
+
+
+def test_renderer_memoizes_by_item_identity():
+    calls = []
+
+    def render(item):
+        calls.append(item)
+        return f"<b>{item.pk}</b>"
+
+    renderer = CellRenderer(render)
+    a, b = Item(1), Item(1)
+    assert [renderer.render(item) for item in (a, a, None, b)] == ["<b>1</b>", "<b>1</b>", SKIP_CELL_HTML, "<b>1</b>"]
+    assert calls == [a, b]
+    assert (renderer.hits, renderer.misses) == (2, 2)
+
+    renderer.clear()
+    renderer.render(a)
+    assert calls == [a, b, a]
+
+
+def test_prerender_renders_every_distinct_item_once_in_the_thread_context():
+    local = threading.local()
+    local.language = "en"
+    seen = []
+
+    @contextlib.contextmanager
+    def language():
+        local.language = "de"
+        yield
+
+    def render(item):
+        seen.append((item.pk, getattr(local, "language", None), threading.current_thread()))
+        return str(item.pk)
+
+    items = [Item(pk) for pk in range(10)]
+    renderer = CellRenderer(render, thread_context=language)
+    renderer.prerender(items + items + [None], threads=4)
+
+    assert sorted((pk, language) for pk, language, _ in seen) == [(pk, "de") for pk in range(10)]
+    assert all(thread is not threading.current_thread() for _, _, thread in seen)
+    assert local.language == "en"
+    assert [renderer.render(item) for item in items] == [str(pk) for pk in range(10)]
+    assert len(seen) == 10
+
+
+def test_prerender_calls_the_cleanup_of_every_worker():
+    cleanups = []
+    renderer = CellRenderer(lambda item: "", thread_cleanup=lambda: cleanups.append(threading.current_thread()))
+    renderer.prerender([Item(pk) for pk in range(10)], threads=3)
+    assert len(cleanups) == 3
+    assert threading.current_thread() not in cleanups
+
+
+def test_prerender_without_threads_renders_lazily():
+    calls = []
+    renderer = CellRenderer(calls.append)
+    renderer.prerender([Item(1), Item(2)], threads=1)
+    assert calls == []
+
+
+def test_breaker_is_disabled_by_default():
+    failures = RenderFailures()
+    for _ in range(100):
+        failures.record(KeyError("part"))
+    assert not failures.open
+    assert failures.check() is False
+
+
+def test_breaker_aborts_at_the_threshold():
+    failures = RenderFailures(threshold=3)
+    failures.record(KeyError("part"))
+    failures.record(ValueError("other"))
+    failures.record(KeyError("part"))
+    with pytest.raises(RenderAborted) as exc_info:
+        failures.record(KeyError("part"))
+    assert "3x KeyError: 'part'" in str(exc_info.value)
+    with pytest.raises(RenderAborted):
+        failures.check()
+
+
+def test_breaker_only_counts_equal_failures():
+    failures = RenderFailures(threshold=2)
+    failures.record(KeyError("a"))
+    failures.record(KeyError("b"))
+    failures.record(ValueError("a"))
+    assert not failures.open
+    assert failures.summary() == "1x KeyError: 'a', 1x KeyError: 'b', 1x ValueError: a"
+
+
+def test_breaker_fills_the_remaining_cells():
+    rendered = []
+
+    def render(item):
+        rendered.append(item)
+        raise KeyError("part")
+
+    failures = RenderFailures(threshold=2, abort=False)
+    renderer = CellRenderer(render, failures=failures)
+    cells = [renderer.render(Item(pk)) for pk in range(5)]
+
+    assert cells == [ERROR_CELL_HTML] * 5
+    assert len(rendered) == 2
+    assert failures.open
+    assert failures.skipped == 3
+
+
+def test_broken_template_aborts_the_job_with_a_validation_error(plugin, weasyprint, monkeypatch):
+    from django.core.exceptions import ValidationError
+
+    from advanced_sheet_label.layouts import LAYOUTS
+    from stubs import StubItem, StubTemplate
+
+    def render_label(label, item, request):
+        raise KeyError("part")
+
+    commits = []
+    monkeypatch.setattr(plugin, "_render_label", render_label)
+    monkeypatch.setattr(plugin, "_commit_label_skip_counter", lambda counter, layout: commits.append(counter))
+    plugin.set_setting("RENDER_ERROR_THRESHOLD", 2)
+    layout = LAYOUTS["4780"]
+    template = StubTemplate(1, layout.label_width, layout.label_height)
+
+    with pytest.raises(ValidationError, match="KeyError"):
+        plugin._print_labels(template, [StubItem(pk) for pk in range(5)], None, printing_options={"sheet_layout": "4780"})
+    assert weasyprint.documents == [] and commits == []
+
+    plugin.set_setting("RENDER_ERROR_ACTION", "fill")
+    plugin._print_labels(template, [StubItem(pk) for pk in range(5)], None, printing_options={"sheet_layout": "4780"})
+    assert weasyprint.documents[0].count(ERROR_CELL_HTML) == 5
+    assert commits == [5]
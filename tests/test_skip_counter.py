@@ -0,0 +1,154 @@
+import contextlib
+import json
+import types
+
+import pytest
+from django.core.exceptions import ValidationError
+
+from advanced_sheet_label import printing_plugin, skip_counter
+from advanced_sheet_label.layouts import LAYOUTS
+from advanced_sheet_label.printing_plugin import AdvancedLabelSheetPlugin
+from advanced_sheet_label.skip_counter import (
+    GLOBAL_COUNTER_KEY, LAYOUT_COUNTERS_KEY, MAX_LAYOUT_COUNTERS, SCOPE_KEY, SkipCounters
+)
+from stubs import StubItem, StubTemplate
+
+
+class FakePlugin:
+    """
+    Plugin settings stored in a dict, which also stands in for the setting rows in the database.
+    """
+
+    def __init__(self, **values):
+        self.values = values
+        self.reads = []
+
+    def plugin_config(self):
+        return None
+
+    def get_setting(self, key: str):
+        self.reads.append(key)
+        return self.values.get(key)
+
+    def set_setting(self, key: str, value) -> None:
+        self.values[key] = value
+
+
+@pytest.fixture
+def plugin(monkeypatch):
+    plugin = FakePlugin()
+
+    def filter(key, **kwargs):
+        row = types.SimpleNamespace(value=plugin.values[key]) if key in plugin.values else None
+        return types.SimpleNamespace(first=lambda: row)
+
+    objects = types.SimpleNamespace(select_for_update=lambda: types.SimpleNamespace(filter=filter))
+    monkeypatch.setattr(skip_counter, "PluginSetting", types.SimpleNamespace(objects=objects))
+    monkeypatch.setattr(skip_counter, "transaction", types.SimpleNamespace(atomic=contextlib.nullcontext))
+    return plugin
+
+
+def test_global_counter(plugin):
+    counters = SkipCounters(plugin)
+    assert counters.get() == 0
+    counters.commit(7)
+    assert plugin.values[GLOBAL_COUNTER_KEY] == 7
+    assert counters.get() == 7
+
+
+def test_layout_counters_are_merged_with_the_stored_value(plugin):
+    counters = SkipCounters(plugin)
+    counters.commit(3, "4780")
+    # committed by another process meanwhile
+    plugin.values[LAYOUT_COUNTERS_KEY] = json.dumps({"4780": 3, "4737": 5})
+    counters.commit(9, "4780")
+
+    assert json.loads(plugin.values[LAYOUT_COUNTERS_KEY]) == {"4737": 5, "4780": 9}
+    assert (counters.get("4780"), counters.get("4737"), counters.get("other")) == (9, 5, 0)
+    assert counters.last_used_layout() == "4780"
+
+
+def test_layout_counters_are_bounded(plugin):
+    counters = SkipCounters(plugin)
+    for idx in range(MAX_LAYOUT_COUNTERS + 5):
+        counters.commit(idx, f"layout-{idx}")
+    stored = json.loads(plugin.values[LAYOUT_COUNTERS_KEY])
+    assert len(stored) == MAX_LAYOUT_COUNTERS
+    assert "layout-0" not in stored
+
+
+def test_cached_counters_are_read_again_after_the_ttl(plugin):
+    counters = SkipCounters(plugin, ttl=60)
+    assert counters.get() == 0
+    plugin.values[GLOBAL_COUNTER_KEY] = 4
+    assert counters.get() == 0
+    counters.invalidate()
+    assert counters.get() == 4
+
+
+def test_scope_is_cached_with_the_counters(plugin):
+    plugin.values[SCOPE_KEY] = "layout"
+    counters = SkipCounters(plugin, ttl=60)
+    assert counters.per_layout() and counters.per_layout()
+    assert plugin.reads == [SCOPE_KEY]
+    plugin.values[SCOPE_KEY] = "global"
+    counters.invalidate()
+    assert not counters.per_layout()
+
+
+def test_invalid_layout_counters_are_reset(plugin):
+    plugin.values[LAYOUT_COUNTERS_KEY] = "not json"
+    assert SkipCounters(plugin).get("4780") == 0
+
+
+@pytest.fixture
+def label_plugin(monkeypatch):
+    label_plugin = AdvancedLabelSheetPlugin()
+    commits = []
+    monkeypatch.setattr(label_plugin._skip_counters, "commit", lambda counter, layout_key=None: commits.append((counter, layout_key)))
+    monkeypatch.setattr(label_plugin, "_render_job", lambda *args: b"%PDF")
+    label_plugin.commits = commits
+    return label_plugin
+
+
+def print_job(plugin, items: int, **options):
+    layout = LAYOUTS["4737"]
+    template = StubTemplate(1, layout.label_width, layout.label_height)
+    options = {"count": 1, "skip": 0, "sheet_layout": "4737", **options}
+    return plugin._print_labels(template, [StubItem(pk) for pk in range(items)], None, printing_options=options)
+
+
+def test_job_commits_the_used_positions_of_the_last_page(label_plugin):
+    assert print_job(label_plugin, 5, count=2, skip=3) == b"%PDF"
+    assert label_plugin.commits == [((3 + 5 * 2) % 27, None)]
+
+
+def test_job_commits_the_counter_of_the_layout(label_plugin):
+    label_plugin.set_setting("SKIP_COUNTER_SCOPE", "layout")
+    print_job(label_plugin, 30)
+    assert label_plugin.commits == [(3, "4737")]
+
+
+def test_label_skip_counter_of_the_default_layout(label_plugin, monkeypatch):
+    values = {SCOPE_KEY: "layout", "DEFAULT_LAYOUT": "4737", LAYOUT_COUNTERS_KEY: json.dumps({"4737": 4, "4780": 2})}
+    reads = []
+    monkeypatch.setattr(label_plugin, "get_setting", lambda key: reads.append(key) or values[key])
+    assert label_plugin.label_skip_counter == 4
+    assert label_plugin.label_skip_counter == 4
+    assert sorted(reads) == sorted(values)     # each setting is read only once
+    values["DEFAULT_LAYOUT"] = "auto_round"
+    # saving the setting drops the cached value
+    printing_plugin._invalidate_skip_counters(None, types.SimpleNamespace(key="DEFAULT_LAYOUT"))
+    assert label_plugin.label_skip_counter == 2     # the most recently used layout
+
+
+def test_failed_job_does_not_commit(label_plugin, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("render failed")
+
+    monkeypatch.setattr(label_plugin, "_render_job", fail)
+    with pytest.raises(RuntimeError):
+        print_job(label_plugin, 5)
+    with pytest.raises(ValidationError):
+        print_job(label_plugin, 5, sheet_layout="does-not-exist")
+    assert label_plugin.commits == []